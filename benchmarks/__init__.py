@@ -0,0 +1,6 @@
+"""
+Benchmarks that upload synthetic images to a local fake imgbox server
+
+Run "python -m benchmarks -h" or "python -m benchmarks.memory -h" from the
+repository root for usage.
+"""
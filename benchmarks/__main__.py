@@ -0,0 +1,180 @@
+"""
+Upload synthetic images to a local fake imgbox server and report throughput
+
+Arguments after "--" are passed to imgbox, e.g.
+
+    python -m benchmarks --count 200 --latency 0.05 -- --jobs 4
+    python -m benchmarks --count 2000 --loop asyncio -- --jobs 64
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import httpx
+
+from imgbox import _loop, _main, _retry
+
+from . import server
+
+
+class _RedirectTransport(httpx.AsyncHTTPTransport):
+    # Send every request to the fake server instead of imgbox.com
+    def __init__(self, port, **kwargs):
+        super().__init__(**kwargs)
+        self._port = port
+
+    async def handle_async_request(self, request):
+        request.url = request.url.copy_with(scheme='http', host='127.0.0.1', port=self._port)
+        return await super().handle_async_request(request)
+
+
+def _make_files(directory, count, size):
+    # Return paths of `count` files with `size` random bytes each
+    filepaths = []
+    for i in range(count):
+        filepath = os.path.join(directory, f'{i:06d}.jpg')
+        with open(filepath, 'wb') as f:
+            f.write(os.urandom(size))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def _percentile(values, percent):
+    # Nearest-rank percentile
+    values = sorted(values)
+    if not values:
+        return None
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+def _peak_rss():
+    # Maximum resident set size of this process in bytes
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+async def _measure(port, filepaths, imgbox_args):
+    # Run imgbox and return exit code, number of seconds and upload latencies
+    latencies = []
+    retry_upload = _retry.Retry.upload
+
+    async def timed_upload(self, gallery, filepath):
+        start = time.monotonic()
+        try:
+            return await retry_upload(self, gallery, filepath)
+        finally:
+            latencies.append(time.monotonic() - start)
+
+    AsyncClient = httpx.AsyncClient
+
+    def new_client(*args, **kwargs):
+        # Each gallery closes its own connection pool
+        kwargs['transport'] = _RedirectTransport(port)
+        return AsyncClient(*args, **kwargs)
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch('pyimgbox._http.httpx.AsyncClient', new_client))
+        stack.enter_context(mock.patch('imgbox._retry.Retry.upload', timed_upload))
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        # Don't read file paths from stdin
+        stdin = stack.enter_context(open(os.devnull, 'r'))
+        stack.enter_context(mock.patch('sys.stdin', stdin))
+        start = time.monotonic()
+        exit_code = await _main.run([*imgbox_args, *filepaths])
+        duration = time.monotonic() - start
+    return exit_code, duration, latencies
+
+
+def _get_args(argv):
+    argparser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Upload synthetic images to a local fake imgbox server',
+        epilog='Arguments after "--" are passed to imgbox.',
+    )
+    argparser.add_argument('--count', default=100, type=int,
+                           help='Number of images (default: 100)')
+    argparser.add_argument('--size', default=256 * 1024, type=int,
+                           help='Size of each image in bytes (default: 262144)')
+    argparser.add_argument('--latency', default=0.0, type=float,
+                           help='Seconds before the server responds (default: 0)')
+    argparser.add_argument('--bandwidth', default=None, type=float,
+                           help='Bytes per second the server receives (default: unlimited)')
+    argparser.add_argument('--error-rate', default=0.0, type=float,
+                           help='Probability of "503 Service Unavailable" (default: 0)')
+    argparser.add_argument('--loop', default=None, choices=('asyncio', 'uvloop'),
+                           help='Event loop of imgbox (default: uvloop if it is installed)')
+    argparser.add_argument('--json', action='store_true',
+                           help='Print results as JSON object')
+    return argparser.parse_args(argv)
+
+
+def main(argv=sys.argv[1:]):
+    if '--' in argv:
+        imgbox_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    else:
+        imgbox_args = []
+    args = _get_args(argv)
+
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(
+        target=server.serve,
+        args=(child_connection,),
+        kwargs={'latency': args.latency, 'bandwidth': args.bandwidth,
+                'error_rate': args.error_rate},
+        daemon=True,
+    )
+    server_process.start()
+    try:
+        port = parent_connection.recv()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepaths = _make_files(tmpdir, args.count, args.size)
+            exit_code, duration, latencies = _loop.run(
+                _measure(port, filepaths, imgbox_args),
+                _loop.get_loop_factory(args.loop),
+            )
+    finally:
+        parent_connection.close()
+        server_process.join(timeout=5)
+
+    results = {
+        'exit_code': exit_code,
+        'files': args.count,
+        'bytes': args.count * args.size,
+        'seconds': duration,
+        'images_per_second': args.count / duration,
+        'mib_per_second': args.count * args.size / duration / 2**20,
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p95': _percentile(latencies, 95),
+        'latency_p99': _percentile(latencies, 99),
+        'peak_rss_mib': _peak_rss() / 2**20,
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(f'     Files: {results["files"]} ({results["bytes"] / 2**20:.1f} MiB)')
+        print(f'      Time: {results["seconds"]:.2f} s')
+        print(f'Throughput: {results["images_per_second"]:.1f} images/s, '
+              f'{results["mib_per_second"]:.2f} MiB/s')
+        if latencies:
+            print(f'   Latency: p50 {results["latency_p50"] * 1000:.1f} ms, '
+                  f'p95 {results["latency_p95"] * 1000:.1f} ms, '
+                  f'p99 {results["latency_p99"] * 1000:.1f} ms')
+        print(f'  Peak RSS: {results["peak_rss_mib"]:.1f} MiB')
+        print(f' Exit code: {exit_code}')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Upload the same synthetic image many times and report peak memory usage for
+each combination of number of files, image size and number of simultaneous
+uploads
+
+Each combination is uploaded by a new process that reads the file paths from
+stdin. Arguments after "--" are passed to imgbox, e.g.
+
+    python -m benchmarks.memory --counts 10000 100000 1000000 -- --json
+    python -m benchmarks.memory --counts 100 --sizes 1048576 10000000 --jobs 1 8 32
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from . import server
+from .__main__ import _peak_rss, _RedirectTransport
+
+
+def _write_paths(fd, filepath, count):
+    # Write `filepath` `count` times to file descriptor `fd` and close it
+    line = (filepath + '\n').encode('utf-8')
+    with open(fd, 'wb') as f:
+        for _ in range(count):
+            f.write(line)
+
+
+def _measure(port, count, size, jobs, loop, imgbox_args, connection):
+    # Upload `count` files of `size` bytes with `jobs` simultaneous uploads in
+    # this process and send exit code, number of seconds and peak RSS through
+    # `connection`
+    import httpx
+
+    from imgbox import _loop, _main
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'image.jpg')
+        with open(filepath, 'wb') as f:
+            f.write(os.urandom(size))
+
+        read_fd, write_fd = os.pipe()
+        writer = threading.Thread(target=_write_paths, args=(write_fd, filepath, count),
+                                  daemon=True)
+        writer.start()
+
+        AsyncClient = httpx.AsyncClient
+
+        def new_client(*args, **kwargs):
+            # Each gallery closes its own connection pool
+            kwargs['transport'] = _RedirectTransport(port)
+            return AsyncClient(*args, **kwargs)
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch('pyimgbox._http.httpx.AsyncClient', new_client))
+            stack.enter_context(mock.patch('sys.stdin', open(read_fd, 'r')))
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+            start = time.monotonic()
+            exit_code = _loop.run(_main.run(['--jobs', str(jobs), *imgbox_args]),
+                                  _loop.get_loop_factory(loop))
+            duration = time.monotonic() - start
+
+    connection.send((exit_code, duration, _peak_rss()))
+
+
+def _get_args(argv):
+    argparser = argparse.ArgumentParser(
+        prog='python -m benchmarks.memory',
+        description='Report peak memory usage of uploads to a local fake imgbox server',
+        epilog='Arguments after "--" are passed to imgbox.',
+    )
+    argparser.add_argument('--counts', nargs='+', default=[10000, 100000, 1000000], type=int,
+                           help='Numbers of files (default: 10000 100000 1000000)')
+    argparser.add_argument('--sizes', nargs='+', default=[1024], type=int,
+                           help='Sizes of the image in bytes (default: 1024)')
+    argparser.add_argument('--jobs', nargs='+', default=[1], type=int,
+                           help='Numbers of simultaneous uploads (default: 1)')
+    argparser.add_argument('--loop', default=None, choices=('asyncio', 'uvloop'),
+                           help='Event loop of imgbox (default: uvloop if it is installed)')
+    argparser.add_argument('--json', action='store_true',
+                           help='Print results as JSON array')
+    return argparser.parse_args(argv)
+
+
+def main(argv=sys.argv[1:]):
+    if '--' in argv:
+        imgbox_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    else:
+        imgbox_args = []
+    args = _get_args(argv)
+
+    # Measuring processes must not inherit memory from this one
+    context = multiprocessing.get_context('spawn')
+    parent_connection, child_connection = context.Pipe()
+    server_process = context.Process(target=server.serve, args=(child_connection,), daemon=True)
+    server_process.start()
+    results = []
+    try:
+        port = parent_connection.recv()
+        for count, size, jobs in itertools.product(args.counts, args.sizes, args.jobs):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_measure,
+                                      args=(port, count, size, jobs, args.loop, imgbox_args,
+                                            sender))
+            process.start()
+            exit_code, duration, peak_rss = receiver.recv()
+            process.join()
+            results.append({
+                'exit_code': exit_code,
+                'files': count,
+                'size': size,
+                'jobs': jobs,
+                'seconds': duration,
+                'images_per_second': count / duration,
+                'peak_rss_mib': peak_rss / 2**20,
+            })
+            if not args.json:
+                print(f'{count:>9} files of {size:>9} bytes, {jobs:>3} jobs: '
+                      f'{results[-1]["peak_rss_mib"]:6.1f} MiB peak RSS, '
+                      f'{duration:8.1f} s, exit code {exit_code}', flush=True)
+    finally:
+        parent_connection.close()
+        server_process.join(timeout=5)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    return max(r['exit_code'] for r in results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import logging  # isort:skip
+_log = logging.getLogger('benchmarks')
+
+_CHUNK_SIZE = 65536
+
+
+class FakeServer:
+    """
+    HTTP server that responds like imgbox.com to pyimgbox
+
+    latency: Number of seconds before each response is sent
+    bandwidth: Maximum number of request body bytes per second that are
+               received over all connections or None
+    error_rate: Probability between 0 and 1 that a POST request is answered
+                with "503 Service Unavailable"
+
+    Only the requests that are needed to create galleries and to upload images
+    are supported. Uploaded images are discarded.
+    """
+
+    def __init__(self, latency=0, bandwidth=None, error_rate=0):
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._error_rate = error_rate
+        self._ids = itertools.count(1)
+        self._receiving_until = 0
+        self._server = None
+
+    @property
+    def port(self):
+        """Port the server is listening on or None"""
+        if self._server is not None:
+            return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Listen on `host` and `port` (0 picks a random port)"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def close(self):
+        """Stop listening"""
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _throttle(self, size):
+        # Received bytes share the bandwidth like uploads share an uplink
+        if self._bandwidth:
+            now = time.monotonic()
+            self._receiving_until = max(now, self._receiving_until) + size / self._bandwidth
+            await asyncio.sleep(self._receiving_until - now)
+
+    async def _read_body(self, reader, headers):
+        # Read and discard the request body
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await self._read_bytes(reader, size)
+                await reader.readline()
+                if size == 0:
+                    break
+        else:
+            await self._read_bytes(reader, int(headers.get('content-length', 0)))
+
+    async def _read_bytes(self, reader, size):
+        while size > 0:
+            chunk = await reader.read(min(size, _CHUNK_SIZE))
+            if not chunk:
+                raise ConnectionError('Connection closed')
+            size -= len(chunk)
+            await self._throttle(len(chunk))
+
+    def _respond(self, method, path):
+        # Return status and body
+        if method == 'GET' and path == '/':
+            return 200, '<html><head><meta content="csrf" name="csrf-token" /></head></html>'
+
+        elif method == 'POST' and random.random() < self._error_rate:
+            return 503, ''
+
+        elif method == 'POST' and path == '/ajax/token/generate':
+            id = next(self._ids)
+            return 200, json.dumps({
+                'token_id': id, 'token_secret': 'secret',
+                'gallery_id': f'g{id}', 'gallery_secret': 'secret',
+            })
+
+        elif method == 'POST' and path == '/upload/process':
+            id = next(self._ids)
+            return 200, json.dumps({'files': [{
+                'original_url': f'https://images.imgbox.com/{id}_o.jpg',
+                'thumbnail_url': f'https://thumbs.imgbox.com/{id}_t.jpg',
+                'url': f'https://imgbox.com/{id}',
+            }]})
+
+        else:
+            return 404, 'Not found'
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip().lower()
+                await self._read_body(reader, headers)
+
+                if self._latency:
+                    await asyncio.sleep(self._latency)
+                status, body = self._respond(method, path)
+                body = body.encode('utf-8')
+                writer.write(
+                    f'HTTP/1.1 {status} Fake\r\n'
+                    f'Content-Length: {len(body)}\r\n'
+                    'Content-Type: text/html\r\n'
+                    '\r\n'.encode('latin-1')
+                    + body
+                )
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            _log.debug('Closing connection: %r', e)
+        finally:
+            writer.close()
+
+
+def serve(connection, **kwargs):
+    """
+    Run :class:`FakeServer` until `connection` is closed
+
+    connection: :class:`multiprocessing.connection.Connection` that receives
+                the server's port
+
+    All other keyword arguments are passed to :class:`FakeServer`.
+
+    This is meant to run in a separate process so that the server doesn't
+    affect the measurements of the client.
+    """
+    async def run():
+        server = FakeServer(**kwargs)
+        await server.start()
+        connection.send(server.port)
+        loop = asyncio.get_running_loop()
+        # Any message or closing the connection stops the server
+        await loop.run_in_executor(None, _wait_for_eof, connection)
+        await server.close()
+
+    asyncio.run(run())
+
+
+def _wait_for_eof(connection):
+    try:
+        connection.recv()
+    except EOFError:
+        pass
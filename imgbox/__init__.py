@@ -4,3 +4,5 @@ __author_email__ = 'plotski@example.org'
 __command_name__ = 'imgbox'
 __homepage_url__ = 'https://github.com/plotski/imgbox-cli'
 __bugtracker_url__ = 'https://github.com/plotski/imgbox-cli/issues'
+
+from ._api import upload  # noqa: F401
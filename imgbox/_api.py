@@ -0,0 +1,125 @@
+# Public API that is exported by the package. pyimgbox and httpx are only
+# imported when an upload starts so that importing imgbox stays cheap.
+
+
+async def upload(filepaths, *, gallery=None, title=None, thumb_width=100,
+                 square_thumbs=False, comments=False, adult=False, jobs=1,
+                 order='input', schedule='input', max_per_gallery=1000, attempts=3,
+                 timeout=None, stall_timeout=None, deadline=None, limit_rate=None,
+                 fit=False, optimize=False, cache_path=None):
+    """
+    Upload image files to imgbox.com
+
+    filepaths: Iterable or asynchronous iterable of paths to image files
+    gallery: :class:`pyimgbox.Gallery` instance to upload to or None to create
+             a new gallery with `title`, `thumb_width`, `square_thumbs`,
+             `comments` and `adult`
+    title: Gallery title or None
+    thumb_width: Thumbnail width in pixels
+    square_thumbs: Whether thumbnails are square
+    comments: Whether comments are enabled
+    adult: Whether the gallery is adult-only
+    jobs: Maximum number of simultaneous uploads
+    order: "input" to yield results in the same order as `filepaths` or
+           "completion" to yield them as soon as they are finished
+    schedule: "input" to upload files in the same order as `filepaths`,
+              "smallest-first" to get the first results sooner or
+              "largest-first" to finish sooner if `jobs` is greater than 1
+    max_per_gallery: Maximum number of files in one gallery or None; the
+                     following files are uploaded to a new gallery with the
+                     same settings
+    attempts: Maximum number of attempts to create a gallery or to upload a
+              file if the connection fails or the server has a temporary
+              problem
+    timeout: Maximum number of seconds for each attempt or None
+    stall_timeout: Maximum number of seconds an attempt may go without sending
+                   or receiving anything before it is repeated or None
+    deadline: Maximum number of seconds for all uploads or None
+    limit_rate: Maximum number of bytes per second of all uploads of this call
+                or None
+    fit: Whether to downscale or recompress images that are too large instead
+         of refusing to upload them (requires Pillow)
+    optimize: Whether to optimize images without losing quality and remove
+              their metadata before uploading (requires Pillow)
+    cache_path: Path to SQLite database that remembers uploaded files so they
+                are not uploaded again or None to upload every file; files
+                that are found in the database are not added to `gallery`
+
+    `gallery` can be created and even contain images already. It is not
+    closed, so multiple calls can share its connection pool. Galleries that
+    are created by this function are closed when the iteration ends.
+
+    Uploading starts when the first result is requested. Files that can't be
+    uploaded don't stop the other uploads. They yield a failed submission.
+
+    Results should be consumed to the end or the iterator should be closed
+    with ``aclose()`` so that everything is cleaned up immediately.
+
+    Raise ValueError if `order` or `schedule` is invalid or if `fit` or `optimize` is
+    given and Pillow is not installed.
+    Raise OSError if the database at `cache_path` can't be opened.
+    Raise TimeoutError after the results that were finished in time if
+    `deadline` is exceeded.
+
+    Yield 2-tuples of :class:`pyimgbox.Gallery` and :class:`pyimgbox.Submission`
+    objects asynchronously. The gallery is the one the submission was
+    uploaded to.
+    """
+    import asyncio
+
+    from . import (_cache, _gallery, _preprocess, _ratelimit, _retry,
+                   _schedule, _upload)
+
+    if order not in ('input', 'completion'):
+        raise ValueError(f'Invalid order: {order!r}')
+    if schedule not in _schedule.POLICIES:
+        raise ValueError(f'Invalid schedule: {schedule!r}')
+    if deadline is not None:
+        deadline = asyncio.get_running_loop().time() + deadline
+
+    cache = preprocessor = session = None
+    retry = _retry.Retry(attempts=attempts, timeout=timeout, stall_timeout=stall_timeout)
+    rate_limit = _ratelimit.RateLimit(limit_rate) if limit_rate else None
+    try:
+        if cache_path is not None:
+            cache = _cache.Cache(path=cache_path)
+        if fit or optimize:
+            preprocessor = _preprocess.Preprocessor(fit=fit, optimize=optimize)
+        if gallery is None:
+            gallery = session = _gallery.new(
+                title=title,
+                thumb_width=thumb_width,
+                square_thumbs=square_thumbs,
+                comments_enabled=comments,
+                adult=adult,
+            )
+
+        uploads = _upload.upload(
+            gallery, filepaths,
+            jobs=jobs,
+            order=order,
+            schedule=schedule,
+            cache=cache,
+            max_per_gallery=max_per_gallery,
+            preprocessor=preprocessor,
+            retry=retry,
+            rate_limit=rate_limit,
+            deadline=deadline,
+        )
+        try:
+            async for g, sub in uploads:
+                yield g, sub
+        finally:
+            await uploads.aclose()
+    finally:
+        # A gallery from the caller may be passed to any number of calls
+        if gallery is not None:
+            retry.unwatch(gallery)
+            if rate_limit is not None:
+                rate_limit.unwatch(gallery)
+        if session is not None:
+            await session.close()
+        if cache is not None:
+            cache.close()
+        if preprocessor is not None:
+            preprocessor.close()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+# asyncio and pyimgbox are imported where they are used
+
+
+def _file_digest(filepath):
+    hash = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def _file_signature(filepath, st=None):
+    # If none of these change, we assume the file content didn't change either
+    if st is None:
+        st = os.stat(filepath)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _upload_settings(gallery):
+    # Settings of `gallery` that change the image and thumbnail of an upload
+    return f'{gallery.thumb_width}:{gallery.square_thumbs:d}:{gallery.adult:d}'
+
+
+class Cache:
+    """
+    Remember URLs of uploaded files by content
+
+    path: Path to SQLite database; parent directories are created if necessary
+    max_age: Forget uploads that were not used for this many seconds or None
+    max_entries: Forget least recently used uploads beyond this number or None
+
+    Files are identified by the SHA256 digest of their content. The digest is
+    only computed if a file's device, inode, size or modification time changed
+    since it was last seen.
+
+    Uploads are also identified by thumbnail width, square thumbnails and
+    adult content of the gallery they were uploaded to. A cached upload stays
+    in its original gallery; it is not added to any other gallery.
+
+    Raise OSError if the database can't be opened.
+    """
+
+    # Increased with every incompatible change of the uploads table
+    _version = 1
+
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS files ('
+        ' device INTEGER, inode INTEGER, size INTEGER, mtime INTEGER,'
+        ' digest TEXT NOT NULL, used REAL NOT NULL,'
+        ' PRIMARY KEY (device, inode))',
+        'CREATE TABLE IF NOT EXISTS uploads ('
+        ' digest TEXT, settings TEXT,'
+        ' image_url TEXT, thumbnail_url TEXT, web_url TEXT,'
+        ' gallery_url TEXT, edit_url TEXT, used REAL NOT NULL,'
+        ' PRIMARY KEY (digest, settings))',
+    )
+
+    def __init__(self, path, max_age=None, max_entries=None):
+        self._path = path
+        self._max_age = max_age
+        self._max_entries = max_entries
+        try:
+            dirpath = os.path.dirname(path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+            self._db = sqlite3.connect(path)
+            # Losing the most recent entries on power failure is acceptable
+            self._db.execute('PRAGMA synchronous = OFF')
+            with self._db:
+                version = self._db.execute('PRAGMA user_version').fetchone()[0]
+                if version < self._version:
+                    # Uploads without settings are useless
+                    self._db.execute('DROP TABLE IF EXISTS uploads')
+                    self._db.execute(f'PRAGMA user_version = {self._version}')
+                for statement in self._schema:
+                    self._db.execute(statement)
+            self.evict()
+        except (OSError, sqlite3.Error) as e:
+            raise OSError(f'{path}: {e}')
+
+    @property
+    def path(self):
+        """Path to SQLite database"""
+        return self._path
+
+    def close(self):
+        """Close database connection"""
+        self._db.close()
+
+    def evict(self):
+        """Forget uploads according to `max_age` and `max_entries`"""
+        with self._db:
+            if self._max_age is not None:
+                oldest = time.time() - self._max_age
+                self._db.execute('DELETE FROM uploads WHERE used < ?', (oldest,))
+                self._db.execute('DELETE FROM files WHERE used < ?', (oldest,))
+            if self._max_entries is not None:
+                for table in ('uploads', 'files'):
+                    self._db.execute(
+                        f'DELETE FROM {table} WHERE rowid NOT IN '
+                        f'(SELECT rowid FROM {table} ORDER BY used DESC LIMIT ?)',
+                        (self._max_entries,),
+                    )
+
+    async def _digest(self, filepath, st=None):
+        signature = _file_signature(filepath, st)
+        row = self._db.execute(
+            'SELECT digest FROM files WHERE device=? AND inode=? AND size=? AND mtime=?',
+            signature,
+        ).fetchone()
+        if row:
+            digest = row[0]
+        else:
+            import asyncio
+            loop = asyncio.get_running_loop()
+            digest = await loop.run_in_executor(None, _file_digest, filepath)
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                (*signature, digest, time.time()),
+            )
+        return digest
+
+    async def get(self, filepath, gallery, st=None):
+        """
+        Return :class:`pyimgbox.Submission` for previously uploaded `filepath`
+
+        gallery: :class:`pyimgbox.Gallery` that `filepath` would be uploaded to
+        st: :class:`os.stat_result` of `filepath` or None to get it from the OS
+
+        Return None if `filepath` was not uploaded before with the settings of
+        `gallery` or if it can't be read.
+        """
+        settings = _upload_settings(gallery)
+        try:
+            digest = await self._digest(filepath, st)
+        except OSError:
+            return None
+        row = self._db.execute(
+            'SELECT image_url, thumbnail_url, web_url, gallery_url, edit_url '
+            'FROM uploads WHERE digest=? AND settings=?',
+            (digest, settings),
+        ).fetchone()
+        if row:
+            with self._db:
+                self._db.execute('UPDATE uploads SET used=? WHERE digest=? AND settings=?',
+                                 (time.time(), digest, settings))
+            image_url, thumbnail_url, web_url, gallery_url, edit_url = row
+            import pyimgbox
+            return pyimgbox.Submission(
+                filepath=filepath,
+                image_url=image_url,
+                thumbnail_url=thumbnail_url,
+                web_url=web_url,
+                gallery_url=gallery_url,
+                edit_url=edit_url,
+            )
+
+    async def add(self, sub, gallery):
+        """
+        Remember successful :class:`pyimgbox.Submission` `sub`
+
+        gallery: :class:`pyimgbox.Gallery` that `sub` was uploaded to
+        """
+        if sub.success:
+            try:
+                digest = await self._digest(sub.filepath)
+            except OSError:
+                return
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (digest, _upload_settings(gallery), sub.image_url, sub.thumbnail_url, sub.web_url,
+                     sub.gallery_url, sub.edit_url, time.time()),
+                )
@@ -0,0 +1,452 @@
+import contextvars
+import json
+import os
+import stat
+import sys
+
+from . import __command_name__, _input
+
+import logging  # isort:skip
+_log = logging.getLogger('imgbox')
+
+# The client only needs asyncio. pyimgbox and httpx are imported by the
+# daemon when it starts.
+
+# Number of seconds idle connections to imgbox.com are kept open
+_KEEPALIVE_EXPIRY = 300
+
+# Maximum number of characters per output message; JSON escaping can make a
+# message up to 6 times longer and lines longer than 64 KiB can't be read
+_MAX_OUTPUT_CHUNK = 8192
+
+# Arguments that contain paths that are relative to the client's working
+# directory
+_PATH_ARGS = ('journal', 'resume', 'manifest', 'cache_path', 'gallery_store', 'trace')
+
+# Job of the current task or None
+_current_job = contextvars.ContextVar('current_job', default=None)
+
+
+def default_socket_path():
+    """
+    Return path of the daemon's Unix socket
+
+    Without $XDG_RUNTIME_DIR, the socket is in a directory in /tmp that the
+    daemon creates only accessible by the user.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = f'/tmp/{__command_name__}-{os.getuid()}'
+    return os.path.join(runtime_dir, f'{__command_name__}.sock')
+
+
+def _check_socket_dir(path):
+    # Whoever can write to the directory of socket `path` can replace the
+    # socket between checking and connecting to it, so the directory must only
+    # be accessible by the user
+    #
+    # Raise OSError if the directory is not private.
+    dirpath = os.path.dirname(os.path.abspath(path))
+    st = os.lstat(dirpath)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise OSError(f'{dirpath}: Not a private directory')
+
+
+def _encode(**message):
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def _job_args(args):
+    # Return command line arguments as JSON-serializable dictionary with paths
+    # that don't depend on the working directory
+    job_args = dict(vars(args))
+    for name in ('daemon', 'socket'):
+        job_args.pop(name, None)
+    for name in _PATH_ARGS:
+        if job_args.get(name):
+            job_args[name] = os.path.abspath(job_args[name])
+    job_args['files'] = [os.path.abspath(f) if f != '-' else f
+                         for f in job_args['files']]
+    return job_args
+
+
+async def submit(args):
+    """
+    Send job to daemon and copy its output to stdout and stderr
+
+    args: :class:`argparse.Namespace` from :func:`_input.get_args`
+
+    Return the job's exit code or None if no daemon is listening on
+    `args.socket`, if the socket or its directory is accessible by other users
+    or if the daemon can't do the job.
+    """
+    import asyncio
+
+    # The daemon can't read our stdin
+    if args.manifest == '-':
+        return None
+
+    path = args.socket or default_socket_path()
+    try:
+        _check_socket_dir(path)
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return None
+    # Another user's daemon would get our files and could print anything
+    if st.st_uid != os.getuid():
+        print(f'{path}: Socket belongs to another user', file=sys.stderr)
+        return None
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+
+    async def send_files(files):
+        async for f in files:
+            writer.write(_encode(file=os.path.abspath(f)))
+            await writer.drain()
+        writer.write(_encode(end=True))
+        await writer.drain()
+
+    async def no_files():
+        return
+        yield
+
+    try:
+        # The daemon gets files from the journal or manifest
+        if args.resume or args.manifest:
+            files = no_files()
+        else:
+            try:
+                files = await _input.get_files(args)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+
+        writer.write(_encode(args=_job_args(args)))
+        sender = asyncio.ensure_future(send_files(files))
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if 'stdout' in message:
+                    sys.stdout.write(message['stdout'])
+                    sys.stdout.flush()
+                elif 'stderr' in message:
+                    sys.stderr.write(message['stderr'])
+                    sys.stderr.flush()
+                elif 'exit_code' in message:
+                    return message['exit_code']
+        finally:
+            sender.cancel()
+
+        print('Daemon closed the connection', file=sys.stderr)
+        return 1
+    finally:
+        writer.close()
+
+
+class _Job:
+    # Output of one job that is sent to its client
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def send(self, **message):
+        if not self._writer.is_closing():
+            self._writer.write(_encode(**message))
+
+    def write(self, stream, text):
+        for i in range(0, len(text), _MAX_OUTPUT_CHUNK):
+            self.send(**{stream: text[i:i + _MAX_OUTPUT_CHUNK]})
+
+
+class _OutputProxy:
+    # Replacement for sys.stdout or sys.stderr that sends output to the client
+    # of the current job
+
+    def __init__(self, name, stream):
+        self._name = name
+        self._stream = stream
+
+    def write(self, text):
+        job = _current_job.get()
+        if job is None:
+            return self._stream.write(text)
+        else:
+            job.write(self._name, text)
+            return len(text)
+
+    def flush(self):
+        if _current_job.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _SharedTransport:
+    # Connection pool for all jobs that limits the number of simultaneous
+    # requests and, if `rate_limit` is not None, their upload bandwidth
+
+    def __init__(self, max_requests, rate_limit=None):
+        import asyncio
+
+        import httpx
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_keepalive_connections=max_requests,
+                                keepalive_expiry=_KEEPALIVE_EXPIRY),
+        )
+        self._semaphore = asyncio.Semaphore(max_requests)
+        self._rate_limit = rate_limit
+
+    async def handle_async_request(self, request):
+        async with self._semaphore:
+            if self._rate_limit is not None:
+                self._rate_limit.apply(request)
+            return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class Daemon:
+    """
+    Upload images for clients that connect to a Unix socket
+
+    path: Path of the Unix socket
+    jobs: Maximum number of simultaneous requests of all jobs
+    limit_rate: Maximum number of bytes per second of all jobs or None
+
+    All jobs share the same connection pool to imgbox.com, so only the first
+    job has to wait for DNS lookups and TLS handshakes.
+
+    A client sends one JSON object per line:
+
+        {"args": {...}}       Command line arguments (see :func:`submit`)
+        {"file": "/path"}     For each file
+        {"end": true}         After the last file
+
+    The daemon sends the job's output the same way:
+
+        {"stdout": "..."}
+        {"stderr": "..."}
+        {"exit_code": 0}      After the job is finished
+    """
+
+    def __init__(self, path, jobs=8, limit_rate=None):
+        self._path = path
+        self._jobs = jobs
+        self._limit_rate = limit_rate
+        self._server = None
+        self._transport = None
+        self._tasks = set()
+
+    @property
+    def path(self):
+        """Path of the Unix socket"""
+        return self._path
+
+    async def start(self):
+        """
+        Listen on :attr:`path`
+
+        The directory of :attr:`path` is created if it doesn't exist. It must
+        only be accessible by the user.
+
+        Raise RuntimeError if another daemon is listening on :attr:`path`.
+        Raise OSError if listening fails or if the directory of :attr:`path`
+        is accessible by other users.
+        """
+        import asyncio
+
+        from . import _gallery
+
+        dirpath = os.path.dirname(self._path)
+        if dirpath:
+            os.makedirs(dirpath, mode=0o700, exist_ok=True)
+        _check_socket_dir(self._path)
+
+        # Remove socket of a daemon that didn't exit cleanly
+        try:
+            _, writer = await asyncio.open_unix_connection(self._path)
+        except FileNotFoundError:
+            pass
+        except ConnectionRefusedError:
+            os.unlink(self._path)
+        else:
+            writer.close()
+            raise RuntimeError(f'{self._path}: Daemon is already running')
+
+        # Other users must not be able to connect at any time, so the socket is
+        # created private instead of changing its mode afterwards
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self._handle_client, self._path)
+        finally:
+            os.umask(umask)
+        if self._limit_rate:
+            from . import _ratelimit
+            rate_limit = _ratelimit.RateLimit(self._limit_rate)
+        else:
+            rate_limit = None
+        self._transport = _SharedTransport(max_requests=self._jobs, rate_limit=rate_limit)
+        _gallery.share_transport(self._transport)
+        sys.stdout = _OutputProxy('stdout', sys.stdout)
+        sys.stderr = _OutputProxy('stderr', sys.stderr)
+
+    async def close(self):
+        """Stop listening and cancel all jobs"""
+        import asyncio
+
+        from . import _gallery
+
+        self._server.close()
+        for task in tuple(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        sys.stdout = sys.stdout._stream
+        sys.stderr = sys.stderr._stream
+        _gallery.share_transport(None)
+        await self._transport.aclose()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _get_args(self, job_args):
+        args = _input.get_args([])
+        for name, value in job_args.items():
+            if hasattr(args, name):
+                setattr(args, name, value)
+        # Logging is configured for the whole daemon
+        args.debug = False
+        return args
+
+    async def _read_files(self, reader, queue):
+        # Put file paths from the client into `queue` and None after the last
+        # one. Return when the client disconnects.
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                message = json.loads(line)
+                if 'file' in message:
+                    await queue.put(message['file'])
+                elif message.get('end'):
+                    await queue.put(None)
+                    break
+            # The client doesn't send anything else until it disconnects
+            await reader.read()
+        except (ConnectionError, ValueError) as e:
+            _log.debug('Invalid request: %r', e)
+
+    async def _iter_queue(self, queue):
+        while True:
+            filepath = await queue.get()
+            if filepath is None:
+                break
+            yield filepath
+
+    async def _handle_client(self, reader, writer):
+        import asyncio
+
+        from . import _main
+
+        self._tasks.add(asyncio.current_task())
+        job = _Job(writer)
+        _current_job.set(job)
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            args = self._get_args(json.loads(line)['args'])
+
+            queue = asyncio.Queue(maxsize=1000)
+            files = None if args.resume or args.manifest else self._iter_queue(queue)
+            run = asyncio.ensure_future(_main._run(args, files=files))
+            read = asyncio.ensure_future(self._read_files(reader, queue))
+            try:
+                await asyncio.wait((run, read), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                read.cancel()
+                if not run.done():
+                    # The client disconnected
+                    run.cancel()
+                    await asyncio.wait((run,))
+            job.send(exit_code=run.result())
+            await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            _log.debug('Invalid request: %r', e)
+        finally:
+            writer.close()
+            self._tasks.discard(asyncio.current_task())
+
+
+def _get_args(argv):
+    import argparse
+    argparser = argparse.ArgumentParser(
+        prog=f'{__command_name__} serve',
+        description=('Keep connections to imgbox.com open and upload images for '
+                     f'"{__command_name__} --daemon"'),
+    )
+    argparser.add_argument('--socket', default=None, metavar='PATH',
+                           help=('Listen on Unix socket PATH in a directory that only you can '
+                                 f'access (default: {default_socket_path()})'))
+    argparser.add_argument('--jobs', '-J', default=8, type=_input._positive_int,
+                           help=('Maximum number of simultaneous requests of all '
+                                 'clients (default: 8)'))
+    argparser.add_argument('--limit-rate', default=None, type=_input._rate, metavar='RATE',
+                           help=('Maximum number of bytes per second of all clients, '
+                                 'e.g. 500K or 5M (default: unlimited)'))
+    argparser.add_argument('--loop', default=None, choices=('asyncio', 'uvloop'),
+                           help='Event loop implementation (default: uvloop if it is installed)')
+    argparser.add_argument('--debug', action='store_true',
+                           help='Print debugging information')
+    return argparser.parse_args(argv)
+
+
+async def _serve(args):
+    import asyncio
+    import signal
+
+    if args.debug:
+        import logging
+        logging.basicConfig(level=logging.DEBUG,
+                            format='%(module)s: %(message)s')
+
+    daemon = Daemon(args.socket or default_socket_path(), jobs=args.jobs,
+                    limit_rate=args.limit_rate)
+    try:
+        await daemon.start()
+    except (RuntimeError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    print(f'Listening on {daemon.path}', file=sys.stderr)
+    try:
+        await stop.wait()
+    finally:
+        await daemon.close()
+    return 0
+
+
+def main(argv):
+    """Run daemon until SIGINT or SIGTERM and return exit code"""
+    args = _get_args(argv)
+    from . import _loop
+    try:
+        loop_factory = _loop.get_loop_factory(args.loop)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return _loop.run(_serve(args), loop_factory)
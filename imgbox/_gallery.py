@@ -0,0 +1,161 @@
+import html.parser
+import os
+
+import pyimgbox
+from pyimgbox import _const
+
+# pyimgbox can only add images to galleries it created itself. get_token() and
+# reopen() use its internals to get the credentials of an existing gallery and
+# to continue adding images to it later.
+
+# httpx transport that is used by all new galleries or None
+_shared_transport = None
+
+
+def share_transport(transport):
+    """
+    Make all galleries that are returned by :func:`new` and :func:`copy` use
+    the same connection pool
+
+    transport: :class:`httpx.AsyncBaseTransport` instance or None to give each
+               gallery its own connection pool
+
+    Closing a gallery doesn't close `transport`.
+    """
+    global _shared_transport
+    _shared_transport = transport
+
+
+class _UnclosableTransport:
+    # Transport wrapper that ignores the client closing it
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+def new(transport=None, **settings):
+    """
+    Return new :class:`pyimgbox.Gallery`
+
+    transport: :class:`httpx.AsyncBaseTransport` instance that is shared with
+               other galleries or None; the transport from
+               :func:`share_transport` is used instead if there is one
+
+    All other keyword arguments are passed to :class:`pyimgbox.Gallery`.
+    """
+    gallery = pyimgbox.Gallery(**settings)
+    if _shared_transport is not None:
+        transport = _shared_transport
+    if transport is not None:
+        # Each gallery still needs its own client for its own session cookies
+        import httpx
+        gallery._client._client = httpx.AsyncClient(
+            timeout=300,
+            transport=_UnclosableTransport(transport),
+        )
+    return gallery
+
+
+def copy(gallery, number, transport=None):
+    """
+    Return new :class:`pyimgbox.Gallery` with the same settings as `gallery`
+
+    number: Number that is appended to the title of `gallery`, e.g. "Foo (2)"
+    transport: See :func:`new`
+    """
+    return new(
+        transport=transport,
+        title=f'{gallery.title} ({number})' if gallery.title else None,
+        thumb_width=gallery.thumb_width,
+        square_thumbs=gallery.square_thumbs,
+        adult=gallery.adult,
+        comments_enabled=gallery.comments_enabled,
+    )
+
+
+def get_token(gallery):
+    """
+    Return credentials of created `gallery` or None
+
+    The return value is a dictionary that can be serialized to JSON and passed
+    to :func:`reopen`.
+    """
+    if gallery.created:
+        return dict(gallery._gallery_token)
+
+
+class _CSRFTokenParser(html.parser.HTMLParser):
+    token = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'meta' and attrs.get('name') == 'csrf-token':
+            self.token = attrs.get('content')
+
+
+async def reopen(gallery, token):
+    """
+    Make `gallery` add images to an existing gallery
+
+    gallery: :class:`pyimgbox.Gallery` instance that was not created yet
+    token: Return value of :func:`get_token`
+
+    Raise ConnectionError if the request for a new session fails.
+
+    Raise RuntimeError if `gallery` was already created or if the server
+    responds in an unexpected way.
+    """
+    if gallery.created:
+        raise RuntimeError('Gallery was already created')
+
+    # Every session needs its own CSRF token
+    gallery._client.headers.pop(_const.CSRF_TOKEN_HEADER, None)
+    text = await gallery._client.get(f'https://{_const.SERVICE_DOMAIN}/')
+    parser = _CSRFTokenParser()
+    parser.feed(text)
+    if not parser.token:
+        raise RuntimeError("Couldn't find CSRF token in HTML head")
+    gallery._client.headers[_const.CSRF_TOKEN_HEADER] = parser.token
+    gallery._gallery_token = dict(token)
+
+
+def upload_name(filepath):
+    """
+    Return file name that is sent with the image from `filepath`
+
+    The file name must be valid UTF-8, so bytes from a path that was decoded
+    with the "surrogateescape" error handler are replaced with U+FFFD.
+    """
+    return os.fsencode(os.path.basename(filepath)).decode('utf-8', 'replace')
+
+
+def add_event_hook(gallery, event, hook):
+    """
+    Call `hook` for every HTTP request `gallery` makes
+
+    event: "request" to call `hook` with every :class:`httpx.Request` before it
+           is sent or "response" to call `hook` with every
+           :class:`httpx.Response` when it is received
+    hook: Coroutine function that takes a request or response
+
+    Adding the same `hook` again does nothing.
+    """
+    hooks = gallery._client._client.event_hooks[event]
+    if hook not in hooks:
+        hooks.append(hook)
+
+
+def remove_event_hook(gallery, event, hook):
+    """
+    Stop calling `hook` that was added with :func:`add_event_hook`
+
+    Removing a `hook` that wasn't added does nothing.
+    """
+    hooks = gallery._client._client.event_hooks[event]
+    if hook in hooks:
+        hooks.remove(hook)
@@ -1,15 +1,75 @@
 import argparse
+import fnmatch
+import os
 import sys
 
-from . import __command_name__, __version__
+from . import __command_name__, __version__, _paths
+
+# File name extensions of each image type that imgbox.com accepts
+_IMAGE_TYPES = {
+    'jpeg': ('.jpg', '.jpeg'),
+    'png': ('.png',),
+    'gif': ('.gif',),
+}
+_IMAGE_EXTENSIONS = tuple(ext for exts in _IMAGE_TYPES.values() for ext in exts)
+
+
+def _rate(value):
+    # Number of bytes per second with optional binary suffix like curl's
+    # --limit-rate, e.g. "500K" or "5M"
+    multipliers = {'': 1, 'k': 2**10, 'm': 2**20, 'g': 2**30}
+    number, suffix = value, ''
+    if value[-1:].lower() in multipliers:
+        number, suffix = value[:-1], value[-1].lower()
+    try:
+        rate = float(number) * multipliers[suffix]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Not a rate: {value}')
+    if not 1 <= rate < float('inf'):
+        raise argparse.ArgumentTypeError(f'Must be 1 or higher: {value}')
+    return rate
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Not a number: {value}')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'Must be 1 or higher: {value}')
+    return number
 
 
 def get_args(argv):
-    argparser = argparse.ArgumentParser(description='Upload images to imgbox.com')
+    argparser = argparse.ArgumentParser(
+        description='Upload images to imgbox.com',
+        epilog=(f'Run "{__command_name__} serve -h" to learn how to keep connections '
+                'open between uploads.'),
+    )
 
     argparser.add_argument('files', nargs='*',
-                           help=('Image files to upload; newline-separated file paths '
-                                 'are also read from stdin'))
+                           help=('Image files or, with --recursive, directories to upload; '
+                                 'newline-separated paths are also read from stdin'))
+
+    argparser.add_argument('--recursive', '-r', action='store_true',
+                           help=('Upload image files beneath directories; symbolic links '
+                                 'to directories are not followed'))
+
+    argparser.add_argument('--include', action='append', default=None, metavar='GLOB',
+                           help=('Upload only files from directories with names that match '
+                                 'GLOB; may be given multiple times'))
+
+    argparser.add_argument('--exclude', action='append', default=None, metavar='GLOB',
+                           help=('Skip files and directories with names that match GLOB '
+                                 'while walking directories; may be given multiple times'))
+
+    argparser.add_argument('--type', action='append', default=None,
+                           choices=tuple(_IMAGE_TYPES),
+                           help=('Upload only files of this type from directories; may be '
+                                 'given multiple times (default: all)'))
+
+    argparser.add_argument('--null', '-0', action='store_true',
+                           help='File paths from stdin are separated by null bytes')
 
     argparser.add_argument('--title', '-t', default=None,
                            help='Gallery title')
@@ -26,8 +86,125 @@ def get_args(argv):
     argparser.add_argument('--adult', '-a', action='store_true',
                            help='Mark gallery as adult-only')
 
-    argparser.add_argument('--json', '-j', action='store_true',
-                           help='Print URLs as JSON object')
+    argparser.add_argument('--gallery', '-g', default=None, metavar='NAME',
+                           help=('Add images to the gallery that was saved as NAME instead '
+                                 'of creating a new one; if there is none, the new gallery '
+                                 'is saved as NAME; NAME may also be the edit URL of a '
+                                 'saved gallery'))
+
+    argparser.add_argument('--gallery-store', default=None, metavar='PATH',
+                           help=('Where to save galleries for --gallery '
+                                 f'(default: {_paths.gallery_store_path()})'))
+
+    output = argparser.add_mutually_exclusive_group()
+    output.add_argument('--json', '-j', action='store_true',
+                        help='Print URLs as JSON object')
+    output.add_argument('--ndjson', action='store_true',
+                        help=('Print gallery URLs and then each upload as soon as it is '
+                              'finished as one JSON object per line'))
+
+    argparser.add_argument('--jobs', '-J', default=1, type=_positive_int,
+                           help=('Maximum number of simultaneous uploads; images may '
+                                 'appear in the gallery in a different order if this is '
+                                 'larger than 1 (default: 1)'))
+
+    argparser.add_argument('--max-per-gallery', default=1000, type=_positive_int, metavar='N',
+                           help=('Upload to a new gallery with the same settings after '
+                                 'every N files (default: 1000)'))
+
+    argparser.add_argument('--attempts', default=3, type=_positive_int, metavar='N',
+                           help=('Maximum number of attempts to create a gallery or to '
+                                 'upload a file if the connection fails or the server '
+                                 'has a temporary problem (default: 3)'))
+
+    argparser.add_argument('--timeout', default=None, type=_positive_int, metavar='SECONDS',
+                           help=('Maximum number of seconds for each attempt to create a '
+                                 'gallery or to upload a file (default: none)'))
+
+    argparser.add_argument('--stall-timeout', default=None, type=_positive_int,
+                           metavar='SECONDS',
+                           help=('Repeat an attempt to create a gallery or to upload a file '
+                                 'if it doesn\'t send or receive anything for SECONDS; exit '
+                                 'with code 4 if any upload failed because of this '
+                                 '(default: none)'))
+
+    argparser.add_argument('--deadline', default=None, type=_positive_int, metavar='SECONDS',
+                           help=('Stop after SECONDS, print and record all finished '
+                                 'uploads and exit with code 3 (default: none)'))
+
+    argparser.add_argument('--limit-rate', default=None, type=_rate, metavar='RATE',
+                           help=('Maximum number of bytes per second of all uploads, '
+                                 'e.g. 500K or 5M (default: unlimited)'))
+
+    argparser.add_argument('--fit', action='store_true',
+                           help=('Downscale or recompress images that are too large '
+                                 'instead of refusing to upload them (requires Pillow)'))
+
+    argparser.add_argument('--optimize', action='store_true',
+                           help=('Optimize images without losing quality and remove '
+                                 'their metadata before uploading (requires Pillow)'))
+
+    argparser.add_argument('--order', default='input', choices=('input', 'completion'),
+                           help=('Print results in the order of the given files or as '
+                                 'soon as each upload is finished (default: input)'))
+
+    argparser.add_argument('--schedule', default='input',
+                           choices=('input', 'smallest-first', 'largest-first'),
+                           help=('Upload files in the order they are given, the smallest '
+                                 'or the largest of the next files first; smallest-first '
+                                 'prints the first results sooner, largest-first finishes '
+                                 'sooner with --jobs (default: input)'))
+
+    argparser.add_argument('--cache', action='store_true',
+                           help=("Don't upload files again that were uploaded before "
+                                 'with the same thumbnail settings; they are NOT added '
+                                 'to the gallery'))
+
+    argparser.add_argument('--cache-path', default=None, metavar='PATH',
+                           help=('Where to remember uploaded files '
+                                 f'(default: {_paths.cache_path()})'))
+
+    argparser.add_argument('--cache-max-age', default=None, type=_positive_int, metavar='DAYS',
+                           help=('Forget uploads that were not used for DAYS days '
+                                 '(default: never)'))
+
+    argparser.add_argument('--cache-max-entries', default=100000, type=_positive_int, metavar='N',
+                           help=('Forget least recently used uploads beyond N '
+                                 '(default: 100000)'))
+
+    batch = argparser.add_mutually_exclusive_group()
+    batch.add_argument('--journal', default=None, metavar='JOURNAL',
+                       help=('Record progress in new file JOURNAL so that the batch '
+                             'can be continued with --resume'))
+    batch.add_argument('--resume', default=None, metavar='JOURNAL',
+                       help=('Continue the batch recorded in JOURNAL; files that '
+                             'failed 3 times are listed in JOURNAL.failed'))
+    batch.add_argument('--manifest', default=None, metavar='FILE',
+                       help=('Upload to multiple galleries that are described by one JSON '
+                             'object per line in FILE, e.g. {"title": "Foo", "adult": '
+                             'false, "files": ["a.jpg", "b.jpg"]}; relative paths are '
+                             'relative to FILE; other options provide default settings'))
+
+    argparser.add_argument('--progress', '-p', action='store_true',
+                           help=('Display number of uploaded files and bytes, throughput '
+                                 'and remaining time on stderr'))
+
+    argparser.add_argument('--trace', default=None, metavar='FILE',
+                           help=('Write the duration of each phase of each upload to FILE '
+                                 'in Chrome trace event format (see https://ui.perfetto.dev/)'))
+
+    argparser.add_argument('--stats', action='store_true',
+                           help='Print duration statistics of each phase to stderr')
+
+    argparser.add_argument('--daemon', '-d', action='store_true',
+                           help=(f'Let "{__command_name__} serve" upload the files; upload '
+                                 'them without it if it is not running'))
+
+    argparser.add_argument('--socket', default=None, metavar='PATH',
+                           help='Unix socket of the daemon for --daemon')
+
+    argparser.add_argument('--loop', default=None, choices=('asyncio', 'uvloop'),
+                           help='Event loop implementation (default: uvloop if it is installed)')
 
     argparser.add_argument('--version', '-V', action='version',
                            version=f'{__command_name__} {__version__}')
@@ -38,21 +215,163 @@ def get_args(argv):
     return argparser.parse_args(argv)
 
 
-def get_files(args):
+def _read_paths(fileobj, separator):
+    # Yield paths from unbuffered binary `fileobj` as soon as they are
+    # terminated by `separator`. Paths are decoded the same way as paths from
+    # the OS are, so non-UTF-8 paths can still be opened.
+    buffer = b''
+    for chunk in iter(lambda: fileobj.read(65536), b''):
+        buffer += chunk
+        *paths, buffer = buffer.split(separator)
+        for path in paths:
+            yield os.fsdecode(path)
+    if buffer:
+        yield os.fsdecode(buffer)
+
+
+async def _iter_in_thread(iterable):
+    # Yield items from blocking `iterable` as soon as they are produced in a
+    # daemon thread that can't prevent the process from exiting. The bounded
+    # queue stops iterating if uploads can't keep up.
+    import asyncio
+    import threading
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=1000)
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def producer():
+        try:
+            for item in iterable:
+                put(item)
+        except Exception as e:
+            put(e)
+        finally:
+            put(None)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            yield item
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def _scandir(directory):
+    # Return directory entries sorted by name or empty list if `directory` can't
+    # be read
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(entries, key=lambda entry: entry.name)
+    except OSError:
+        return []
+
+
+def _walk(directory, include=(), exclude=(), extensions=_IMAGE_EXTENSIONS):
+    # Yield paths of files beneath `directory` sorted by name, descending into
+    # each subdirectory where it is sorted. File names must match any `include`
+    # pattern and have one of `extensions`. Files and directories that match
+    # any `exclude` pattern are skipped. Symbolic links to directories are not
+    # followed.
+    #
+    # The type of each entry is known from the directory listing on most file
+    # systems, so found files are not stat()ed before they are validated.
+    stack = [iter(_scandir(directory))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+        elif _matches(entry.name, exclude):
+            continue
+        else:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = not is_dir and entry.is_file()
+            except OSError:
+                continue
+            if is_dir:
+                stack.append(iter(_scandir(entry.path)))
+            elif (is_file
+                  and os.path.splitext(entry.name)[1].lower() in extensions
+                  and (not include or _matches(entry.name, include))):
+                yield entry.path
+
+
+def _get_extensions(types):
+    if types:
+        return tuple(ext for type in types for ext in _IMAGE_TYPES[type])
+    else:
+        return _IMAGE_EXTENSIONS
+
+
+def _expand(paths, args):
+    # Replace directories in `paths` with the files beneath them
+    for path in paths:
+        if os.path.isdir(path):
+            yield from _walk(path, include=args.include or (), exclude=args.exclude or (),
+                             extensions=_get_extensions(args.type))
+        else:
+            yield path
+
+
+async def _iter_files(args):
     # Files from stdin
-    files = []
     if not sys.stdin.isatty():
-        files.extend(f.rstrip('\n') for f in sys.stdin.readlines() if f.strip())
+        separator = b'\0' if args.null else b'\n'
+        # A thread that is blocked in the buffered reader holds its lock, which
+        # aborts the interpreter if it exits before stdin is closed. A replaced
+        # stdin may not be buffered, e.g. BytesIO.
+        paths = _read_paths(getattr(sys.stdin.buffer, 'raw', sys.stdin.buffer), separator)
+        if args.null:
+            paths = (f for f in paths if f)
+        else:
+            paths = (f for f in paths if f.strip())
+        if args.recursive:
+            paths = _expand(paths, args)
+        async for f in _iter_in_thread(paths):
+            yield f
 
     # Files from arguments
     if args.files != ['-']:
-        files.extend(args.files)
+        if args.recursive:
+            async for f in _iter_in_thread(_expand(args.files, args)):
+                yield f
+        else:
+            for f in args.files:
+                yield f
+
+
+async def get_files(args):
+    """
+    Return asynchronous iterator of file paths from stdin and arguments
+
+    File paths are yielded as soon as they are read from stdin.
+
+    Raise ValueError if there are no file paths.
+    """
+    files = _iter_files(args)
 
     # No files is an error
-    if not files:
+    try:
+        first = await files.__anext__()
+    except StopAsyncIteration:
         raise ValueError(
             'Missing at least one image file. '
             f'Run "{__command_name__} -h" for more information.'
         )
 
-    return files
+    async def all_files():
+        yield first
+        async for f in files:
+            yield f
+
+    return all_files()
@@ -0,0 +1,204 @@
+import collections
+import json
+import os
+
+import pyimgbox
+
+from . import _gallery
+
+
+class Journal:
+    """
+    Append-only record of an upload batch
+
+    path: Path to journal file
+    resume: Whether `path` must be an existing journal (True) or must not exist
+            yet (False)
+    max_attempts: How many times a file may fail before it is given up
+
+    Each line in the journal file is a JSON object with one of these keys:
+
+    batch: Gallery settings and maximum number of files per gallery
+    file: File path that is part of the batch
+    gallery: Number and credentials of a created gallery (see
+             :func:`~._gallery.get_token`)
+    submission: Finished :class:`pyimgbox.Submission`
+
+    Records are written to disk immediately so that a batch can be resumed after
+    the process was killed at any point. File paths are recorded as absolute
+    paths so that a batch can be resumed from any working directory.
+
+    Files that failed `max_attempts` times are also appended to a dead letter
+    file, which is `path` with ".failed" appended. It contains one file path per
+    line.
+
+    Raise OSError if `path` can't be read or written or if `resume` is True and
+    `path` is not a valid journal.
+    """
+
+    def __init__(self, path, resume=False, max_attempts=3):
+        self._path = path
+        self._max_attempts = max_attempts
+        self._batch = None
+        self._files = {}
+        self._galleries = {}
+        self._succeeded = {}
+        self._failed = {}
+        self._attempts = collections.Counter()
+
+        if resume:
+            self._read()
+        elif os.path.exists(path):
+            raise OSError(f'{path}: Journal already exists')
+
+        try:
+            self._file = open(path, 'a')
+        except OSError as e:
+            raise OSError(f'{path}: {e.strerror}')
+
+    def _read(self):
+        try:
+            f = open(self._path, 'r')
+        except OSError as e:
+            raise OSError(f'{self._path}: {e.strerror}')
+
+        with f:
+            # A process that was killed may have left an incomplete last line,
+            # so invalid JSON is only an error if more lines follow
+            invalid_lineno = None
+            for lineno, line in enumerate(f, start=1):
+                if invalid_lineno is not None:
+                    raise OSError(f'{self._path}: Line {invalid_lineno}: Invalid JSON')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    invalid_lineno = lineno
+                else:
+                    self._read_record(record, lineno)
+
+        if self._batch is None:
+            raise OSError(f'{self._path}: Not a journal')
+
+    def _read_record(self, record, lineno):
+        try:
+            if 'batch' in record:
+                self._batch = record['batch']
+            elif 'file' in record:
+                self._files[record['file']] = None
+            elif 'gallery' in record:
+                self._galleries[record['gallery']['number']] = record['gallery']
+            elif 'submission' in record:
+                self._remember(pyimgbox.Submission(**record['submission']))
+        except (KeyError, TypeError, AssertionError):
+            raise OSError(f'{self._path}: Line {lineno}: Invalid record')
+
+    def _remember(self, sub):
+        # Only URLs and error messages are kept to save memory
+        if sub.success:
+            self._succeeded[sub.filepath] = (sub.image_url, sub.thumbnail_url, sub.web_url,
+                                             sub.gallery_url, sub.edit_url)
+            self._failed.pop(sub.filepath, None)
+        else:
+            self._failed[sub.filepath] = sub.error
+            self._attempts[sub.filepath] += 1
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    @property
+    def path(self):
+        """Path to journal file"""
+        return self._path
+
+    @property
+    def dead_letter_path(self):
+        """Path to file that lists files that failed `max_attempts` times"""
+        return self._path + '.failed'
+
+    @property
+    def settings(self):
+        """Gallery settings passed to :meth:`start` or None"""
+        return self._batch['settings'] if self._batch else None
+
+    @property
+    def max_per_gallery(self):
+        """Maximum number of files per gallery passed to :meth:`start` or None"""
+        return self._batch.get('max_per_gallery') if self._batch else None
+
+    @property
+    def files(self):
+        """List of file paths yielded by :meth:`add_files`"""
+        return list(self._files)
+
+    @property
+    def gallery_tokens(self):
+        """Map gallery numbers to credentials of galleries passed to :meth:`add_gallery`"""
+        return {number: gallery['token'] for number, gallery in self._galleries.items()}
+
+    def close(self):
+        """Close journal file"""
+        self._file.close()
+
+    def start(self, settings, max_per_gallery=None):
+        """
+        Record the beginning of a batch
+
+        settings: Dictionary of keyword arguments for :class:`pyimgbox.Gallery`
+        max_per_gallery: Maximum number of files per gallery or None
+        """
+        self._batch = {'settings': dict(settings), 'max_per_gallery': max_per_gallery}
+        self._write({'batch': self._batch})
+
+    async def add_files(self, filepaths):
+        """Record and yield each path from asynchronous iterable `filepaths`"""
+        async for filepath in filepaths:
+            abspath = os.path.abspath(filepath)
+            if abspath not in self._files:
+                self._files[abspath] = None
+                self._write({'file': abspath})
+            yield filepath
+
+    def add_gallery(self, gallery, number=0):
+        """
+        Record credentials of created `gallery` unless already recorded
+
+        number: Index of `gallery` in the galleries of this batch
+        """
+        if number not in self._galleries:
+            self._galleries[number] = {
+                'number': number,
+                'url': gallery.url,
+                'edit_url': gallery.edit_url,
+                'token': _gallery.get_token(gallery),
+            }
+            self._write({'gallery': self._galleries[number]})
+
+    def get(self, filepath):
+        """
+        Return recorded :class:`pyimgbox.Submission` for `filepath` or None
+
+        A successful submission is returned if `filepath` was uploaded before.
+        A failed submission is returned if `filepath` failed `max_attempts`
+        times. Otherwise, `filepath` should be uploaded and None is returned.
+        """
+        abspath = os.path.abspath(filepath)
+        if abspath in self._succeeded:
+            image_url, thumbnail_url, web_url, gallery_url, edit_url = self._succeeded[abspath]
+            return pyimgbox.Submission(filepath=filepath, image_url=image_url,
+                                       thumbnail_url=thumbnail_url, web_url=web_url,
+                                       gallery_url=gallery_url, edit_url=edit_url)
+        elif self._attempts[abspath] >= self._max_attempts:
+            return pyimgbox.Submission(filepath=filepath, error=self._failed[abspath])
+
+    def add(self, sub):
+        """Record finished :class:`pyimgbox.Submission` `sub`"""
+        sub = pyimgbox.Submission(**{**sub, 'filepath': os.path.abspath(sub.filepath),
+                                     'filename': None})
+        self._write({'submission': sub})
+        self._remember(sub)
+        if not sub.success and self._attempts[sub.filepath] == self._max_attempts:
+            # Paths that are not valid UTF-8 are written as they were read
+            with open(self.dead_letter_path, 'a', errors='surrogateescape') as f:
+                f.write(sub.filepath + '\n')
@@ -0,0 +1,88 @@
+import asyncio
+import signal
+
+
+def get_loop_factory(name=None):
+    """
+    Return callable that creates a new event loop
+
+    name: "asyncio", "uvloop" or None to use uvloop if it is installed
+
+    Raise ValueError if `name` is "uvloop" and uvloop is not installed.
+    """
+    if name is None or name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            if name == 'uvloop':
+                raise ValueError('uvloop is not installed')
+        else:
+            return uvloop.new_event_loop
+    elif name != 'asyncio':
+        raise ValueError(f'Invalid event loop: {name!r}')
+    return asyncio.new_event_loop
+
+
+async def _cancel_on_sigint(coro):
+    # Run `coro` in a task that is cancelled by the first SIGINT so that all
+    # `finally` blocks run. A second SIGINT interrupts the cleanup.
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coro)
+    interrupted = handling = False
+
+    def interrupt():
+        nonlocal interrupted, handling
+        interrupted, handling = True, False
+        loop.remove_signal_handler(signal.SIGINT)
+        task.cancel()
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, interrupt)
+    except (NotImplementedError, RuntimeError):
+        # Not supported on Windows or outside the main thread
+        pass
+    else:
+        handling = True
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if interrupted:
+            raise KeyboardInterrupt()
+        raise
+    finally:
+        if handling:
+            loop.remove_signal_handler(signal.SIGINT)
+
+
+def run(coro, loop_factory=None):
+    """
+    Run coroutine in a new event loop and return its result
+
+    coro: Coroutine object
+    loop_factory: Return value of :func:`get_loop_factory` or None to use
+                  uvloop if it is installed
+
+    SIGINT cancels `coro` instead of interrupting it wherever it happens to
+    be. All remaining tasks are cancelled and asynchronous generators are
+    closed before the loop is closed.
+
+    Raise KeyboardInterrupt if `coro` was cancelled by SIGINT.
+    """
+    if loop_factory is None:
+        loop_factory = get_loop_factory()
+
+    if hasattr(asyncio, 'Runner'):
+        # Python >= 3.11
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            return runner.run(_cancel_on_sigint(coro))
+    else:
+        class Policy(asyncio.DefaultEventLoopPolicy):
+            def new_event_loop(self):
+                return loop_factory()
+
+        policy = asyncio.get_event_loop_policy()
+        asyncio.set_event_loop_policy(Policy())
+        try:
+            return asyncio.run(_cancel_on_sigint(coro))
+        finally:
+            asyncio.set_event_loop_policy(policy)
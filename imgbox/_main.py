@@ -1,57 +1,229 @@
-import asyncio
 import sys
-import traceback
 
-import pyimgbox
-
-from . import __bugtracker_url__, _input, _output
+# Only modules that are needed to parse arguments are imported here so that
+# --help, --version and invalid arguments don't wait for the HTTP client stack.
+from . import _input
 
 
 def main(argv=sys.argv[1:]):
-    loop = asyncio.get_event_loop()
-    exit_code = loop.run_until_complete(
-        run(argv)
-    )
-    return exit_code
+    if argv[:1] == ['serve']:
+        from . import _daemon
+        return _daemon.main(argv[1:])
+
+    args = _input.get_args(argv)
+    from . import _loop
+    try:
+        loop_factory = _loop.get_loop_factory(args.loop)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        return _loop.run(_run(args), loop_factory)
+    except KeyboardInterrupt:
+        # Uploads are cancelled and everything is closed
+        return 130
 
 
 async def run(args):
-    args = _input.get_args(args)
+    return await _run(_input.get_args(args))
+
+
+async def _run(args, files=None):
+    # files: Asynchronous iterator of file paths that are used instead of
+    #        get_files() or None
+    if args.daemon:
+        from . import _daemon
+        exit_code = await _daemon.submit(args)
+        if exit_code is not None:
+            return exit_code
+
+    import asyncio
+
+    from . import (__bugtracker_url__, _cache, _gallery, _journal, _manifest,
+                   _output, _paths, _preprocess, _progress, _ratelimit, _retry,
+                   _tokens, _trace, _upload)
 
     if args.debug:
         import logging
         logging.basicConfig(level=logging.DEBUG,
                             format='%(module)s: %(message)s')
 
+    # The deadline includes reading file paths from stdin
+    loop = asyncio.get_running_loop()
+    if args.deadline:
+        deadline = loop.time() + args.deadline
+    else:
+        deadline = None
+
+    async def until_deadline(coro):
+        # Raise DeadlineExceeded if `coro` doesn't finish before `deadline`
+        if deadline is None:
+            return await coro
+        try:
+            return await asyncio.wait_for(coro, max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            raise _upload.DeadlineExceeded('Deadline exceeded')
+
     exit_code = 0
+    cache = journal = manifest = preprocessor = None
+    tokens = gallery_name = gallery_token = None
     try:
-        files = _input.get_files(args)
-    except ValueError as e:
+        if args.gallery:
+            if args.resume or args.manifest:
+                raise ValueError('--gallery does not work with --resume or --manifest')
+            tokens = _tokens.TokenStore(args.gallery_store or _paths.gallery_store_path())
+            if _tokens.parse_edit_url(args.gallery):
+                found = tokens.find(args.gallery)
+                if found is None:
+                    raise ValueError(f'Unknown gallery: {args.gallery}')
+                gallery_name, gallery_token = found
+            else:
+                gallery_name, gallery_token = args.gallery, tokens.get(args.gallery)
+
+        if args.resume:
+            if args.files:
+                raise ValueError('--resume does not take any files')
+            journal = _journal.Journal(args.resume, resume=True)
+            settings = journal.settings
+            max_per_gallery = journal.max_per_gallery
+            files = journal.files
+        else:
+            settings = {
+                'title': args.title,
+                'adult': args.adult,
+                'thumb_width': args.thumb_width,
+                'square_thumbs': args.square_thumbs,
+                'comments_enabled': args.comments,
+            }
+            max_per_gallery = args.max_per_gallery
+            if args.manifest:
+                if args.files:
+                    raise ValueError('--manifest does not take any files')
+                manifest = _manifest.Manifest(args.manifest, settings, max_per_gallery)
+            elif files is None:
+                files = await until_deadline(_input.get_files(args))
+            if args.journal:
+                journal = _journal.Journal(args.journal)
+                journal.start(settings, max_per_gallery)
+                files = journal.add_files(files)
+
+        if args.cache:
+            cache = _cache.Cache(
+                path=args.cache_path or _paths.cache_path(),
+                max_age=args.cache_max_age * 86400 if args.cache_max_age else None,
+                max_entries=args.cache_max_entries,
+            )
+
+        if args.fit or args.optimize:
+            preprocessor = _preprocess.Preprocessor(fit=args.fit, optimize=args.optimize)
+    except _upload.DeadlineExceeded:
+        print(f'Deadline of {args.deadline} seconds exceeded', file=sys.stderr)
+        exit_code = 3
+    except (ValueError, OSError) as e:
         print(e, file=sys.stderr)
         exit_code = 1
     else:
-        gallery = pyimgbox.Gallery(
-            title=args.title,
-            adult=args.adult,
-            thumb_width=args.thumb_width,
-            square_thumbs=args.square_thumbs,
-            comments_enabled=args.comments,
-        )
+        if manifest is None:
+            gallery = session = _gallery.new(**settings)
+        else:
+            # The manifest provides galleries with their files
+            gallery, files, session = None, manifest, manifest
+        retry = _retry.Retry(attempts=args.attempts, timeout=args.timeout,
+                             stall_timeout=args.stall_timeout)
+        tracer = _trace.Tracer() if args.trace or args.stats else None
+        progress = _progress.Progress() if args.progress else None
+        rate_limit = _ratelimit.RateLimit(args.limit_rate) if args.limit_rate else None
 
         if args.json:
             create_output = _output.json
+        elif args.ndjson:
+            create_output = _output.ndjson
         else:
             create_output = _output.text
 
-        async with gallery:
+        async with session:
             try:
-                exit_code = await create_output(gallery, files)
+                if journal is not None and 0 in journal.gallery_tokens:
+                    await until_deadline(_gallery.reopen(gallery, journal.gallery_tokens[0]))
+                elif gallery_token is not None:
+                    # Skip creating a gallery
+                    await until_deadline(_gallery.reopen(gallery, gallery_token))
+            except _upload.DeadlineExceeded:
+                print(f'Deadline of {args.deadline} seconds exceeded', file=sys.stderr)
+                return 3
+            except ConnectionError as e:
+                print(e, file=sys.stderr)
+                return 1
+
+            if tracer is not None:
+                lag_sampler = asyncio.ensure_future(tracer.sample_lag())
+            if progress is not None:
+                progress_display = asyncio.ensure_future(progress.display())
+
+            try:
+                exit_code = await create_output(
+                    gallery, files,
+                    jobs=args.jobs,
+                    order=args.order,
+                    schedule=args.schedule,
+                    cache=cache,
+                    journal=journal,
+                    max_per_gallery=max_per_gallery,
+                    preprocessor=preprocessor,
+                    retry=retry,
+                    tracer=tracer,
+                    progress=progress,
+                    rate_limit=rate_limit,
+                    deadline=deadline,
+                )
+            except _upload.DeadlineExceeded:
+                # Everything that was finished is printed and recorded
+                exit_code = 3
+                print(f'Deadline of {args.deadline} seconds exceeded', file=sys.stderr)
             except Exception as e:
+                import traceback
                 exit_code = 100
                 tb = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
                 print(
                     f'{tb}\nPlease report this as a bug: {__bugtracker_url__}',
                     file=sys.stderr,
                 )
+            else:
+                if exit_code == 1 and retry.stalled:
+                    exit_code = 4
+            finally:
+                # Also report what was done before Ctrl-C
+                if progress is not None:
+                    progress_display.cancel()
+                    await asyncio.wait((progress_display,))
+
+                if rate_limit is not None:
+                    print(rate_limit.summary(), file=sys.stderr)
+
+                if tracer is not None:
+                    lag_sampler.cancel()
+                    if args.stats:
+                        print(tracer.summary(), file=sys.stderr)
+                    if args.trace:
+                        try:
+                            tracer.write(args.trace)
+                        except OSError as e:
+                            print(e, file=sys.stderr)
+                            exit_code = exit_code or 1
+
+                if gallery_name is not None and gallery_token is None and gallery.created:
+                    # Following runs add images to the same gallery
+                    try:
+                        tokens.save(gallery_name, _gallery.get_token(gallery))
+                    except OSError as e:
+                        print(e, file=sys.stderr)
+                        exit_code = exit_code or 1
+    finally:
+        if cache is not None:
+            cache.close()
+        if journal is not None:
+            journal.close()
+        if preprocessor is not None:
+            preprocessor.close()
 
     return exit_code
@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+
+import httpx
+
+from . import _gallery
+
+# Manifest keys, the gallery setting each one maps to and the allowed types
+_SETTINGS = {
+    'title': ('title', (str, type(None))),
+    'thumb_width': ('thumb_width', (int,)),
+    'square_thumbs': ('square_thumbs', (bool,)),
+    'adult': ('adult', (bool,)),
+    'comments': ('comments_enabled', (bool,)),
+}
+
+
+def _parse(line, defaults, directory):
+    # Return gallery settings and file paths from one manifest line
+    # Raise ValueError if `line` is invalid
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f'Invalid JSON: {e}')
+    if not isinstance(obj, dict):
+        raise ValueError('Not a JSON object')
+
+    settings = dict(defaults)
+    for key, value in obj.items():
+        if key == 'files':
+            continue
+        elif key not in _SETTINGS:
+            raise ValueError(f'Unknown key: {key}')
+        name, types = _SETTINGS[key]
+        if not isinstance(value, types) or (bool not in types and isinstance(value, bool)):
+            raise ValueError(f'Invalid {key}: {value!r}')
+        settings[name] = value
+
+    files = obj.get('files')
+    if not isinstance(files, list) or not files:
+        raise ValueError('Missing list of files')
+    for f in files:
+        if not isinstance(f, str) or not f:
+            raise ValueError(f'Invalid file: {f!r}')
+    return settings, [os.path.join(directory, f) for f in files]
+
+
+class Manifest:
+    """
+    Galleries and their files from a JSON Lines file
+
+    path: Path to manifest file or "-" to read it from stdin
+    defaults: Keyword arguments for :class:`pyimgbox.Gallery` that are used
+              for settings that are missing in the manifest
+    max_per_gallery: Maximum number of files in one gallery or None
+
+    Each line is a JSON object with a list of "files" and the optional keys
+    "title", "thumb_width", "square_thumbs", "adult" and "comments". Relative
+    file paths are relative to the directory of the manifest. Empty lines are
+    ignored.
+
+    The whole manifest is read immediately so that it is validated before any
+    uploads start.
+
+    Iterating over an instance yields 2-tuples of :class:`pyimgbox.Gallery`
+    and file path, which is what :func:`~._upload.upload_many` expects. This
+    is only possible in an ``async with`` block, which closes all galleries
+    and their shared connection pool.
+
+    Raise ValueError if the manifest is invalid.
+    Raise OSError if reading the manifest fails.
+    """
+
+    def __init__(self, path, defaults, max_per_gallery=None):
+        self._max_per_gallery = max_per_gallery
+        self._galleries = []
+        self._transport = None
+        if path == '-':
+            self._entries = self._read(sys.stdin, '<stdin>', defaults, '')
+        else:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._entries = self._read(f, path, defaults, os.path.dirname(path))
+            except OSError as e:
+                raise OSError(f'{path}: {e.strerror}')
+
+    @staticmethod
+    def _read(f, path, defaults, directory):
+        entries = []
+        for number, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    entries.append(_parse(line, defaults, directory))
+                except ValueError as e:
+                    raise ValueError(f'{path}:{number}: {e}')
+        if not entries:
+            raise ValueError(f'{path}: No galleries')
+        return entries
+
+    async def __aenter__(self):
+        self._transport = httpx.AsyncHTTPTransport()
+        return self
+
+    async def __aexit__(self, *_):
+        for g in self._galleries:
+            await g.close()
+        await self._transport.aclose()
+
+    def __iter__(self):
+        if self._transport is None:
+            raise RuntimeError('Manifest is not open')
+
+        for settings, files in self._entries:
+            gallery = _gallery.new(transport=self._transport, **settings)
+            self._galleries.append(gallery)
+            g = gallery
+            for index, filepath in enumerate(files):
+                number = index // self._max_per_gallery if self._max_per_gallery else 0
+                if number > 0 and index % self._max_per_gallery == 0:
+                    g = _gallery.copy(gallery, number=number + 1, transport=self._transport)
+                    self._galleries.append(g)
+                yield g, filepath
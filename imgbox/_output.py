@@ -1,77 +1,156 @@
-import os
-import sys
-
-import pyimgbox
-
-
-# https://stackoverflow.com/a/55930068
-async def _async_enumerate(async_iter, start=0):
-    n = start
-    async for item in async_iter:
-        yield n, item
-        n += 1
-
-
-def _assert_file_ok(filepath):
-    if not os.path.exists(filepath):
-        raise AssertionError('No such file')
-    if not os.path.isfile(filepath):
-        raise AssertionError('Not a file')
-    if not os.access(filepath, os.R_OK):
-        raise AssertionError('Not readable')
-    if os.path.getsize(filepath) > pyimgbox.MAX_FILE_SIZE:
-        raise AssertionError(f'File is larger than {pyimgbox.MAX_FILE_SIZE} bytes')
-
-
-def _all_files_ok(filepaths):
-    # We want to check file readability before creating the gallery.
-    # Gallery.add() calls create() automatically, but we don't want to wait for
-    # the first file upload to finish before printing the gallery URL.
-    ok = True
-    for filepath in filepaths:
-        try:
-            _assert_file_ok(filepath)
-        except AssertionError as e:
-            ok = False
-            print(f'{filepath}: {e}', file=sys.stderr)
-    return ok
-
-
-async def text(gallery, filepaths):
-    exit_code = 0
-    if not _all_files_ok(filepaths):
-        exit_code = 1
+import functools
+
+from . import _trace, _upload
+
+
+def _uploads(gallery, filepaths, max_per_gallery=None, **kwargs):
+    # Upload `filepaths` to `gallery` or, if `gallery` is None, upload
+    # (gallery, filepath) tuples from `filepaths`
+    if gallery is None:
+        return _upload.upload_many(filepaths, **kwargs)
     else:
-        try:
-            await gallery.create()
-            print(f'Gallery: {gallery.url}')
-            print(f'   Edit: {gallery.edit_url}')
-        except ConnectionError as e:
-            exit_code = 1
-            print(str(e), file=sys.stderr)
-        else:
-            async for sub in gallery.add(filepaths):
-                print(f'* {sub.filename}')
-                if sub.success:
-                    print(f'      Image: {sub.image_url}')
-                    print(f'  Thumbnail: {sub.thumbnail_url}')
-                    print(f'    Webpage: {sub.web_url}')
-                else:
-                    print(f'  {sub.error}')
-                    exit_code = 1
+        return _upload.upload(gallery, filepaths, max_per_gallery=max_per_gallery, **kwargs)
+
+
+def _printable(path):
+    # Paths that are not valid UTF-8 contain surrogate escapes, which can't be
+    # encoded for printing
+    return path.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+
+
+def _printable_submission(sub):
+    # JSON can't contain surrogate escapes either
+    return {**sub, **{key: _printable(sub[key]) for key in ('filepath', 'filename')
+                      if sub[key] is not None}}
+
+
+def _print_gallery(gallery):
+    print(f'Gallery: {gallery.url}')
+    print(f'   Edit: {gallery.edit_url}')
+
+
+async def text(gallery, filepaths, jobs=1, order='input', schedule='input', cache=None,
+               journal=None, max_per_gallery=None, preprocessor=None, retry=None,
+               tracer=None, progress=None, rate_limit=None, deadline=None):
+    exit_code = 0
+
+    def print_first_gallery(g):
+        # The URL is printed as soon as the gallery exists, before the first
+        # image is uploaded
+        if g is gallery:
+            if progress is not None:
+                progress.clear()
+            _print_gallery(g)
+
+    uploads = _uploads(gallery, filepaths, jobs=jobs, order=order, schedule=schedule,
+                       cache=cache, journal=journal,
+                       max_per_gallery=max_per_gallery,
+                       preprocessor=preprocessor, retry=retry,
+                       tracer=tracer, progress=progress, rate_limit=rate_limit,
+                       deadline=deadline, on_gallery=print_first_gallery)
+    current_gallery = gallery
+    async for g, sub in uploads:
+        with _trace.span(tracer, 'print', 'output'):
+            if progress is not None:
+                progress.clear()
+            if g is not current_gallery and g.created:
+                current_gallery = g
+                _print_gallery(g)
+            print(f'* {_printable(sub.filename)}')
+            if sub.success:
+                print(f'      Image: {sub.image_url}')
+                print(f'  Thumbnail: {sub.thumbnail_url}')
+                print(f'    Webpage: {sub.web_url}')
+            else:
+                print(f'  {sub.error}')
+                exit_code = 1
     return exit_code
 
 
-async def json(gallery, filepaths):
+async def json(gallery, filepaths, jobs=1, order='input', schedule='input', cache=None,
+               journal=None, max_per_gallery=None, preprocessor=None, retry=None,
+               tracer=None, progress=None, rate_limit=None, deadline=None):
+    import json
     exit_code = 0
-    if not _all_files_ok(filepaths):
-        exit_code = 1
-    else:
-        submissions = []
-        async for sub in gallery.add(filepaths):
-            submissions.append(sub)
+    # Print each submission as soon as it is yielded instead of collecting
+    # all of them. The output is identical to json.dumps(submissions, indent=4).
+    separator = '[\n'
+    uploads = _uploads(gallery, filepaths, jobs=jobs, order=order, schedule=schedule,
+                       cache=cache, journal=journal,
+                       max_per_gallery=max_per_gallery,
+                       preprocessor=preprocessor, retry=retry,
+                       tracer=tracer, progress=progress, rate_limit=rate_limit,
+                       deadline=deadline)
+    try:
+        async for g, sub in uploads:
+            with _trace.span(tracer, 'print', 'output'):
+                if progress is not None:
+                    progress.clear()
+                item = json.dumps(_printable_submission(sub), indent=4).replace('\n', '\n    ')
+                print(f'{separator}    {item}', end='')
+                separator = ',\n'
             if not sub.success:
                 exit_code = 1
-        import json
-        print(json.dumps(submissions, indent=4))
+    finally:
+        # Output is valid JSON even if uploading is cancelled
+        with _trace.span(tracer, 'print', 'output'):
+            if progress is not None:
+                progress.clear()
+            print('[]' if separator == '[\n' else '\n]')
+    return exit_code
+
+
+@functools.lru_cache(maxsize=None)
+def _get_compact_json_encoder():
+    # orjson is a lot faster, but it can't encode file paths that were decoded
+    # with the "surrogateescape" error handler.
+    import json
+    dumps = functools.partial(json.dumps, separators=(',', ':'))
+    try:
+        import orjson
+    except ImportError:
+        return dumps
+    else:
+        def orjson_dumps(obj):
+            try:
+                return orjson.dumps(obj).decode('utf-8')
+            except TypeError:
+                return dumps(obj)
+        return orjson_dumps
+
+
+async def ndjson(gallery, filepaths, jobs=1, order='input', schedule='input', cache=None,
+                 journal=None, max_per_gallery=None, preprocessor=None, retry=None,
+                 tracer=None, progress=None, rate_limit=None, deadline=None):
+    dumps = _get_compact_json_encoder()
+
+    def print_gallery(gallery):
+        print(dumps({'gallery_url': gallery.url, 'edit_url': gallery.edit_url}), flush=True)
+
+    def print_first_gallery(g):
+        # The URL is printed as soon as the gallery exists, before the first
+        # image is uploaded
+        if g is gallery:
+            if progress is not None:
+                progress.clear()
+            print_gallery(g)
+
+    exit_code = 0
+    uploads = _uploads(gallery, filepaths, jobs=jobs, order=order, schedule=schedule,
+                       cache=cache, journal=journal,
+                       max_per_gallery=max_per_gallery,
+                       preprocessor=preprocessor, retry=retry,
+                       tracer=tracer, progress=progress, rate_limit=rate_limit,
+                       deadline=deadline, on_gallery=print_first_gallery)
+    current_gallery = gallery
+    async for g, sub in uploads:
+        with _trace.span(tracer, 'print', 'output'):
+            if progress is not None:
+                progress.clear()
+            if g is not current_gallery and g.created:
+                current_gallery = g
+                print_gallery(g)
+            print(dumps(_printable_submission(sub)), flush=True)
+        if not sub.success:
+            exit_code = 1
     return exit_code
@@ -0,0 +1,17 @@
+import os
+
+# Default paths are needed to build the --help text, so this module must not
+# import anything that takes noticeable time
+
+
+def cache_path():
+    """Return path to cache database in the user's cache directory"""
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'imgbox', 'uploads.db')
+
+
+def gallery_store_path():
+    """Return path to gallery token store in the user's data directory"""
+    data_dir = (os.environ.get('XDG_DATA_HOME')
+                or os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(data_dir, 'imgbox', 'galleries.json')
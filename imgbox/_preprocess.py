@@ -0,0 +1,163 @@
+import asyncio
+import concurrent.futures
+import io
+import os
+import shutil
+import tempfile
+
+import pyimgbox
+
+from . import _gallery
+
+# EXIF tag that tells viewers how to rotate the image
+_EXIF_ORIENTATION = 0x0112
+
+# Maximum number of attempts to shrink an image below the size limit
+_MAX_ATTEMPTS = 8
+
+
+def _encode(img, fmt, optimize, **kwargs):
+    # Return encoded image as bytes. Metadata that is not passed explicitly is
+    # not written.
+    buffer = io.BytesIO()
+    if img.info.get('icc_profile'):
+        kwargs['icc_profile'] = img.info['icc_profile']
+    if fmt == 'JPEG':
+        orientation = img.getexif().get(_EXIF_ORIENTATION)
+        if orientation and orientation != 1:
+            exif = img.getexif()
+            exif.clear()
+            exif[_EXIF_ORIENTATION] = orientation
+            kwargs['exif'] = exif
+    img.save(buffer, format=fmt, optimize=optimize, **kwargs)
+    return buffer.getvalue()
+
+
+def _shrink(img, fmt, max_size):
+    # Return encoded image that is not larger than `max_size` bytes
+    from PIL import Image
+
+    kwargs = {'quality': 85} if fmt == 'JPEG' else {}
+    data = _encode(img, fmt, optimize=True, **kwargs)
+    for _ in range(_MAX_ATTEMPTS):
+        if len(data) <= max_size:
+            return data
+        # File size is roughly proportional to the number of pixels
+        factor = (max_size / len(data)) ** 0.5 * 0.95
+        size = (max(1, int(img.width * factor)), max(1, int(img.height * factor)))
+        img = img.resize(size, Image.LANCZOS)
+        data = _encode(img, fmt, optimize=True, **kwargs)
+
+    raise AssertionError(f"Can't shrink image below {max_size} bytes")
+
+
+def _process(filepath, outdir, max_size, optimize):
+    # Write processed copy of `filepath` to `outdir` and return its path or
+    # return None if `filepath` can be uploaded as it is. This runs in a
+    # separate process.
+    from PIL import Image
+
+    size = os.path.getsize(filepath)
+    try:
+        with Image.open(filepath) as img:
+            fmt = img.format
+            if fmt not in ('JPEG', 'PNG'):
+                if size > max_size:
+                    raise AssertionError(f'Unsupported image format: {fmt}')
+                return None
+            img.load()
+            if size > max_size:
+                data = _shrink(img, fmt, max_size)
+            elif optimize:
+                if fmt == 'JPEG':
+                    # Re-use quantization tables so that image quality doesn't
+                    # change
+                    data = _encode(img, fmt, optimize=True, quality='keep', subsampling='keep')
+                else:
+                    data = _encode(img, fmt, optimize=True)
+                if len(data) >= size:
+                    return None
+            else:
+                return None
+    except (OSError, Image.DecompressionBombError) as e:
+        raise AssertionError(f'Invalid image: {e}')
+
+    # Keep the file name because it is uploaded with the image
+    processed_filepath = os.path.join(tempfile.mkdtemp(dir=outdir),
+                                      _gallery.upload_name(filepath))
+    with open(processed_filepath, 'wb') as f:
+        f.write(data)
+    return processed_filepath
+
+
+class Preprocessor:
+    """
+    Shrink and optimize images before they are uploaded
+
+    fit: Whether to shrink images that are larger than
+         :attr:`pyimgbox.MAX_FILE_SIZE`
+    optimize: Whether to optimize all images without losing quality and remove
+              their metadata
+    workers: Maximum number of images that are processed simultaneously or
+             None to use all CPUs
+
+    Images are processed in separate processes. Processed images are written to
+    a temporary directory that is removed by :meth:`close`.
+
+    Raise ValueError if Pillow is not installed.
+    """
+
+    def __init__(self, fit=False, optimize=False, workers=None):
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise ValueError('Preprocessing images requires Pillow: pip install Pillow')
+        self._fit = bool(fit)
+        self._optimize = bool(optimize)
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self._tmpdir = tempfile.mkdtemp(prefix='imgbox.')
+
+    @property
+    def fit(self):
+        """Whether images that are larger than the size limit are shrunk"""
+        return self._fit
+
+    @property
+    def optimize(self):
+        """Whether all images are optimized"""
+        return self._optimize
+
+    def close(self):
+        """Stop worker processes and remove processed images"""
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    async def process(self, filepath, st):
+        """
+        Return path to file that should be uploaded instead of `filepath`
+
+        filepath: Path to image file
+        st: :class:`os.stat_result` of `filepath`
+
+        The returned path is `filepath` if the image doesn't need to be
+        processed. Otherwise, it is a processed copy that should be passed to
+        :meth:`release` after it was uploaded.
+
+        Raise AssertionError if the image can't be processed.
+        """
+        max_size = pyimgbox.MAX_FILE_SIZE
+        if st.st_size <= max_size and not self._optimize:
+            return filepath
+        elif st.st_size > max_size and not self._fit:
+            raise AssertionError(f'File is larger than {max_size} bytes')
+
+        loop = asyncio.get_running_loop()
+        processed_filepath = await loop.run_in_executor(
+            self._executor, _process, filepath, self._tmpdir, max_size, self._optimize,
+        )
+        return processed_filepath or filepath
+
+    def release(self, filepath):
+        """Remove `filepath` if it was returned by :meth:`process`"""
+        if os.path.dirname(os.path.dirname(filepath)) == self._tmpdir:
+            shutil.rmtree(os.path.dirname(filepath), ignore_errors=True)
@@ -0,0 +1,216 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import sys
+import time
+
+import httpx
+
+from . import __command_name__, _gallery
+
+# Number of seconds between updates of the progress line on a terminal
+_TTY_INTERVAL = 0.2
+
+# Number of seconds between progress log lines if stderr is not a terminal
+_LOG_INTERVAL = 10
+
+# Number of seconds throughput is averaged over
+_RATE_WINDOW = 5
+
+# Upload that is sending requests in the current task or None
+_current_upload = contextvars.ContextVar('current_upload', default=None)
+
+
+class _Upload:
+    # Number of bytes of one file that were sent by its latest request
+
+    __slots__ = ('size', 'sent')
+
+    def __init__(self, size):
+        self.size = size
+        self.sent = 0
+
+
+class _CountingStream(httpx.AsyncByteStream):
+    # Request body that counts the bytes that are read from it
+
+    def __init__(self, stream, progress, upload):
+        self._stream = stream
+        self._progress = progress
+        self._upload = upload
+
+    async def __aiter__(self):
+        # A repeated request starts from zero
+        self._upload.sent = 0
+        async for chunk in self._stream:
+            self._upload.sent += len(chunk)
+            self._progress._sent += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        if hasattr(self._stream, 'aclose'):
+            await self._stream.aclose()
+
+
+_SIZE_UNITS = ('B', 'KiB', 'MiB', 'GiB', 'TiB')
+
+
+def format_size(size):
+    """Return number of bytes `size` in the largest fitting unit, e.g. "1.5 MiB\""""
+    for unit in _SIZE_UNITS:
+        if size < 1024 or unit == _SIZE_UNITS[-1]:
+            break
+        size /= 1024
+    if unit == 'B':
+        return f'{size:.0f} B'
+    return f'{size:.1f} {unit}'
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    elif seconds >= 60:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    else:
+        return f'{seconds}s'
+
+
+class Progress:
+    """
+    Display number of uploaded files and bytes, throughput and ETA
+
+    stream: File object the progress is written to
+
+    If `stream` is a terminal, one line is updated several times per second.
+    Otherwise, a line is written every few seconds.
+
+    Uploads only increment counters. All formatting and writing happens in
+    :meth:`display`.
+
+    The ETA is only known after the last file path was read because only files
+    that are about to be uploaded are validated.
+    """
+
+    def __init__(self, stream=None):
+        self._stream = stream if stream is not None else sys.stderr
+        self._isatty = self._stream.isatty()
+        self._files_total = 0
+        self._files_done = 0
+        self._bytes_total = 0
+        self._bytes_done = 0
+        self._sent = 0
+        self._input_finished = False
+        self._uploads = set()
+        self._samples = collections.deque()
+        self._line_displayed = False
+
+    def add_file(self):
+        """Count one more file to process"""
+        self._files_total += 1
+
+    def add_bytes(self, size):
+        """Count `size` more bytes to upload"""
+        self._bytes_total += size
+
+    def finish_input(self):
+        """Remember that :meth:`add_file` won't be called anymore"""
+        self._input_finished = True
+
+    def finish_file(self):
+        """Count one more processed file"""
+        self._files_done += 1
+
+    def watch(self, gallery):
+        """Count bytes that are sent by :meth:`uploading` blocks to `gallery`"""
+        _gallery.add_event_hook(gallery, 'request', self._on_request)
+
+    async def _on_request(self, request):
+        upload = _current_upload.get()
+        if upload is not None and isinstance(request.stream, httpx.AsyncByteStream):
+            request.stream = _CountingStream(request.stream, self, upload)
+
+    @contextlib.contextmanager
+    def uploading(self, size):
+        """
+        Context manager that counts the bytes of the file upload in its body
+
+        size: Size of the uploaded file in bytes
+        """
+        upload = _Upload(size)
+        self._uploads.add(upload)
+        token = _current_upload.set(upload)
+        try:
+            yield
+        finally:
+            _current_upload.reset(token)
+            self._uploads.discard(upload)
+            self._bytes_done += size
+
+    @property
+    def uploaded(self):
+        """Number of bytes of finished and partially sent files"""
+        # Multipart encoding adds a few bytes to each request body
+        return self._bytes_done + sum(min(u.sent, u.size) for u in self._uploads)
+
+    def _rate(self, now):
+        # Bytes per second over the last few seconds
+        self._samples.append((now, self._sent))
+        while now - self._samples[0][0] > _RATE_WINDOW:
+            self._samples.popleft()
+        then, sent = self._samples[0]
+        return (self._sent - sent) / (now - then) if now > then else 0
+
+    def format(self, now=None):
+        """Return human-readable progress"""
+        rate = self._rate(time.monotonic() if now is None else now)
+        uploaded = self.uploaded
+        if self._input_finished:
+            parts = [f'{self._files_done}/{self._files_total} files',
+                     f'{format_size(uploaded)}/{format_size(self._bytes_total)}',
+                     f'{format_size(rate)}/s']
+            remaining = self._bytes_total - uploaded
+            if remaining <= 0:
+                pass
+            elif rate > 0:
+                parts.append(f'ETA {_format_duration(remaining / rate)}')
+            else:
+                parts.append('ETA ?')
+        else:
+            parts = [f'{self._files_done}/? files',
+                     format_size(uploaded),
+                     f'{format_size(rate)}/s']
+        return ', '.join(parts)
+
+    def clear(self):
+        """Remove progress line from terminal, e.g. before printing to stdout"""
+        if self._line_displayed:
+            self._stream.write('\r\x1b[K')
+            self._stream.flush()
+            self._line_displayed = False
+
+    def _write(self):
+        if self._isatty:
+            self._stream.write(f'\r\x1b[K{self.format()}')
+            self._line_displayed = True
+        else:
+            self._stream.write(f'{__command_name__}: {self.format()}\n')
+        self._stream.flush()
+
+    async def display(self):
+        """Write progress periodically until cancelled"""
+        interval = _TTY_INTERVAL if self._isatty else _LOG_INTERVAL
+        # Throughput is measured from now on
+        self._rate(time.monotonic())
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self._write()
+        finally:
+            # Final state
+            self._write()
+            if self._isatty:
+                self._stream.write('\n')
+                self._stream.flush()
+                self._line_displayed = False
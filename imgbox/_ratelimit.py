@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+
+from . import _gallery, _progress
+
+# Maximum number of bytes that are sent at once
+_CHUNK_SIZE = 16 * 1024
+
+# Number of seconds of unused bandwidth that may be used later, e.g. to catch
+# up after sleeping for too long
+_BURST_SECONDS = 0.1
+
+
+class _LimitedStream(httpx.AsyncByteStream):
+    # Request body that is sent in small chunks as fast as `rate_limit` allows
+
+    def __init__(self, stream, rate_limit):
+        self._stream = stream
+        self._rate_limit = rate_limit
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            for i in range(0, len(chunk), _CHUNK_SIZE):
+                part = chunk[i:i + _CHUNK_SIZE]
+                await self._rate_limit.consume(len(part))
+                yield part
+
+    async def aclose(self):
+        if hasattr(self._stream, 'aclose'):
+            await self._stream.aclose()
+
+
+class RateLimit:
+    """
+    Token bucket that limits the upload bandwidth of many galleries
+
+    rate: Maximum number of bytes per second
+
+    All request bodies share the same bandwidth. Each body is sent in small
+    chunks, and each chunk waits for its turn, so the bandwidth is used evenly
+    instead of in bursts.
+    """
+
+    def __init__(self, rate):
+        self._rate = rate
+        self._burst = max(_CHUNK_SIZE, rate * _BURST_SECONDS)
+        # Time when the bucket is empty again
+        self._empty_at = None
+        self._sent = 0
+        self._first_sent = self._last_sent = None
+
+    @property
+    def rate(self):
+        """Maximum number of bytes per second"""
+        return self._rate
+
+    async def consume(self, size):
+        """Wait until `size` bytes may be sent"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._empty_at is None:
+            # Start with an empty bucket
+            self._empty_at = self._first_sent = now
+        # The bucket can't hold more than `_burst` bytes
+        self._empty_at = max(self._empty_at, now - self._burst / self._rate)
+        self._empty_at += size / self._rate
+        if self._empty_at > now:
+            await asyncio.sleep(self._empty_at - now)
+        self._last_sent = loop.time()
+        self._sent += size
+
+    def apply(self, request):
+        """Make the body of :class:`httpx.Request` `request` wait for bandwidth"""
+        if isinstance(request.stream, httpx.AsyncByteStream):
+            request.stream = _LimitedStream(request.stream, self)
+
+    async def _on_request(self, request):
+        self.apply(request)
+
+    def watch(self, gallery):
+        """Limit the request bodies that are sent by `gallery`"""
+        _gallery.add_event_hook(gallery, 'request', self._on_request)
+
+    def unwatch(self, gallery):
+        """Stop limiting the request bodies that are sent by `gallery`"""
+        _gallery.remove_event_hook(gallery, 'request', self._on_request)
+
+    @property
+    def sent(self):
+        """Number of bytes that were sent"""
+        return self._sent
+
+    @property
+    def effective_rate(self):
+        """Bytes per second from the first until the last sent chunk"""
+        if self._first_sent is None or self._last_sent <= self._first_sent:
+            return 0
+        return self._sent / (self._last_sent - self._first_sent)
+
+    def summary(self):
+        """Return human-readable number of sent bytes and effective rate"""
+        return (f'Sent {_progress.format_size(self._sent)} at '
+                f'{_progress.format_size(self.effective_rate)}/s '
+                f'(limit: {_progress.format_size(self._rate)}/s)')
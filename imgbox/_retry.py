@@ -0,0 +1,273 @@
+import asyncio
+import contextvars
+import email.utils
+import random
+import time
+
+import httpx
+import pyimgbox
+
+from . import _gallery
+
+import logging  # isort:skip
+_log = logging.getLogger('imgbox')
+
+# Responses to the requests of the current attempt or None for requests without
+# response. This is a list so that tasks that are started by asyncio.wait_for()
+# can report to the task that started them.
+_exchanges = contextvars.ContextVar('exchanges')
+
+# Event loop time when the current attempt last sent or received anything. This
+# is a list for the same reason as `_exchanges`.
+_activity = contextvars.ContextVar('activity')
+
+# Status codes of responses that tell us to slow down
+_THROTTLING_STATUS_CODES = (429, 503)
+
+
+def _parse_retry_after(value):
+    # Return number of seconds from "Retry-After" header or None
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+class _Stalled(Exception):
+    pass
+
+
+class _ActivityStream(httpx.AsyncByteStream):
+    # Request body that records when each chunk is sent
+
+    def __init__(self, stream, activity):
+        self._stream = stream
+        self._activity = activity
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        async for chunk in self._stream:
+            self._activity[0] = loop.time()
+            yield chunk
+
+    async def aclose(self):
+        if hasattr(self._stream, 'aclose'):
+            await self._stream.aclose()
+
+
+class Retry:
+    """
+    Repeat gallery creation and uploads that fail temporarily
+
+    attempts: Maximum number of attempts per request
+    timeout: Maximum number of seconds per attempt or None
+    stall_timeout: Maximum number of seconds an attempt may go without sending
+                   or receiving anything or None
+    delay: Maximum number of seconds before the first repetition; it doubles
+           with each repetition and is randomized to spread out simultaneous
+           requests
+    max_delay: Maximum number of seconds between attempts
+    breaker_threshold: Number of consecutive failures of any request after
+                       which all requests are paused
+    breaker_pause: Number of seconds all requests are paused
+
+    Connection errors, timeouts, stalled attempts and server errors (5xx) are
+    temporary. Other errors are returned or raised immediately.
+
+    If the server responds with 429 or 503, all requests are paused for the
+    number of seconds in the "Retry-After" header.
+    """
+
+    def __init__(self, attempts=3, timeout=None, stall_timeout=None, delay=1,
+                 max_delay=60, breaker_threshold=5, breaker_pause=30):
+        self._attempts = attempts
+        self._timeout = timeout
+        self._stall_timeout = stall_timeout
+        self._delay = delay
+        self._max_delay = max_delay
+        self._breaker_threshold = breaker_threshold
+        self._breaker_pause = breaker_pause
+        self._failures = 0
+        self._paused_until = 0
+        self._stalled = 0
+
+    @property
+    def attempts(self):
+        """Maximum number of attempts per request"""
+        return self._attempts
+
+    @property
+    def timeout(self):
+        """Maximum number of seconds per attempt or None"""
+        return self._timeout
+
+    @property
+    def stall_timeout(self):
+        """Maximum number of seconds without progress per attempt or None"""
+        return self._stall_timeout
+
+    @property
+    def stalled(self):
+        """Number of requests that failed because their last attempt stalled"""
+        return self._stalled
+
+    async def _on_request(self, request):
+        exchanges = _exchanges.get(None)
+        if exchanges is not None:
+            exchanges.append(None)
+        activity = _activity.get(None)
+        if activity is not None:
+            activity[0] = asyncio.get_running_loop().time()
+            if isinstance(request.stream, httpx.AsyncByteStream):
+                request.stream = _ActivityStream(request.stream, activity)
+
+    async def _on_response(self, response):
+        exchanges = _exchanges.get(None)
+        if exchanges:
+            exchanges[-1] = response
+        activity = _activity.get(None)
+        if activity is not None:
+            activity[0] = asyncio.get_running_loop().time()
+
+    async def _attempt(self, request):
+        # Return return value of `request()`
+        #
+        # Raise asyncio.TimeoutError if it takes longer than `timeout`.
+        # Raise _Stalled if it doesn't send or receive anything for
+        # `stall_timeout` seconds.
+        if self._stall_timeout is None:
+            return await asyncio.wait_for(request(), timeout=self._timeout)
+
+        loop = asyncio.get_running_loop()
+        activity = [loop.time()]
+        token = _activity.set(activity)
+        try:
+            task = asyncio.ensure_future(asyncio.wait_for(request(), timeout=self._timeout))
+        finally:
+            _activity.reset(token)
+        try:
+            while not task.done():
+                idle = loop.time() - activity[0]
+                if idle >= self._stall_timeout:
+                    task.cancel()
+                    await asyncio.wait((task,))
+                    raise _Stalled()
+                await asyncio.wait((task,), timeout=self._stall_timeout - idle)
+            return task.result()
+        finally:
+            task.cancel()
+
+    def _pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def _wait(self):
+        # Wait until all requests may continue
+        while True:
+            remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+    def _is_temporary(self, exchanges):
+        # Without any request, the error happened locally
+        if not exchanges:
+            return False
+        response = exchanges[-1]
+        # Without response, the connection failed
+        if response is None:
+            return True
+        if response.status_code in _THROTTLING_STATUS_CODES:
+            retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                _log.debug('Throttled for %s seconds', retry_after)
+                self._pause(retry_after)
+            return True
+        return response.status_code >= 500
+
+    async def _run(self, gallery, request):
+        # Call `request` until it succeeds and return its return value, which is
+        # a 2-tuple of any object and an error message or None
+        _gallery.add_event_hook(gallery, 'request', self._on_request)
+        _gallery.add_event_hook(gallery, 'response', self._on_response)
+        for attempt in range(1, self._attempts + 1):
+            await self._wait()
+            exchanges = []
+            token = _exchanges.set(exchanges)
+            stalled = False
+            try:
+                result, error = await self._attempt(request)
+            except asyncio.TimeoutError:
+                result, error = None, f'Timeout after {self._timeout} seconds'
+                temporary = True
+            except _Stalled:
+                result, error = None, f'Stalled for {self._stall_timeout} seconds'
+                temporary = stalled = True
+            else:
+                temporary = self._is_temporary(exchanges)
+            finally:
+                _exchanges.reset(token)
+
+            if error is None:
+                self._failures = 0
+                break
+            elif not temporary or attempt >= self._attempts:
+                if stalled:
+                    self._stalled += 1
+                break
+
+            # Circuit breaker: Pause everything if the server seems to be down
+            self._failures += 1
+            if self._failures >= self._breaker_threshold:
+                _log.debug('%d consecutive failures: Pausing for %s seconds',
+                           self._failures, self._breaker_pause)
+                self._pause(self._breaker_pause)
+
+            delay = random.uniform(0, min(self._max_delay, self._delay * 2 ** (attempt - 1)))
+            _log.debug('%s: Retrying in %.1f seconds', error, delay)
+            await asyncio.sleep(delay)
+
+        return result, error
+
+    async def create(self, gallery):
+        """
+        Call `gallery.create()` until it succeeds
+
+        Raise ConnectionError if the last attempt fails.
+        """
+        async def request():
+            try:
+                await gallery.create()
+            except ConnectionError as e:
+                return None, str(e)
+            return None, None
+
+        _, error = await self._run(gallery, request)
+        if error is not None:
+            raise ConnectionError(error)
+
+    async def upload(self, gallery, filepath):
+        """
+        Call `gallery.upload(filepath)` until it succeeds
+
+        Return the last :class:`pyimgbox.Submission`.
+        """
+        async def request():
+            sub = await gallery.upload(filepath)
+            return sub, sub.error
+
+        sub, error = await self._run(gallery, request)
+        if sub is None:
+            sub = pyimgbox.Submission(filepath=filepath, error=error)
+        return sub
+
+    def unwatch(self, gallery):
+        """Remove the event hooks that :meth:`create` and :meth:`upload` added to `gallery`"""
+        _gallery.remove_event_hook(gallery, 'request', self._on_request)
+        _gallery.remove_event_hook(gallery, 'response', self._on_response)
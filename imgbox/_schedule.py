@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import itertools
+import math
+
+# Names of scheduling policies for --schedule
+POLICIES = ('input', 'smallest-first', 'largest-first')
+
+
+def _priority(policy, prepared):
+    # Return sort key of the file that is prepared by future `prepared`
+    if prepared is None or prepared.cancelled() or prepared.exception() is not None:
+        return -math.inf
+    result = prepared.result()
+    if not isinstance(result, tuple):
+        # Finished submission that doesn't need an upload
+        return -math.inf
+    _, size = result
+    return size if policy == 'smallest-first' else -size
+
+
+class Scheduler:
+    """
+    Queue of files that are prepared for uploading
+
+    policy: "input", "smallest-first" or "largest-first"
+    ahead: Maximum number of files that are prepared but not taken
+
+    "input" hands out files in the order they were added. The other policies
+    wait until each file is prepared and hand out the smallest or largest file
+    that is ready. Files that don't need to be uploaded are handed out first.
+
+    Only files that are prepared ahead are compared, so input of any length
+    can be scheduled.
+
+    Raise ValueError if `policy` is invalid.
+    """
+
+    def __init__(self, policy='input', ahead=32):
+        if policy not in POLICIES:
+            raise ValueError(f'Invalid schedule: {policy!r}')
+        self._policy = policy
+        self._ahead = asyncio.Semaphore(ahead)
+        self._queue = asyncio.PriorityQueue()
+        self._counter = itertools.count()
+        self._preparing = set()
+
+    def _put(self, priority, item, prepared=None):
+        # The counter keeps files with the same priority in input order and
+        # prevents comparing items
+        self._queue.put_nowait((priority, next(self._counter), item, prepared))
+
+    async def put(self, item, prepared):
+        """
+        Add `item` once `prepared` is done
+
+        item: Anything
+        prepared: Future that returns a :class:`pyimgbox.Submission` or a
+                  2-tuple of file path and size in bytes, or None if `item`
+                  doesn't need to be prepared
+
+        Block while `ahead` files are not taken yet.
+        """
+        await self._ahead.acquire()
+        if self._policy == 'input':
+            self._put(0, item, prepared)
+        elif prepared is None or prepared.done():
+            self._put(_priority(self._policy, prepared), item, prepared)
+        else:
+            self._preparing.add(prepared)
+            prepared.add_done_callback(functools.partial(self._prepared, item))
+
+    def _prepared(self, item, prepared):
+        self._preparing.discard(prepared)
+        self._put(_priority(self._policy, prepared), item, prepared)
+
+    async def finish(self, count):
+        """Hand out None `count` times after all items"""
+        if self._preparing:
+            await asyncio.wait(self._preparing)
+        for _ in range(count):
+            self._put(math.inf, None)
+
+    async def get(self):
+        """Return next item or None if there are no more items"""
+        _, _, item, _ = await self._queue.get()
+        if item is not None:
+            self._ahead.release()
+        return item
+
+    def cancel(self):
+        """Cancel every future that was passed to :meth:`put` and is not taken"""
+        for prepared in tuple(self._preparing):
+            prepared.cancel()
+        while not self._queue.empty():
+            prepared = self._queue.get_nowait()[3]
+            if prepared is not None:
+                prepared.cancel()
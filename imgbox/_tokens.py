@@ -0,0 +1,85 @@
+import json
+import os
+import re
+
+# token_id and token_secret from pyimgbox's EDIT_URL_FORMAT
+_EDIT_URL_REGEX = re.compile(r'^https?://(?:www\.)?imgbox\.com/upload/edit/([^/]+)/([^/?#]+)/?$')
+
+
+def parse_edit_url(url):
+    """Return 2-tuple of token ID and secret from edit URL `url` or None"""
+    match = _EDIT_URL_REGEX.match(url)
+    if match:
+        return match.groups()
+
+
+class TokenStore:
+    """
+    Remember credentials of galleries by name
+
+    path: Path to JSON file; parent directories are created when a gallery is
+          saved
+
+    The file is a JSON object that maps names to the return values of
+    :func:`~._gallery.get_token`. It is only readable by the user because
+    anyone with the credentials can add images to a gallery.
+
+    Raise OSError if `path` exists and can't be read or is not a valid store.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._tokens = self._read()
+
+    @property
+    def path(self):
+        """Path to JSON file"""
+        return self._path
+
+    def _read(self):
+        try:
+            with open(self._path, 'r') as f:
+                tokens = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            raise OSError(f'{self._path}: {e.strerror}')
+        except ValueError as e:
+            raise OSError(f'{self._path}: Invalid gallery store: {e}')
+        if not isinstance(tokens, dict) or not all(isinstance(t, dict) for t in tokens.values()):
+            raise OSError(f'{self._path}: Invalid gallery store')
+        return tokens
+
+    def get(self, name):
+        """Return credentials of gallery `name` or None"""
+        return self._tokens.get(name)
+
+    def find(self, edit_url):
+        """Return name and credentials of the gallery with `edit_url` or None"""
+        ids = parse_edit_url(edit_url)
+        for name, token in self._tokens.items():
+            if ids == (str(token.get('token_id')), str(token.get('token_secret'))):
+                return name, token
+
+    def save(self, name, token):
+        """
+        Remember credentials `token` of gallery `name`
+
+        Galleries that were saved by other processes in the meantime are kept.
+
+        Raise OSError if the store can't be written.
+        """
+        self._tokens = self._read()
+        self._tokens[name] = token
+        tmp_path = f'{self._path}.tmp'
+        try:
+            dirpath = os.path.dirname(self._path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w') as f:
+                json.dump(self._tokens, f, indent=2, sort_keys=True)
+            # Readers never see a partially written store
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            raise OSError(f'{self._path}: {e.strerror}')
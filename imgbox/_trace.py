@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import time
+
+# Returned by span() if tracing is disabled
+_NO_SPAN = contextlib.nullcontext()
+
+
+def _percentile(values, percent):
+    # Nearest-rank percentile of sorted `values`
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[index]
+
+
+def span(tracer, name, category, id=None, **args):
+    """
+    Return :meth:`Tracer.span` context manager or one that does nothing if
+    `tracer` is None
+    """
+    if tracer is None:
+        return _NO_SPAN
+    else:
+        return tracer.span(name, category, id=id, **args)
+
+
+class Tracer:
+    """
+    Record how long each phase of each upload takes
+
+    lag_interval: Number of seconds between measurements of how long the event
+                  loop is blocked
+
+    Events are recorded in the Chrome trace event format, which can be opened
+    with https://ui.perfetto.dev/ or chrome://tracing.
+    """
+
+    def __init__(self, lag_interval=0.1):
+        self._lag_interval = lag_interval
+        self._start = time.perf_counter()
+        self._events = []
+        self._durations = collections.defaultdict(list)
+        self._lags = []
+
+    def _timestamp(self):
+        # Microseconds since the tracer was created
+        return (time.perf_counter() - self._start) * 1e6
+
+    @contextlib.contextmanager
+    def span(self, name, category, id=None, **args):
+        """
+        Context manager that records the time spent in its body
+
+        name: Name of the phase
+        category: Name of the group of phases, e.g. "file" or "gallery"
+        id: Anything that identifies the file, gallery, etc or None
+
+        Spans with the same `id` and `category` are displayed in the same row.
+        Spans without `id` are displayed in the row of the main thread.
+
+        All other keyword arguments are stored in the event.
+        """
+        start = self._timestamp()
+        try:
+            yield
+        finally:
+            end = self._timestamp()
+            self._durations[(category, name)].append((end - start) / 1e6)
+            event = {'name': name, 'cat': category, 'pid': os.getpid(), 'args': args}
+            if id is None:
+                self._events.append({**event, 'ph': 'X', 'tid': 'main',
+                                     'ts': start, 'dur': end - start})
+            else:
+                self._events.append({**event, 'ph': 'b', 'id': str(id), 'ts': start})
+                self._events.append({**event, 'ph': 'e', 'id': str(id), 'ts': end})
+
+    async def sample_lag(self):
+        """Measure event loop lag until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(self._lag_interval)
+            lag = max(0, loop.time() - before - self._lag_interval)
+            self._lags.append(lag)
+            self._events.append({
+                'name': 'event loop lag', 'ph': 'C', 'pid': os.getpid(),
+                'ts': self._timestamp(), 'args': {'ms': lag * 1000},
+            })
+
+    @property
+    def events(self):
+        """Sequence of recorded trace events"""
+        return tuple(self._events)
+
+    def write(self, path):
+        """
+        Write trace events as JSON to `path`
+
+        Raise OSError if writing fails.
+        """
+        try:
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+        except OSError as e:
+            raise OSError(f'{path}: {e.strerror}')
+
+    def summary(self):
+        """Return human-readable durations and event loop lag"""
+        def stats(values):
+            values = sorted(values)
+            return (f'{len(values):>6} {sum(values):>9.3f} '
+                    f'{_percentile(values, 50) * 1000:>9.1f} '
+                    f'{_percentile(values, 95) * 1000:>9.1f} '
+                    f'{_percentile(values, 99) * 1000:>9.1f} '
+                    f'{values[-1] * 1000:>9.1f}')
+
+        rows = [(f'{category} {name}', durations)
+                for (category, name), durations in self._durations.items()]
+        if self._lags:
+            rows.append(('event loop lag', self._lags))
+        width = max([len('Phase')] + [len(phase) for phase, _ in rows])
+        lines = [f'{"Phase":<{width}} {"Count":>6} {"Total s":>9} {"p50 ms":>9} '
+                 f'{"p95 ms":>9} {"p99 ms":>9} {"Max ms":>9}']
+        for phase, durations in rows:
+            lines.append(f'{phase:<{width}} {stats(durations)}')
+        lines.append(f'Total time: {time.perf_counter() - self._start:.3f} s')
+        return '\n'.join(lines)
@@ -0,0 +1,510 @@
+import asyncio
+import collections
+import contextlib
+import itertools
+import os
+import shutil
+import stat
+import tempfile
+import weakref
+
+import pyimgbox
+
+from . import _gallery, _schedule, _trace
+
+# Maximum number of files that are validated in advance while other files are
+# still being uploaded
+_VALIDATE_AHEAD = 32
+
+# Maximum number of finished submissions that wait for a slower previous
+# submission if order is "input"
+_REORDER_AHEAD = 1000
+
+# Returned by _progress_span() if progress is not displayed
+_NO_SPAN = contextlib.nullcontext()
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when uploading is stopped because it took too long"""
+
+
+def _progress_span(progress, size):
+    if progress is None:
+        return _NO_SPAN
+    else:
+        return progress.uploading(size)
+
+
+async def _aiter(iterable):
+    # Turn any iterable into an asynchronous iterable
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+# https://stackoverflow.com/a/55930068
+async def _async_enumerate(async_iter, start=0):
+    n = start
+    async for item in async_iter:
+        yield n, item
+        n += 1
+
+
+def _is_readable(st):
+    # Equivalent to os.access(filepath, os.R_OK) without another system call,
+    # except that ACLs are ignored
+    uid = os.geteuid()
+    if uid == 0:
+        return True
+    elif st.st_uid == uid:
+        return bool(st.st_mode & stat.S_IRUSR)
+    elif st.st_gid == os.getegid() or st.st_gid in os.getgroups():
+        return bool(st.st_mode & stat.S_IRGRP)
+    else:
+        return bool(st.st_mode & stat.S_IROTH)
+
+
+def _check_file(filepath, max_size=pyimgbox.MAX_FILE_SIZE):
+    """
+    Return :class:`os.stat_result` of `filepath`
+
+    max_size: Maximum file size in bytes or None
+
+    Permissions are checked with the mode bits of `filepath`, so files that an
+    ACL denies access to pass validation and only fail when pyimgbox opens
+    them.
+
+    Raise AssertionError if `filepath` can't be uploaded.
+    """
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        raise AssertionError('No such file')
+    except OSError as e:
+        raise AssertionError(e.strerror)
+    if not stat.S_ISREG(st.st_mode):
+        raise AssertionError('Not a file')
+    if not _is_readable(st):
+        raise AssertionError('Not readable')
+    if max_size is not None and st.st_size > max_size:
+        raise AssertionError(f'File is larger than {max_size} bytes')
+    return st
+
+
+def _link(filepath, linkdir):
+    # Return path to a symbolic link to `filepath` in a new subdirectory of
+    # `linkdir` that has the name the file is uploaded with
+    link_filepath = os.path.join(tempfile.mkdtemp(dir=linkdir), _gallery.upload_name(filepath))
+    os.symlink(os.path.abspath(filepath), link_filepath)
+    return link_filepath
+
+
+# Tasks that are currently creating galleries
+_creations = weakref.WeakKeyDictionary()
+
+
+async def _create_gallery(gallery, retry):
+    if retry is not None:
+        await retry.create(gallery)
+    else:
+        await gallery.create()
+
+
+async def create_gallery(gallery, retry=None):
+    """
+    Create `gallery` unless it is already created
+
+    retry: :class:`~._retry.Retry` instance or None
+
+    Simultaneous calls for the same `gallery` wait for the same request, so
+    the gallery can be created by whoever needs it first. If that request
+    fails, all of them raise the same exception, but later calls try again.
+
+    Raise ConnectionError if creating `gallery` fails.
+    """
+    if not gallery.created:
+        creation = _creations.get(gallery)
+        if creation is None:
+            creation = _creations[gallery] = asyncio.ensure_future(_create_gallery(gallery, retry))
+            creation.add_done_callback(lambda _: _creations.pop(gallery, None))
+        # Cancelling one caller must not cancel the request for the others
+        await asyncio.shield(creation)
+
+
+async def upload(gallery, filepaths, jobs=1, order='input', schedule='input', cache=None,
+                 journal=None, max_per_gallery=None, preprocessor=None, retry=None,
+                 tracer=None, progress=None, rate_limit=None, deadline=None,
+                 on_gallery=None):
+    """
+    Upload files to `gallery` with up to `jobs` simultaneous uploads
+
+    gallery: :class:`pyimgbox.Gallery` instance
+    filepaths: Iterable or asynchronous iterable of paths to image files
+    jobs: Maximum number of simultaneous uploads
+    order: "input" to yield submissions in the same order as `filepaths` or
+           "completion" to yield them as soon as they are finished
+    schedule: "input" to upload files in the same order as `filepaths`,
+              "smallest-first" or "largest-first"
+    cache: :class:`~._cache.Cache` instance or None
+    journal: :class:`~._journal.Journal` instance or None
+    max_per_gallery: Maximum number of files in one gallery or None
+    preprocessor: :class:`~._preprocess.Preprocessor` instance or None
+    retry: :class:`~._retry.Retry` instance or None
+    tracer: :class:`~._trace.Tracer` instance or None
+    progress: :class:`~._progress.Progress` instance or None
+    rate_limit: :class:`~._ratelimit.RateLimit` instance or None
+    deadline: Event loop time (see :meth:`asyncio.loop.time`) when uploading
+              stops or None
+    on_gallery: Function that is called with each gallery as soon as it is
+                created or reopened or None
+
+    After `max_per_gallery` files, the following files are uploaded to a new
+    gallery with the same settings as `gallery`. All galleries share the same
+    `jobs` simultaneous uploads.
+
+    See :func:`upload_many` for everything else.
+
+    Yield 2-tuples of :class:`pyimgbox.Gallery` and :class:`pyimgbox.Submission`
+    objects asynchronously.
+    """
+    # Copies of `gallery` that are not closed yet
+    copies = []
+
+    async def items():
+        g = gallery
+        async for index, filepath in _async_enumerate(_aiter(filepaths)):
+            if max_per_gallery and index > 0 and index % max_per_gallery == 0:
+                g = _gallery.copy(gallery, number=index // max_per_gallery + 1)
+                copies.append(g)
+            yield g, filepath
+
+    uploads = upload_many(items(), jobs=jobs, order=order, schedule=schedule, cache=cache,
+                          journal=journal, preprocessor=preprocessor,
+                          retry=retry, tracer=tracer, progress=progress,
+                          rate_limit=rate_limit, deadline=deadline,
+                          on_gallery=on_gallery)
+    # Close each copy as soon as all of its files are yielded so that a batch
+    # of any size keeps only the connection pools of a few galleries open
+    yielded = collections.Counter()
+    try:
+        async for g, sub in uploads:
+            yield g, sub
+            if g is not gallery:
+                yielded[g] += 1
+                if yielded[g] == max_per_gallery:
+                    del yielded[g]
+                    copies.remove(g)
+                    await g.close()
+    finally:
+        await uploads.aclose()
+        for g in copies:
+            await g.close()
+
+
+async def upload_many(items, jobs=1, order='input', schedule='input', cache=None,
+                      journal=None, preprocessor=None, retry=None, tracer=None,
+                      progress=None, rate_limit=None, deadline=None, on_gallery=None):
+    """
+    Upload files to any number of galleries with up to `jobs` simultaneous
+    uploads
+
+    items: Iterable or asynchronous iterable of 2-tuples of
+           :class:`pyimgbox.Gallery` instance and path to image file
+    jobs: Maximum number of simultaneous uploads to all galleries
+    order: "input" to yield submissions in the same order as `items` or
+           "completion" to yield them as soon as they are finished
+    schedule: "input" to upload files in the same order as `items`,
+              "smallest-first" or "largest-first"
+    cache: :class:`~._cache.Cache` instance or None
+    journal: :class:`~._journal.Journal` instance or None
+    preprocessor: :class:`~._preprocess.Preprocessor` instance or None
+    retry: :class:`~._retry.Retry` instance or None
+    tracer: :class:`~._trace.Tracer` instance or None
+    progress: :class:`~._progress.Progress` instance or None
+    rate_limit: :class:`~._ratelimit.RateLimit` instance or None
+    deadline: Event loop time (see :meth:`asyncio.loop.time`) when uploading
+              stops or None
+    on_gallery: Function that is called with each gallery as soon as it is
+                created or reopened or None
+
+    Uploads start as soon as `items` provides the first file. Files are
+    validated in a thread pool while previous files are uploaded. Files that
+    don't exist, can't be read, etc are not uploaded and yield a failed
+    submission.
+
+    If `schedule` is "smallest-first" or "largest-first", the smallest or
+    largest of the files that are validated ahead is uploaded next.
+    Smallest-first yields the first URLs sooner. Largest-first keeps all `jobs`
+    busy until the end. `order` decides the order of the yielded submissions
+    either way.
+
+    Files that are found in `cache` with the same gallery settings are not
+    uploaded again. Their submission contains the URLs from the previous upload,
+    and they are not added to the gallery.
+
+    Galleries are numbered in the order they first appear in `items`. Every
+    gallery and every finished submission are recorded in `journal`. Files
+    that `journal` already knows about are not uploaded again and galleries
+    that `journal` knows about are reopened instead of created.
+
+    Each gallery is created when the first of its files is validated, so
+    invalid files are reported without a network connection and don't create
+    empty galleries. If creating fails, a failed submission is yielded for
+    each of its remaining files.
+
+    Files are processed by `preprocessor` ahead of the uploads, like they are
+    validated. The processed copy is uploaded, but the submission refers to the
+    original file. Files with names that are not valid UTF-8 are uploaded with
+    invalid bytes replaced by U+FFFD (see :func:`~._gallery.upload_name`).
+
+    Gallery creation and uploads that fail temporarily are repeated by `retry`.
+
+    The duration of each phase of each file and gallery is recorded by
+    `tracer`.
+
+    Processed files and sent bytes are counted by `progress`.
+
+    All galleries share the upload bandwidth of `rate_limit`.
+
+    At `deadline`, all remaining work is cancelled. Submissions that are
+    finished by then are still yielded, even if `order` is "input" and some
+    of the previous files are missing, before :class:`DeadlineExceeded` is
+    raised. Cancelled files are not recorded in `journal`.
+
+    Memory usage doesn't depend on the number of files. Files are read from
+    `items` only as fast as they are uploaded and yielded, and no more than
+    `_REORDER_AHEAD` finished submissions wait for a slower previous one.
+    Galleries are not kept after their last yielded submission unless the
+    caller keeps them. Neither does memory usage depend on the size of the
+    files because httpx streams each file from disk in 64 KiB chunks.
+
+    Galleries are not closed.
+
+    Raise :class:`DeadlineExceeded` if `deadline` is reached.
+
+    Yield 2-tuples of :class:`pyimgbox.Gallery` and :class:`pyimgbox.Submission`
+    objects asynchronously.
+    """
+    if order not in ('input', 'completion'):
+        raise ValueError(f'Invalid order: {order!r}')
+    scheduler = _schedule.Scheduler(schedule, ahead=_VALIDATE_AHEAD)
+
+    # Map each gallery to its number and to the task that creates it. A gallery
+    # is forgotten as soon as nothing else refers to it because it holds a
+    # connection pool.
+    gallery_numbers = weakref.WeakKeyDictionary()
+    creations = weakref.WeakKeyDictionary()
+    numbers = itertools.count()
+
+    async def open_gallery(g, number):
+        # Gallery.upload() creates the gallery automatically, but concurrent
+        # uploads would each create their own gallery.
+        if not g.created:
+            tokens = journal.gallery_tokens if journal is not None else {}
+            if number in tokens:
+                with _trace.span(tracer, 'reopen', 'gallery', id=number):
+                    await _gallery.reopen(g, tokens[number])
+            else:
+                with _trace.span(tracer, 'create', 'gallery', id=number):
+                    await create_gallery(g, retry)
+        if journal is not None:
+            journal.add_gallery(g, number)
+        if on_gallery is not None:
+            on_gallery(g)
+
+    def start_opening(g):
+        # Return task that creates or reopens `g` and start it if necessary
+        if g not in creations:
+            creations[g] = asyncio.ensure_future(open_gallery(g, gallery_numbers[g]))
+        return creations[g]
+
+    # Temporary directory for links to files with names that are not valid
+    # UTF-8 or None if it isn't created yet
+    linkdir = None
+
+    def release(upload_filepath):
+        # Remove link or processed copy that was uploaded instead of a file
+        if os.path.dirname(os.path.dirname(upload_filepath)) == linkdir:
+            shutil.rmtree(os.path.dirname(upload_filepath), ignore_errors=True)
+        else:
+            preprocessor.release(upload_filepath)
+
+    if preprocessor is not None and preprocessor.fit:
+        max_size = None
+    else:
+        max_size = pyimgbox.MAX_FILE_SIZE
+
+    async def prepare(index, g, filepath):
+        # Return finished submission or path and size of the file that must be
+        # uploaded
+        try:
+            with _trace.span(tracer, 'validate', 'file', id=index):
+                st = await loop.run_in_executor(None, _check_file, filepath, max_size)
+        except AssertionError as e:
+            return pyimgbox.Submission(filepath=filepath, error=str(e))
+
+        if cache is not None:
+            with _trace.span(tracer, 'cache', 'file', id=index):
+                sub = await cache.get(filepath, g, st)
+            if sub is not None:
+                return sub
+
+        size = st.st_size
+        if preprocessor is not None:
+            try:
+                with _trace.span(tracer, 'preprocess', 'file', id=index):
+                    upload_filepath = await preprocessor.process(filepath, st)
+            except AssertionError as e:
+                return pyimgbox.Submission(filepath=filepath, error=str(e))
+            if upload_filepath != filepath:
+                # Progress and scheduling depend on the bytes that are sent
+                size = (await loop.run_in_executor(None, os.stat, upload_filepath)).st_size
+        else:
+            upload_filepath = filepath
+
+        if _gallery.upload_name(upload_filepath) != os.path.basename(upload_filepath):
+            # The file name is sent with the image, but httpx can only send
+            # valid UTF-8, so a link with a valid name is uploaded instead
+            nonlocal linkdir
+            if linkdir is None:
+                linkdir = tempfile.mkdtemp(prefix='imgbox.')
+            try:
+                upload_filepath = await loop.run_in_executor(None, _link, upload_filepath, linkdir)
+            except OSError as e:
+                return pyimgbox.Submission(filepath=filepath, error=e.strerror)
+
+        start_opening(g)
+        if progress is not None:
+            progress.add_bytes(size)
+        return upload_filepath, size
+
+    async def process(index, g, filepath, prepared):
+        if prepared is None:
+            return journal.get(filepath)
+
+        with _trace.span(tracer, 'wait for preparation', 'file', id=index):
+            sub = await prepared
+        if not isinstance(sub, pyimgbox.Submission):
+            upload_filepath, size = sub
+            try:
+                with _trace.span(tracer, 'wait for gallery', 'file', id=index):
+                    await start_opening(g)
+            except ConnectionError as e:
+                sub = pyimgbox.Submission(filepath=filepath, error=str(e))
+            else:
+                with _trace.span(tracer, 'upload', 'file', id=index, filepath=filepath), \
+                     _progress_span(progress, size):
+                    if retry is not None:
+                        sub = await retry.upload(g, upload_filepath)
+                    else:
+                        sub = await g.upload(upload_filepath)
+                if upload_filepath != filepath:
+                    sub = pyimgbox.Submission(**{**sub, 'filepath': filepath, 'filename': None})
+                if cache is not None:
+                    await cache.add(sub, g)
+            finally:
+                if upload_filepath != filepath:
+                    release(upload_filepath)
+
+        if journal is not None:
+            journal.add(sub)
+        return sub
+
+    # The feeder validates and preprocesses each file ahead of the uploads and
+    # reads only as many file paths as workers can take so that `items` can be
+    # an endless stream.
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    # Each file takes a slot from when it is read until its submission is
+    # yielded, which also limits the size of `results`
+    slots = asyncio.Semaphore(_VALIDATE_AHEAD + jobs + _REORDER_AHEAD)
+
+    async def feeder():
+        try:
+            async for index, (g, filepath) in _async_enumerate(_aiter(items)):
+                await slots.acquire()
+                if g not in gallery_numbers:
+                    gallery_numbers[g] = next(numbers)
+                    if progress is not None:
+                        progress.watch(g)
+                    if rate_limit is not None:
+                        rate_limit.watch(g)
+                if progress is not None:
+                    progress.add_file()
+                if journal is not None and journal.get(filepath) is not None:
+                    # Don't validate or process files that are already done
+                    prepared = None
+                else:
+                    prepared = asyncio.ensure_future(prepare(index, g, filepath))
+                await scheduler.put((index, g, filepath, prepared), prepared)
+            if progress is not None:
+                progress.finish_input()
+        except Exception as e:
+            await results.put(e)
+        await scheduler.finish(jobs)
+
+    async def worker():
+        try:
+            while True:
+                item = await scheduler.get()
+                if item is None:
+                    break
+                index, g, filepath, prepared = item
+                sub = await process(index, g, filepath, prepared)
+                if progress is not None:
+                    progress.finish_file()
+                await results.put((index, g, sub))
+        except Exception as e:
+            await results.put(e)
+        finally:
+            await results.put(None)
+
+    tasks = [asyncio.ensure_future(feeder())]
+    tasks.extend(asyncio.ensure_future(worker()) for _ in range(jobs))
+    try:
+        # Submissions that are finished but must wait for previous submissions
+        # if order is "input"
+        pending = {}
+        next_index = 0
+        running = jobs
+        while running > 0:
+            if deadline is None:
+                result = await results.get()
+            else:
+                try:
+                    result = await asyncio.wait_for(results.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    # Cancel everything and yield what is finished anyway
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.wait(tasks)
+                    while not results.empty():
+                        result = results.get_nowait()
+                        if isinstance(result, tuple):
+                            pending[result[0]] = result[1:]
+                    for index in sorted(pending):
+                        yield pending.pop(index)
+                    raise DeadlineExceeded('Deadline exceeded')
+            if result is None:
+                running -= 1
+            elif isinstance(result, Exception):
+                raise result
+            elif order == 'completion':
+                slots.release()
+                yield result[1:]
+            else:
+                index, g, sub = result
+                pending[index] = (g, sub)
+                while next_index in pending:
+                    slots.release()
+                    yield pending.pop(next_index)
+                    next_index += 1
+    finally:
+        for task in tasks + list(creations.values()):
+            task.cancel()
+        scheduler.cancel()
+        if linkdir is not None:
+            shutil.rmtree(linkdir, ignore_errors=True)
@@ -24,15 +24,19 @@ setuptools.setup(
     long_description=get_description(),
     long_description_content_type='text/markdown',
     url=get_var('__homepage_url__'),
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks']),
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)',
         'Operating System :: OS Independent',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         'pyimgbox==1.*',
     ],
+    extras_require={
+        'preprocess': ['Pillow'],
+        'uvloop': ["uvloop; sys_platform != 'win32'"],
+    },
     entry_points={'console_scripts': ['imgbox = imgbox._main:main']},
 )
@@ -10,7 +10,9 @@ def mock_io():
         def __init__(self, stdin=''):
             self._stdout = io.StringIO()
             self._stderr = io.StringIO()
-            self._stdin = io.StringIO(stdin)
+            if isinstance(stdin, str):
+                stdin = stdin.encode('utf-8')
+            self._stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(stdin)))
 
         def __enter__(self):
             sys.stdout = self._stdout
@@ -0,0 +1,91 @@
+from unittest.mock import Mock, call
+
+import pytest
+from pyimgbox import Submission
+
+import imgbox
+
+
+# Python 3.6 doesn't have AsyncMock
+class AsyncMock(Mock):
+    def __call__(self, *args, **kwargs):
+        async def coro(_sup=super()):
+            return _sup.__call__(*args, **kwargs)
+        return coro()
+
+
+def make_gallery():
+    # Retry adds event hooks to the HTTP client
+    client = Mock(event_hooks={'request': [], 'response': []})
+    return Mock(
+        _client=Mock(_client=client),
+        created=True,
+        upload=AsyncMock(side_effect=lambda fp: Submission(filepath=fp, error='Oops')),
+        close=AsyncMock(),
+    )
+
+
+@pytest.fixture
+def check_file(mocker):
+    return mocker.patch('imgbox._upload._check_file')
+
+
+@pytest.mark.asyncio
+async def test_upload_creates_and_closes_gallery(check_file, mocker):
+    gallery = make_gallery()
+    new = mocker.patch('imgbox._gallery.new', return_value=gallery)
+    results = [(g, sub) async for g, sub in imgbox.upload(['a.jpg', 'b.jpg'], title='Foo',
+                                                          adult=True, jobs=2)]
+    assert results == [
+        (gallery, Submission(filepath='a.jpg', error='Oops')),
+        (gallery, Submission(filepath='b.jpg', error='Oops')),
+    ]
+    assert new.call_args_list == [call(title='Foo', thumb_width=100, square_thumbs=False,
+                                       comments_enabled=False, adult=True)]
+    assert gallery.close.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_upload_does_not_close_given_gallery(check_file, mocker):
+    new = mocker.patch('imgbox._gallery.new')
+    gallery = make_gallery()
+    results = [sub.filepath async for _, sub in imgbox.upload(['a.jpg'], gallery=gallery)]
+    assert results == ['a.jpg']
+    assert new.call_args_list == []
+    assert gallery.close.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_upload_removes_event_hooks_from_given_gallery(check_file, mocker):
+    gallery = make_gallery()
+    for _ in range(5):
+        async for _ in imgbox.upload(['a.jpg'], gallery=gallery, limit_rate=1000000):
+            assert len(gallery._client._client.event_hooks['request']) == 2
+            assert len(gallery._client._client.event_hooks['response']) == 1
+    assert gallery._client._client.event_hooks == {'request': [], 'response': []}
+
+@pytest.mark.asyncio
+async def test_upload_closes_everything_when_closed_early(check_file, mocker):
+    gallery = make_gallery()
+    mocker.patch('imgbox._gallery.new', return_value=gallery)
+    Cache = mocker.patch('imgbox._cache.Cache')
+    Cache.return_value.get = AsyncMock(return_value=None)
+    Cache.return_value.add = AsyncMock()
+    uploads = imgbox.upload(['a.jpg', 'b.jpg'], cache_path='/path/to/cache.db')
+    assert (await uploads.__anext__())[1].filepath == 'a.jpg'
+    await uploads.aclose()
+    assert Cache.call_args_list == [call(path='/path/to/cache.db')]
+    assert Cache.return_value.close.call_args_list == [call()]
+    assert gallery.close.call_args_list == [call()]
+
+@pytest.mark.parametrize(
+    argnames='kwargs, exp_error',
+    argvalues=(
+        ({'order': 'foo'}, "Invalid order: 'foo'"),
+        ({'schedule': 'foo'}, "Invalid schedule: 'foo'"),
+    ),
+)
+@pytest.mark.asyncio
+async def test_upload_with_invalid_argument(kwargs, exp_error, mocker):
+    new = mocker.patch('imgbox._gallery.new')
+    with pytest.raises(ValueError, match=rf'^{exp_error}$'):
+        await imgbox.upload(['a.jpg'], **kwargs).__anext__()
+    assert new.call_args_list == []
@@ -0,0 +1,148 @@
+import sqlite3
+from unittest.mock import Mock
+
+import pytest
+from pyimgbox import Submission
+
+from imgbox import _cache
+
+GALLERY = Mock(thumb_width=300, square_thumbs=False, adult=False)
+
+
+def make_submission(filepath, name='foo'):
+    return Submission(filepath=str(filepath), image_url=f'img/{name}',
+                      thumbnail_url=f'thumb/{name}', web_url=f'web/{name}',
+                      gallery_url='gallery', edit_url='edit')
+
+
+def test_Cache_creates_parent_directories(tmp_path):
+    path = tmp_path / 'foo' / 'bar' / 'uploads.db'
+    cache = _cache.Cache(str(path))
+    cache.close()
+    assert path.exists()
+
+def test_Cache_raises_OSError(tmp_path):
+    path = tmp_path / 'uploads.db'
+    path.mkdir()
+    with pytest.raises(OSError, match=rf'^{path}: '):
+        _cache.Cache(str(path))
+
+
+@pytest.mark.asyncio
+async def test_get_returns_None_for_unknown_file(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    assert await cache.get(str(filepath), GALLERY) is None
+
+@pytest.mark.asyncio
+async def test_get_returns_None_for_nonexisting_file(tmp_path):
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    assert await cache.get(str(tmp_path / 'foo.jpg'), GALLERY) is None
+
+@pytest.mark.asyncio
+async def test_get_returns_known_file(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    await cache.add(make_submission(filepath), GALLERY)
+    cache.close()
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    assert await cache.get(str(filepath), GALLERY) == make_submission(filepath)
+
+@pytest.mark.asyncio
+async def test_get_finds_copy_of_known_file(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    copy = tmp_path / 'copy.jpg'
+    copy.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    await cache.add(make_submission(filepath), GALLERY)
+    assert await cache.get(str(copy), GALLERY) == make_submission(copy)
+
+@pytest.mark.asyncio
+async def test_get_notices_changed_file(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    await cache.add(make_submission(filepath), GALLERY)
+    filepath.write_bytes(b'bar data')
+    assert await cache.get(str(filepath), GALLERY) is None
+
+@pytest.mark.asyncio
+async def test_get_does_not_hash_unchanged_file(tmp_path, mocker):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    await cache.add(make_submission(filepath), GALLERY)
+    mock_file_digest = mocker.patch('imgbox._cache._file_digest')
+    assert await cache.get(str(filepath), GALLERY) == make_submission(filepath)
+    assert mock_file_digest.call_args_list == []
+
+@pytest.mark.parametrize(
+    argnames='settings',
+    argvalues=(
+        {'thumb_width': 350},
+        {'square_thumbs': True},
+        {'adult': True},
+    ),
+)
+@pytest.mark.asyncio
+async def test_get_ignores_file_uploaded_with_other_settings(settings, tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    await cache.add(make_submission(filepath), GALLERY)
+    other_gallery = Mock(**{'thumb_width': 300, 'square_thumbs': False, 'adult': False, **settings})
+    assert await cache.get(str(filepath), other_gallery) is None
+    await cache.add(make_submission(filepath, name='other'), other_gallery)
+    assert await cache.get(str(filepath), other_gallery) == make_submission(filepath, name='other')
+    assert await cache.get(str(filepath), GALLERY) == make_submission(filepath)
+
+@pytest.mark.asyncio
+async def test_get_ignores_uploads_from_old_database(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    db = sqlite3.connect(str(tmp_path / 'uploads.db'))
+    db.execute('CREATE TABLE uploads ('
+               ' digest TEXT PRIMARY KEY,'
+               ' image_url TEXT, thumbnail_url TEXT, web_url TEXT,'
+               ' gallery_url TEXT, edit_url TEXT, used REAL NOT NULL)')
+    db.commit()
+    db.close()
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    assert await cache.get(str(filepath), GALLERY) is None
+    await cache.add(make_submission(filepath), GALLERY)
+    assert await cache.get(str(filepath), GALLERY) == make_submission(filepath)
+
+@pytest.mark.asyncio
+async def test_add_ignores_failed_submission(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'foo data')
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    await cache.add(Submission(filepath=str(filepath), error='Oops'), GALLERY)
+    assert await cache.get(str(filepath), GALLERY) is None
+
+
+@pytest.mark.asyncio
+async def test_evict_by_age(tmp_path, mocker):
+    filepaths = [tmp_path / f'{i}.jpg' for i in range(3)]
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    for i, filepath in enumerate(filepaths):
+        filepath.write_bytes(f'data {i}'.encode())
+        mocker.patch('time.time', return_value=1000 + i * 100)
+        await cache.add(make_submission(filepath, name=i), GALLERY)
+    mocker.patch('time.time', return_value=1000 + 250)
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'), max_age=200)
+    assert [await cache.get(str(fp), GALLERY) is not None for fp in filepaths] == [False, True, True]
+
+@pytest.mark.asyncio
+async def test_evict_by_number_of_entries(tmp_path, mocker):
+    filepaths = [tmp_path / f'{i}.jpg' for i in range(3)]
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'))
+    for i, filepath in enumerate(filepaths):
+        filepath.write_bytes(f'data {i}'.encode())
+        mocker.patch('time.time', return_value=1000 + i * 100)
+        await cache.add(make_submission(filepath, name=i), GALLERY)
+    cache = _cache.Cache(str(tmp_path / 'uploads.db'), max_entries=2)
+    assert [await cache.get(str(fp), GALLERY) is not None for fp in filepaths] == [False, True, True]
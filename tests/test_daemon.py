@@ -0,0 +1,298 @@
+import asyncio
+import os
+import sys
+from unittest.mock import Mock, call
+
+import pytest
+
+from imgbox import _daemon, _input
+
+
+# Python 3.6 doesn't have AsyncMock
+class AsyncMock(Mock):
+    def __call__(self, *args, **kwargs):
+        async def coro(_sup=super()):
+            return _sup.__call__(*args, **kwargs)
+        return coro()
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'imgbox.sock')
+
+
+@pytest.fixture
+def fake_run(mocker):
+    # Print each file and return the number of files as exit code
+    async def run(args, files=None):
+        count = 0
+        if args.resume:
+            print(f'Resuming {args.resume}', file=sys.stderr)
+        else:
+            async for f in files:
+                print(f'* {f}')
+                count += 1
+        return count
+
+    return mocker.patch('imgbox._main._run', run)
+
+
+def test_default_socket_path_with_XDG_RUNTIME_DIR(mocker):
+    mocker.patch.dict(os.environ, {'XDG_RUNTIME_DIR': '/run/user/1000'})
+    assert _daemon.default_socket_path() == '/run/user/1000/imgbox.sock'
+
+def test_default_socket_path_without_XDG_RUNTIME_DIR(mocker):
+    mocker.patch.dict(os.environ, clear=True)
+    mocker.patch('os.getuid', return_value=1000)
+    assert _daemon.default_socket_path() == '/tmp/imgbox-1000/imgbox.sock'
+
+
+def test_job_args_makes_paths_absolute(tmp_path, mocker):
+    mocker.patch('os.getcwd', return_value='/home/foo')
+    args = _input.get_args(['--daemon', '--socket', 'my.sock', '--journal', 'my.journal',
+                            '--trace', '/tmp/trace.json', 'a.jpg', '../b.jpg'])
+    job_args = _daemon._job_args(args)
+    assert 'daemon' not in job_args
+    assert 'socket' not in job_args
+    assert job_args['journal'] == '/home/foo/my.journal'
+    assert job_args['trace'] == '/tmp/trace.json'
+    assert job_args['resume'] is None
+    assert job_args['files'] == ['/home/foo/a.jpg', '/home/b.jpg']
+
+
+@pytest.mark.asyncio
+async def test_submit_without_daemon(socket_path, mock_io):
+    args = _input.get_args(['--daemon', '--socket', socket_path, 'foo.jpg'])
+    with mock_io() as cap:
+        assert await _daemon.submit(args) is None
+    assert cap.stdout == ''
+    assert cap.stderr == ''
+
+@pytest.mark.asyncio
+async def test_submit_with_socket_of_other_user(socket_path, mock_io, mocker):
+    import socket
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(socket_path)
+    mocker.patch('imgbox._daemon._check_socket_dir')
+    mocker.patch('os.getuid', return_value=os.getuid() + 1)
+    args = _input.get_args(['--daemon', '--socket', socket_path, 'foo.jpg'])
+    with mock_io() as cap:
+        assert await _daemon.submit(args) is None
+    assert cap.stdout == ''
+    assert cap.stderr == f'{socket_path}: Socket belongs to another user\n'
+
+@pytest.mark.parametrize('kind', ('shared', 'symlink'))
+@pytest.mark.asyncio
+async def test_submit_with_socket_in_public_directory(kind, tmp_path, mock_io):
+    dirpath = tmp_path / 'run'
+    if kind == 'shared':
+        dirpath.mkdir()
+        dirpath.chmod(0o755)
+    else:
+        (tmp_path / 'real').mkdir(mode=0o700)
+        dirpath.symlink_to(tmp_path / 'real', target_is_directory=True)
+    args = _input.get_args(['--daemon', '--socket', str(dirpath / 'imgbox.sock'), 'foo.jpg'])
+    with mock_io() as cap:
+        assert await _daemon.submit(args) is None
+    assert cap.stdout == ''
+    assert cap.stderr == f'{dirpath}: Not a private directory\n'
+
+@pytest.mark.asyncio
+async def test_submit_without_files(socket_path, mock_io, fake_run):
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io() as cap:
+        await daemon.start()
+        try:
+            args = _input.get_args(['--daemon', '--socket', socket_path])
+            assert await _daemon.submit(args) == 1
+        finally:
+            await daemon.close()
+    assert cap.stdout == ''
+    assert cap.stderr.startswith('Missing at least one image file.')
+
+@pytest.mark.asyncio
+async def test_submit_streams_output(socket_path, mock_io, fake_run, mocker):
+    mocker.patch('os.getcwd', return_value='/home/foo')
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io(stdin='b.jpg\n') as cap:
+        await daemon.start()
+        try:
+            args = _input.get_args(['--daemon', '--socket', socket_path, 'a.jpg'])
+            assert await _daemon.submit(args) == 2
+        finally:
+            await daemon.close()
+    assert cap.stdout == '* /home/foo/b.jpg\n* /home/foo/a.jpg\n'
+    assert cap.stderr == ''
+
+@pytest.mark.asyncio
+async def test_submit_with_resume_argument(socket_path, mock_io, fake_run, mocker):
+    mocker.patch('os.getcwd', return_value='/home/foo')
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io() as cap:
+        await daemon.start()
+        try:
+            args = _input.get_args(['--daemon', '--socket', socket_path, '--resume', 'my.journal'])
+            assert await _daemon.submit(args) == 0
+        finally:
+            await daemon.close()
+    assert cap.stdout == ''
+    assert cap.stderr == 'Resuming /home/foo/my.journal\n'
+
+@pytest.mark.asyncio
+async def test_simultaneous_jobs_have_separate_output(socket_path, mock_io, mocker):
+    async def run(args, files=None):
+        async for f in files:
+            await asyncio.sleep(0.01)
+            print(f'{args.title}: {f}')
+        return 0
+
+    mocker.patch('imgbox._main._run', run)
+    daemon = _daemon.Daemon(socket_path)
+
+    async def submit(title, *files):
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        writer.write(_daemon._encode(args={'title': title}))
+        for f in files:
+            writer.write(_daemon._encode(file=f))
+        writer.write(_daemon._encode(end=True))
+        output = await reader.read()
+        writer.close()
+        return output.decode('utf-8')
+
+    with mock_io() as cap:
+        await daemon.start()
+        try:
+            outputs = await asyncio.gather(submit('A', 'a1', 'a2'), submit('B', 'b1'))
+        finally:
+            await daemon.close()
+    assert outputs == [
+        ('{"stdout": "A: a1"}\n{"stdout": "\\n"}\n'
+         '{"stdout": "A: a2"}\n{"stdout": "\\n"}\n'
+         '{"exit_code": 0}\n'),
+        ('{"stdout": "B: b1"}\n{"stdout": "\\n"}\n'
+         '{"exit_code": 0}\n'),
+    ]
+    assert cap.stdout == ''
+    assert cap.stderr == ''
+
+@pytest.mark.asyncio
+async def test_disconnecting_client_cancels_job(socket_path, mock_io, mocker):
+    cancelled = asyncio.Event()
+
+    async def run(args, files=None):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    mocker.patch('imgbox._main._run', run)
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io():
+        await daemon.start()
+        try:
+            _, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(_daemon._encode(args={}))
+            writer.write(_daemon._encode(file='foo.jpg'))
+            await writer.drain()
+            writer.close()
+            await asyncio.wait_for(cancelled.wait(), timeout=1)
+        finally:
+            await daemon.close()
+
+
+@pytest.mark.asyncio
+async def test_start_creates_private_socket(socket_path, mock_io):
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io():
+        await daemon.start()
+        try:
+            assert os.stat(socket_path).st_mode & 0o777 == 0o600
+        finally:
+            await daemon.close()
+    assert not os.path.exists(socket_path)
+
+@pytest.mark.asyncio
+async def test_start_creates_socket_with_restrictive_umask(socket_path, mock_io, mocker):
+    umasks = []
+
+    async def start_unix_server(client_connected_cb, path):
+        umask = os.umask(0)
+        os.umask(umask)
+        umasks.append(umask)
+        return Mock()
+
+    mocker.patch('asyncio.start_unix_server', start_unix_server)
+    mocker.patch('imgbox._gallery.share_transport')
+    umask = os.umask(0o022)
+    try:
+        daemon = _daemon.Daemon(socket_path)
+        with mock_io():
+            await daemon.start()
+            await daemon.close()
+        assert umasks == [0o177]
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
+
+@pytest.mark.asyncio
+async def test_start_creates_private_socket_directory(tmp_path, mock_io):
+    socket_path = str(tmp_path / 'imgbox-1000' / 'imgbox.sock')
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io():
+        await daemon.start()
+        try:
+            assert os.stat(tmp_path / 'imgbox-1000').st_mode & 0o777 == 0o700
+            assert os.stat(socket_path).st_mode & 0o777 == 0o600
+        finally:
+            await daemon.close()
+
+@pytest.mark.asyncio
+async def test_start_with_socket_in_public_directory(tmp_path, mock_io):
+    dirpath = tmp_path / 'imgbox-1000'
+    dirpath.mkdir()
+    dirpath.chmod(0o755)
+    daemon = _daemon.Daemon(str(dirpath / 'imgbox.sock'))
+    with mock_io():
+        with pytest.raises(OSError, match=rf'^{dirpath}: Not a private directory$'):
+            await daemon.start()
+    assert not (dirpath / 'imgbox.sock').exists()
+
+@pytest.mark.asyncio
+async def test_start_with_daemon_already_running(socket_path, mock_io):
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io():
+        await daemon.start()
+        try:
+            with pytest.raises(RuntimeError, match=rf'^{socket_path}: Daemon is already running$'):
+                await _daemon.Daemon(socket_path).start()
+        finally:
+            await daemon.close()
+
+@pytest.mark.asyncio
+async def test_start_removes_stale_socket(socket_path, mock_io):
+    import socket
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(socket_path)
+    daemon = _daemon.Daemon(socket_path)
+    with mock_io():
+        await daemon.start()
+        await daemon.close()
+
+
+@pytest.mark.asyncio
+async def test_start_with_limit_rate_limits_all_jobs(socket_path, mock_io, mocker):
+    RateLimit = mocker.patch('imgbox._ratelimit.RateLimit')
+    daemon = _daemon.Daemon(socket_path, limit_rate=1000)
+    with mock_io():
+        await daemon.start()
+        try:
+            assert RateLimit.call_args_list == [call(1000)]
+            handle = mocker.patch.object(daemon._transport._transport, 'handle_async_request',
+                                         AsyncMock(return_value='<response>'))
+            request = Mock()
+            assert await daemon._transport.handle_async_request(request) == '<response>'
+            assert RateLimit.return_value.apply.call_args_list == [call(request)]
+            assert handle.call_args_list == [call(request)]
+        finally:
+            await daemon.close()
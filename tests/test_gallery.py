@@ -0,0 +1,155 @@
+import os
+from unittest.mock import Mock, call
+
+import pytest
+
+from imgbox import _gallery
+
+
+# Python 3.6 doesn't have AsyncMock
+class AsyncMock(Mock):
+    def __call__(self, *args, **kwargs):
+        async def coro(_sup=super()):
+            return _sup.__call__(*args, **kwargs)
+        return coro()
+
+
+TOKEN = {'token_id': 123, 'token_secret': 'abc', 'gallery_id': 'g123', 'gallery_secret': 'def'}
+
+
+@pytest.mark.parametrize(
+    argnames='title, exp_title',
+    argvalues=(('Foo', 'Foo (2)'), (None, None)),
+)
+def test_copy(title, exp_title, mocker):
+    Gallery = mocker.patch('pyimgbox.Gallery')
+    gallery = Mock(title=title, thumb_width=123, square_thumbs=True, adult=False,
+                   comments_enabled=True)
+    assert _gallery.copy(gallery, number=2) is Gallery.return_value
+    assert Gallery.call_args_list == [call(
+        title=exp_title, thumb_width=123, square_thumbs=True, adult=False,
+        comments_enabled=True,
+    )]
+
+def test_copy_with_transport(mocker):
+    new = mocker.patch('imgbox._gallery.new')
+    gallery = Mock(title='Foo', thumb_width=123, square_thumbs=True, adult=False,
+                   comments_enabled=True)
+    assert _gallery.copy(gallery, number=3, transport='transport') is new.return_value
+    assert new.call_args_list == [call(
+        transport='transport', title='Foo (3)', thumb_width=123, square_thumbs=True,
+        adult=False, comments_enabled=True,
+    )]
+
+
+def test_new_without_shared_transport(mocker):
+    Gallery = mocker.patch('pyimgbox.Gallery')
+    client = Gallery.return_value._client._client
+    assert _gallery.new(title='Foo') is Gallery.return_value
+    assert Gallery.call_args_list == [call(title='Foo')]
+    assert Gallery.return_value._client._client is client
+
+@pytest.mark.asyncio
+async def test_new_with_shared_transport(mocker):
+    mocker.patch('pyimgbox.Gallery')
+    transport = Mock(handle_async_request=AsyncMock(return_value='response'),
+                     aclose=AsyncMock())
+    _gallery.share_transport(transport)
+    try:
+        gallery = _gallery.new(title='Foo')
+    finally:
+        _gallery.share_transport(None)
+    client = gallery._client._client
+    assert await client._transport.handle_async_request('request') == 'response'
+    await client.aclose()
+    assert transport.aclose.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_new_prefers_shared_transport(mocker):
+    mocker.patch('pyimgbox.Gallery')
+    shared = Mock(handle_async_request=AsyncMock(return_value='shared'))
+    own = Mock(handle_async_request=AsyncMock(return_value='own'))
+    gallery = _gallery.new(transport=own)
+    assert await gallery._client._client._transport.handle_async_request('request') == 'own'
+    _gallery.share_transport(shared)
+    try:
+        gallery = _gallery.new(transport=own)
+    finally:
+        _gallery.share_transport(None)
+    assert await gallery._client._client._transport.handle_async_request('request') == 'shared'
+
+
+def test_get_token_from_created_gallery():
+    gallery = Mock(created=True, _gallery_token=TOKEN)
+    token = _gallery.get_token(gallery)
+    assert token == TOKEN
+    assert token is not TOKEN
+
+def test_get_token_from_uncreated_gallery():
+    gallery = Mock(created=False, _gallery_token={})
+    assert _gallery.get_token(gallery) is None
+
+
+@pytest.mark.asyncio
+async def test_reopen_created_gallery():
+    gallery = Mock(created=True)
+    with pytest.raises(RuntimeError, match=r'^Gallery was already created$'):
+        await _gallery.reopen(gallery, TOKEN)
+
+@pytest.mark.asyncio
+async def test_reopen_without_CSRF_token():
+    gallery = Mock(created=False, _gallery_token={})
+    gallery._client = Mock(headers={}, get=AsyncMock(return_value='<html><head></head></html>'))
+    with pytest.raises(RuntimeError, match=r'^Couldn\'t find CSRF token in HTML head$'):
+        await _gallery.reopen(gallery, TOKEN)
+    assert gallery._gallery_token == {}
+
+@pytest.mark.asyncio
+async def test_reopen_sets_credentials():
+    gallery = Mock(created=False, _gallery_token={})
+    gallery._client = Mock(
+        headers={'X-CSRF-Token': 'old'},
+        get=AsyncMock(return_value=(
+            '<html><head><meta content="s3cr3t" name="csrf-token" /></head></html>'
+        )),
+    )
+    await _gallery.reopen(gallery, TOKEN)
+    assert gallery._client.get.call_args_list == [call('https://imgbox.com/')]
+    assert gallery._client.headers == {'X-CSRF-Token': 's3cr3t'}
+    assert gallery._gallery_token == TOKEN
+
+@pytest.mark.asyncio
+async def test_reopen_passes_on_ConnectionError():
+    gallery = Mock(created=False, _gallery_token={})
+    gallery._client = Mock(headers={}, get=AsyncMock(side_effect=ConnectionError('No')))
+    with pytest.raises(ConnectionError, match=r'^No$'):
+        await _gallery.reopen(gallery, TOKEN)
+
+
+@pytest.mark.parametrize(
+    argnames='filepath, exp_name',
+    argvalues=(
+        ('path/to/foo.jpg', 'foo.jpg'),
+        ('path/to/f\u00f6\u00f6.jpg', 'f\u00f6\u00f6.jpg'),
+        (os.fsdecode(b'path\xff/to/f\xf6\xf6.jpg'), 'f\ufffd\ufffd.jpg'),
+    ),
+)
+def test_upload_name(filepath, exp_name):
+    assert _gallery.upload_name(filepath) == exp_name
+
+
+def test_add_event_hook():
+    gallery = Mock()
+    gallery._client._client.event_hooks = {'request': [], 'response': []}
+    hook = AsyncMock()
+    _gallery.add_event_hook(gallery, 'response', hook)
+    _gallery.add_event_hook(gallery, 'response', hook)
+    assert gallery._client._client.event_hooks == {'request': [], 'response': [hook]}
+
+def test_remove_event_hook():
+    gallery = Mock()
+    hook, other_hook = AsyncMock(), AsyncMock()
+    gallery._client._client.event_hooks = {'request': [other_hook], 'response': [hook]}
+    _gallery.remove_event_hook(gallery, 'response', hook)
+    _gallery.remove_event_hook(gallery, 'response', hook)
+    assert gallery._client._client.event_hooks == {'request': [other_hook], 'response': []}
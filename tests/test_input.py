@@ -1,3 +1,5 @@
+import io
+import threading
 from unittest.mock import Mock
 
 import pytest
@@ -5,33 +7,159 @@ import pytest
 from imgbox import _input
 
 
-def test_get_files_reads_files_from_stdin(mock_io):
+async def collect(aiter):
+    return [item async for item in aiter]
+
+
+@pytest.mark.asyncio
+async def test_get_files_reads_files_from_stdin(mock_io):
     lines = ['foo.jpg', 'bar.jpg', 'baz.png']
-    args = Mock(files=[])
+    args = Mock(files=[], null=False, recursive=False)
     with mock_io(stdin='\n'.join(lines)):
-        assert _input.get_files(args) == lines
+        assert await collect(await _input.get_files(args)) == lines
 
-def test_get_files_ignores_empty_lines_on_stdin(mock_io):
+@pytest.mark.asyncio
+async def test_get_files_ignores_empty_lines_on_stdin(mock_io):
     lines = ['', 'foo.jpg', ' ', 'bar.jpg', '\t', 'baz.png', '\n']
-    args = Mock(files=[])
+    args = Mock(files=[], null=False, recursive=False)
     with mock_io(stdin='\n'.join(lines)):
-        assert _input.get_files(args) == [line for line in lines if line.strip()]
+        assert await collect(await _input.get_files(args)) == [line for line in lines if line.strip()]
+
+@pytest.mark.asyncio
+async def test_get_files_reads_files_from_unbuffered_stdin(mocker):
+    mocker.patch('sys.stdin', io.TextIOWrapper(io.BytesIO(b'foo.jpg\nbar.jpg\n')))
+    args = Mock(files=[], null=False, recursive=False)
+    assert await collect(await _input.get_files(args)) == ['foo.jpg', 'bar.jpg']
 
-def test_get_files_ignores_single_dash_argument(mock_io):
+@pytest.mark.asyncio
+async def test_get_files_ignores_single_dash_argument(mock_io):
     lines = ['foo.jpg', 'bar.jpg', 'baz.png']
-    args = Mock(files=['-'])
+    args = Mock(files=['-'], null=False, recursive=False)
     with mock_io(stdin='\n'.join(lines)):
-        assert _input.get_files(args) == lines
+        assert await collect(await _input.get_files(args)) == lines
 
-def test_get_files_reads_files_from_arguments(mocker, mock_io):
+@pytest.mark.asyncio
+async def test_get_files_reads_files_from_arguments(mocker, mock_io):
     files = ['foo.jpg', 'bar.jpg', 'baz.png']
-    args = Mock(files=files)
+    args = Mock(files=files, null=False, recursive=False)
     with mock_io():
-        assert _input.get_files(args) == files
+        assert await collect(await _input.get_files(args)) == files
 
-def test_get_files_does_not_find_any_files(mock_io):
-    args = Mock(files=[])
+@pytest.mark.asyncio
+async def test_get_files_reads_files_from_stdin_before_arguments(mock_io):
+    args = Mock(files=['foo.jpg'], null=False, recursive=False)
+    with mock_io(stdin='bar.jpg\nbaz.png\n'):
+        assert await collect(await _input.get_files(args)) == ['bar.jpg', 'baz.png', 'foo.jpg']
+
+@pytest.mark.asyncio
+async def test_get_files_does_not_find_any_files(mock_io):
+    args = Mock(files=[], null=False, recursive=False)
     with mock_io(stdin=''):
         with pytest.raises(ValueError, match=(r'^Missing at least one image file\. '
                                               r'Run "imgbox -h" for more information\.$')):
-            _input.get_files(args)
+            await _input.get_files(args)
+
+@pytest.mark.asyncio
+async def test_get_files_reads_null_separated_files_from_stdin(mock_io):
+    args = Mock(files=[], null=True, recursive=False)
+    with mock_io(stdin='foo.jpg\0 \0\0with\nnewline.jpg\0baz.png'):
+        assert await collect(await _input.get_files(args)) == ['foo.jpg', ' ', 'with\nnewline.jpg', 'baz.png']
+
+@pytest.mark.asyncio
+async def test_get_files_reads_non_utf8_paths_from_stdin(mock_io, tmp_path):
+    args = Mock(files=[], null=True, recursive=False)
+    with mock_io(stdin=b'foo\xff.jpg\0'):
+        files = await collect(await _input.get_files(args))
+    assert files == ['foo\udcff.jpg']
+    assert files[0].encode('utf-8', 'surrogateescape') == b'foo\xff.jpg'
+
+@pytest.mark.asyncio
+async def test_get_files_yields_files_before_stdin_is_closed(mock_io, mocker):
+    eof = threading.Event()
+    chunks = iter([b'foo.jpg\nba', b'r.jpg\n', b'baz.png'])
+
+    def read(size):
+        try:
+            return next(chunks)
+        except StopIteration:
+            eof.wait()
+            return b''
+
+    stdin = Mock(isatty=Mock(return_value=False))
+    stdin.buffer.raw.read = read
+    mocker.patch('sys.stdin', stdin)
+    files = await _input.get_files(Mock(files=[], null=False, recursive=False))
+    assert await files.__anext__() == 'foo.jpg'
+    assert await files.__anext__() == 'bar.jpg'
+    eof.set()
+    assert await collect(files) == ['baz.png']
+
+
+def test_read_paths_splits_chunks():
+    fileobj = Mock(read=Mock(side_effect=[b'a\nb', b'', b'']))
+    assert list(_input._read_paths(fileobj, b'\n')) == ['a', 'b']
+    fileobj = Mock(read=Mock(side_effect=[b'a', b'b\nc\n\nd', b'\n', b'']))
+    assert list(_input._read_paths(fileobj, b'\n')) == ['ab', 'c', '', 'd']
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for path in ('b.jpg', 'a.PNG', 'notes.txt', 'sub/c.gif', 'sub/d.jpeg',
+                 'sub/.git/e.jpg', 'z.jpg'):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b'foo')
+    (tmp_path / 'link').symlink_to(tmp_path / 'sub')
+    (tmp_path / 'link.jpg').symlink_to(tmp_path / 'b.jpg')
+    return tmp_path
+
+def test_walk_finds_image_files_sorted_by_name(tree):
+    assert list(_input._walk(str(tree))) == [
+        str(tree / path) for path in ('a.PNG', 'b.jpg', 'link.jpg', 'sub/.git/e.jpg',
+                                      'sub/c.gif', 'sub/d.jpeg', 'z.jpg')
+    ]
+
+def test_walk_with_include(tree):
+    assert list(_input._walk(str(tree), include=('[a-c].*',))) == [
+        str(tree / path) for path in ('a.PNG', 'b.jpg', 'sub/c.gif')
+    ]
+
+def test_walk_with_exclude(tree):
+    assert list(_input._walk(str(tree), exclude=('.git', 'link*', 'z.*'))) == [
+        str(tree / path) for path in ('a.PNG', 'b.jpg', 'sub/c.gif', 'sub/d.jpeg')
+    ]
+
+def test_walk_with_extensions(tree):
+    assert list(_input._walk(str(tree), extensions=('.gif', '.png'))) == [
+        str(tree / path) for path in ('a.PNG', 'sub/c.gif')
+    ]
+
+def test_walk_does_not_stat_files(tree, mocker):
+    mocker.patch('os.stat', side_effect=AssertionError('stat() called'))
+    assert len(list(_input._walk(str(tree)))) == 7
+
+def test_walk_with_unreadable_directory(tmp_path):
+    assert list(_input._walk(str(tmp_path / 'nonexisting'))) == []
+
+
+@pytest.mark.asyncio
+async def test_get_files_with_recursive_argument(tree, mock_io):
+    args = _input.get_args(['-r', '--type', 'gif', '--type', 'png',
+                            str(tree / 'sub'), str(tree / 'notes.txt'), str(tree)])
+    with mock_io(stdin=str(tree / 'z.jpg')):
+        assert await collect(await _input.get_files(args)) == [
+            str(tree / path) for path in ('z.jpg', 'sub/c.gif', 'notes.txt', 'a.PNG', 'sub/c.gif')
+        ]
+
+@pytest.mark.asyncio
+async def test_get_files_with_recursive_argument_and_directory_on_stdin(tree, mock_io):
+    args = _input.get_args(['-r', '--exclude', 'sub'])
+    with mock_io(stdin=f'{tree}\n'):
+        assert await collect(await _input.get_files(args)) == [
+            str(tree / path) for path in ('a.PNG', 'b.jpg', 'link.jpg', 'z.jpg')
+        ]
+
+@pytest.mark.asyncio
+async def test_get_files_without_recursive_argument_yields_directories(tree, mock_io):
+    args = _input.get_args([str(tree)])
+    with mock_io():
+        assert await collect(await _input.get_files(args)) == [str(tree)]
@@ -0,0 +1,170 @@
+import json
+import os
+from unittest.mock import Mock
+
+import pytest
+from pyimgbox import Submission
+
+from imgbox import _journal
+
+SETTINGS = {'title': 'Foo', 'adult': False, 'thumb_width': 100,
+            'square_thumbs': False, 'comments_enabled': False}
+TOKEN = {'token_id': 123, 'token_secret': 'abc', 'gallery_id': 'g123', 'gallery_secret': 'def'}
+
+
+def make_submission(filepath, error=None):
+    if error:
+        return Submission(filepath=filepath, error=error)
+    else:
+        return Submission(filepath=filepath, image_url=f'img/{filepath}',
+                          thumbnail_url=f'thumb/{filepath}', web_url=f'web/{filepath}',
+                          gallery_url='gallery', edit_url='edit')
+
+
+async def collect(aiter):
+    return [item async for item in aiter]
+
+
+async def aiter(seq):
+    for item in seq:
+        yield item
+
+
+@pytest.fixture
+def mock_gallery(mocker):
+    mocker.patch('imgbox._gallery.get_token', return_value=TOKEN)
+    return Mock(url='gallery', edit_url='edit')
+
+
+def test_Journal_refuses_to_overwrite_existing_file(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_text('foo')
+    with pytest.raises(OSError, match=rf'^{path}: Journal already exists$'):
+        _journal.Journal(str(path))
+    assert path.read_text() == 'foo'
+
+def test_Journal_fails_to_resume_nonexisting_file(tmp_path):
+    path = tmp_path / 'journal'
+    with pytest.raises(OSError, match=rf'^{path}: No such file or directory$'):
+        _journal.Journal(str(path), resume=True)
+
+def test_Journal_fails_to_resume_file_without_batch(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_text('{"file": "a.jpg"}\n')
+    with pytest.raises(OSError, match=rf'^{path}: Not a journal$'):
+        _journal.Journal(str(path), resume=True)
+
+def test_Journal_fails_to_resume_file_with_invalid_line(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_text('{"batch": {}}\n{"gallery": \n{"gallery": {}}\n')
+    with pytest.raises(OSError, match=rf'^{path}: Line 2: Invalid JSON$'):
+        _journal.Journal(str(path), resume=True)
+
+def test_Journal_fails_to_resume_file_with_invalid_record(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_text('{"batch": {}}\n{"gallery": {}}\n')
+    with pytest.raises(OSError, match=rf'^{path}: Line 2: Invalid record$'):
+        _journal.Journal(str(path), resume=True)
+
+def test_Journal_ignores_incomplete_last_line(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_text('{"batch": {"settings": {}}}\n{"file": "a.jpg"}\n{"submiss')
+    journal = _journal.Journal(str(path), resume=True)
+    assert journal.files == ['a.jpg']
+
+
+@pytest.mark.asyncio
+async def test_Journal_writes_records(tmp_path, mock_gallery, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'journal'
+    journal = _journal.Journal(str(path))
+    journal.start(SETTINGS, 10)
+    assert await collect(journal.add_files(aiter(['a.jpg', 'b.jpg', 'a.jpg']))) == [
+        'a.jpg', 'b.jpg', 'a.jpg',
+    ]
+    journal.add_gallery(mock_gallery)
+    journal.add_gallery(mock_gallery)
+    journal.add_gallery(mock_gallery, 1)
+    journal.add(make_submission('a.jpg'))
+    journal.add(make_submission('b.jpg', error='Oops'))
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert records == [
+        {'batch': {'settings': SETTINGS, 'max_per_gallery': 10}},
+        {'file': str(tmp_path / 'a.jpg')},
+        {'file': str(tmp_path / 'b.jpg')},
+        {'gallery': {'number': 0, 'url': 'gallery', 'edit_url': 'edit', 'token': TOKEN}},
+        {'gallery': {'number': 1, 'url': 'gallery', 'edit_url': 'edit', 'token': TOKEN}},
+        {'submission': {**make_submission('a.jpg'), 'filepath': str(tmp_path / 'a.jpg')}},
+        {'submission': {**make_submission('b.jpg', error='Oops'),
+                        'filepath': str(tmp_path / 'b.jpg')}},
+    ]
+
+@pytest.mark.asyncio
+async def test_Journal_resumes_batch(tmp_path, mock_gallery, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'journal'
+    journal = _journal.Journal(str(path))
+    journal.start(SETTINGS, 2)
+    await collect(journal.add_files(aiter(['a.jpg', 'b.jpg', 'c.jpg'])))
+    journal.add_gallery(mock_gallery, 1)
+    journal.add(make_submission('a.jpg'))
+    journal.add(make_submission('b.jpg', error='Oops'))
+    journal.close()
+
+    journal = _journal.Journal(str(path), resume=True)
+    assert journal.settings == SETTINGS
+    assert journal.files == [str(tmp_path / name) for name in ('a.jpg', 'b.jpg', 'c.jpg')]
+    assert journal.max_per_gallery == 2
+    assert journal.gallery_tokens == {1: TOKEN}
+    assert journal.get('a.jpg') == make_submission('a.jpg')
+    assert journal.get('b.jpg') is None
+    assert journal.get('c.jpg') is None
+
+@pytest.mark.asyncio
+async def test_Journal_resumes_batch_from_other_directory(tmp_path, monkeypatch):
+    (tmp_path / 'photos').mkdir()
+    (tmp_path / 'other').mkdir()
+    path = tmp_path / 'journal'
+    monkeypatch.chdir(tmp_path / 'photos')
+    journal = _journal.Journal(str(path))
+    journal.start(SETTINGS)
+    await collect(journal.add_files(aiter(['a.jpg', 'b.jpg'])))
+    journal.add(make_submission('a.jpg'))
+    journal.close()
+
+    monkeypatch.chdir(tmp_path / 'other')
+    journal = _journal.Journal(str(path), resume=True)
+    a_jpg, b_jpg = journal.files
+    assert (a_jpg, b_jpg) == (str(tmp_path / 'photos' / 'a.jpg'), str(tmp_path / 'photos' / 'b.jpg'))
+    assert journal.get(a_jpg) == {**make_submission('a.jpg'), 'filepath': a_jpg}
+    assert journal.get('a.jpg') is None
+    assert journal.get(b_jpg) is None
+
+def test_Journal_gives_up_after_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'journal'
+    journal = _journal.Journal(str(path), max_attempts=2)
+    journal.start(SETTINGS)
+    journal.add(make_submission('a.jpg', error='Oops'))
+    journal.add(make_submission('b.jpg', error='Oops'))
+    assert journal.get('a.jpg') is None
+    journal.close()
+
+    journal = _journal.Journal(str(path), resume=True, max_attempts=2)
+    journal.add(make_submission('a.jpg', error='Oops again'))
+    journal.add(make_submission('b.jpg'))
+    assert journal.get('a.jpg') == make_submission('a.jpg', error='Oops again')
+    assert journal.get('b.jpg') == make_submission('b.jpg')
+    assert (tmp_path / 'journal.failed').read_text() == f'{tmp_path}/a.jpg\n'
+
+def test_Journal_writes_non_utf8_paths_to_dead_letter_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'journal'
+    journal = _journal.Journal(str(path), max_attempts=1)
+    journal.start(SETTINGS)
+    filepath = os.fsdecode(b'\xff.jpg')
+    journal.add(make_submission(filepath, error='Oops'))
+    journal.close()
+    assert (tmp_path / 'journal.failed').read_bytes() == os.fsencode(f'{tmp_path}/') + b'\xff.jpg\n'
+    journal = _journal.Journal(str(path), resume=True, max_attempts=1)
+    assert journal.get(filepath) == make_submission(filepath, error='Oops')
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import signal
+from unittest.mock import Mock, call
+
+import pytest
+
+from imgbox import _loop
+
+
+def test_get_loop_factory_with_asyncio(mocker):
+    mocker.patch.dict('sys.modules', {'uvloop': Mock()})
+    assert _loop.get_loop_factory('asyncio') is asyncio.new_event_loop
+
+def test_get_loop_factory_with_uvloop(mocker):
+    uvloop = Mock()
+    mocker.patch.dict('sys.modules', {'uvloop': uvloop})
+    assert _loop.get_loop_factory('uvloop') is uvloop.new_event_loop
+
+def test_get_loop_factory_with_uvloop_not_installed(mocker):
+    mocker.patch.dict('sys.modules', {'uvloop': None})
+    with pytest.raises(ValueError, match=r'^uvloop is not installed$'):
+        _loop.get_loop_factory('uvloop')
+
+def test_get_loop_factory_prefers_uvloop(mocker):
+    uvloop = Mock()
+    mocker.patch.dict('sys.modules', {'uvloop': uvloop})
+    assert _loop.get_loop_factory() is uvloop.new_event_loop
+
+def test_get_loop_factory_without_uvloop(mocker):
+    mocker.patch.dict('sys.modules', {'uvloop': None})
+    assert _loop.get_loop_factory() is asyncio.new_event_loop
+
+def test_get_loop_factory_with_invalid_name():
+    with pytest.raises(ValueError, match=r"^Invalid event loop: 'foo'$"):
+        _loop.get_loop_factory('foo')
+
+
+def test_run_returns_result_from_loop_of_factory():
+    loop_factory = Mock(side_effect=asyncio.new_event_loop)
+
+    async def coro():
+        return type(asyncio.get_running_loop())
+
+    assert _loop.run(coro(), loop_factory) is type(asyncio.new_event_loop())
+    assert loop_factory.call_args_list == [call()]
+
+def test_run_cancels_coroutine_on_sigint():
+    calls = []
+
+    async def background():
+        try:
+            await asyncio.sleep(60)
+        finally:
+            calls.append('background cancelled')
+
+    async def coro():
+        asyncio.ensure_future(background())
+        os.kill(os.getpid(), signal.SIGINT)
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            calls.append('cancelled')
+            await asyncio.sleep(0)
+            calls.append('cleaned up')
+            raise
+
+    with pytest.raises(KeyboardInterrupt):
+        _loop.run(coro(), asyncio.new_event_loop)
+    assert calls == ['cancelled', 'cleaned up', 'background cancelled']
+    assert signal.getsignal(signal.SIGINT) is signal.default_int_handler
+
+def test_run_does_not_turn_other_cancellation_into_KeyboardInterrupt():
+    async def coro():
+        asyncio.current_task().cancel()
+        await asyncio.sleep(0)
+
+    with pytest.raises(asyncio.CancelledError):
+        _loop.run(coro(), asyncio.new_event_loop)
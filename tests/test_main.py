@@ -1,8 +1,9 @@
+import asyncio
 from unittest.mock import Mock, call
 
 import pytest
 
-from imgbox import __bugtracker_url__
+from imgbox import __bugtracker_url__, _tokens, _upload
 from imgbox._main import run
 
 
@@ -30,9 +31,19 @@ def gallery(mocker):
     )
 
 
+@pytest.fixture(autouse=True)
+def cache(mocker):
+    return mocker.patch('imgbox._cache.Cache')
+
+
+@pytest.fixture(autouse=True)
+def retry(mocker):
+    return mocker.patch('imgbox._retry.Retry', return_value=Mock(stalled=0))
+
+
 @pytest.mark.asyncio
 async def test_run_with_debug_argument(mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     mocker.patch('logging.basicConfig')
     with mock_io():
         await run(args=['--debug'])
@@ -47,8 +58,7 @@ async def test_run_with_debug_argument(mock_io, mocker, gallery):
 
 @pytest.mark.asyncio
 async def test_run_with_get_files_raising_ValueError(mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_args')
-    mocker.patch('imgbox._input.get_files', side_effect=ValueError('No'))
+    mocker.patch('imgbox._input.get_files', AsyncMock(side_effect=ValueError('No')))
     with mock_io() as cap:
         await run(args=[])
     assert cap.stdout == ''
@@ -58,7 +68,7 @@ async def test_run_with_get_files_raising_ValueError(mock_io, mocker, gallery):
 @pytest.mark.parametrize(argnames='parameter', argvalues=('--title', '-t'))
 @pytest.mark.asyncio
 async def test_run_with_title_argument(parameter, mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     with mock_io():
         await run(args=[parameter, 'Foo'])
     assert gallery.call_args_list == [
@@ -75,7 +85,7 @@ async def test_run_with_title_argument(parameter, mock_io, mocker, gallery):
 @pytest.mark.parametrize(argnames='parameter', argvalues=('--adult', '-a'))
 @pytest.mark.asyncio
 async def test_run_with_adult_argument(parameter, mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     with mock_io():
         await run(args=[parameter])
     assert gallery.call_args_list == [
@@ -92,7 +102,7 @@ async def test_run_with_adult_argument(parameter, mock_io, mocker, gallery):
 @pytest.mark.parametrize(argnames='parameter', argvalues=('--thumb-width', '-w'))
 @pytest.mark.asyncio
 async def test_run_with_thumb_width_argument(parameter, mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     with mock_io():
         await run(args=[parameter, '123'])
     assert gallery.call_args_list == [
@@ -109,7 +119,7 @@ async def test_run_with_thumb_width_argument(parameter, mock_io, mocker, gallery
 @pytest.mark.parametrize(argnames='parameter', argvalues=('--square-thumbs', '-q'))
 @pytest.mark.asyncio
 async def test_run_with_square_thumbs_argument(parameter, mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     with mock_io():
         await run(args=[parameter])
     assert gallery.call_args_list == [
@@ -126,7 +136,7 @@ async def test_run_with_square_thumbs_argument(parameter, mock_io, mocker, galle
 @pytest.mark.parametrize(argnames='parameter', argvalues=('--comments', '-c'))
 @pytest.mark.asyncio
 async def test_run_with_comments_argument(parameter, mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     with mock_io():
         await run(args=[parameter])
     assert gallery.call_args_list == [
@@ -142,8 +152,8 @@ async def test_run_with_comments_argument(parameter, mock_io, mocker, gallery):
 
 @pytest.mark.parametrize(argnames='parameter', argvalues=('--json', '-j'))
 @pytest.mark.asyncio
-async def test_run_with_json_argument(parameter, mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files', return_value=['foo.jpg', 'bar.png'])
+async def test_run_with_json_argument(parameter, mock_io, mocker, gallery, cache, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg', 'bar.png']))
     mock_output_json = mocker.patch('imgbox._output.json', AsyncMock(return_value=10))
     mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=20))
     with mock_io():
@@ -152,15 +162,27 @@ async def test_run_with_json_argument(parameter, mock_io, mocker, gallery):
     assert mock_output_json.call_args_list == [
         call(
             gallery.return_value,
-            ['foo.jpg', 'bar.png']
+            ['foo.jpg', 'bar.png'],
+            jobs=1,
+            order='input',
+            schedule='input',
+            cache=None,
+            journal=None,
+            max_per_gallery=1000,
+            preprocessor=None,
+            retry=retry.return_value,
+            tracer=None,
+            progress=None,
+            rate_limit=None,
+            deadline=None,
         ),
     ]
     assert mock_output_text.call_args_list == []
 
 
 @pytest.mark.asyncio
-async def test_run_with_no_json_argument(mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files', return_value=['foo.jpg', 'bar.png'])
+async def test_run_with_no_json_argument(mock_io, mocker, gallery, cache, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg', 'bar.png']))
     mock_output_json = mocker.patch('imgbox._output.json', AsyncMock(return_value=10))
     mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=20))
     with mock_io():
@@ -170,14 +192,527 @@ async def test_run_with_no_json_argument(mock_io, mocker, gallery):
     assert mock_output_text.call_args_list == [
         call(
             gallery.return_value,
-            ['foo.jpg', 'bar.png']
+            ['foo.jpg', 'bar.png'],
+            jobs=1,
+            order='input',
+            schedule='input',
+            cache=None,
+            journal=None,
+            max_per_gallery=1000,
+            preprocessor=None,
+            retry=retry.return_value,
+            tracer=None,
+            progress=None,
+            rate_limit=None,
+            deadline=None,
+        ),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_with_ndjson_argument(mock_io, mocker, gallery, cache, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg', 'bar.png']))
+    mock_output_json = mocker.patch('imgbox._output.json', AsyncMock(return_value=10))
+    mock_output_ndjson = mocker.patch('imgbox._output.ndjson', AsyncMock(return_value=30))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=20))
+    with mock_io():
+        exit_code = await run(args=['--ndjson'])
+        assert exit_code == 30
+    assert mock_output_ndjson.call_args_list == [
+        call(
+            gallery.return_value,
+            ['foo.jpg', 'bar.png'],
+            jobs=1,
+            order='input',
+            schedule='input',
+            cache=None,
+            journal=None,
+            max_per_gallery=1000,
+            preprocessor=None,
+            retry=retry.return_value,
+            tracer=None,
+            progress=None,
+            rate_limit=None,
+            deadline=None,
+        ),
+    ]
+    assert mock_output_json.call_args_list == []
+    assert mock_output_text.call_args_list == []
+
+
+@pytest.mark.asyncio
+async def test_run_with_json_and_ndjson_argument(mock_io, mocker, gallery):
+    with mock_io() as cap:
+        with pytest.raises(SystemExit):
+            await run(args=['--json', '--ndjson'])
+    assert 'argument --ndjson: not allowed with argument --json/-j' in cap.stderr
+
+
+@pytest.mark.parametrize(argnames='parameter', argvalues=('--jobs', '-J'))
+@pytest.mark.asyncio
+async def test_run_with_jobs_argument(parameter, mock_io, mocker, gallery, cache, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg', 'bar.png']))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=[parameter, '3', '--order', 'completion'])
+    assert mock_output_text.call_args_list == [
+        call(
+            gallery.return_value,
+            ['foo.jpg', 'bar.png'],
+            jobs=3,
+            order='completion',
+            schedule='input',
+            cache=None,
+            journal=None,
+            max_per_gallery=1000,
+            preprocessor=None,
+            retry=retry.return_value,
+            tracer=None,
+            progress=None,
+            rate_limit=None,
+            deadline=None,
         ),
     ]
 
 
+@pytest.mark.parametrize(argnames='schedule', argvalues=('smallest-first', 'largest-first'))
+@pytest.mark.asyncio
+async def test_run_with_schedule_argument(schedule, mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--schedule', schedule])
+    assert mock_output_text.call_args_list[0][1]['schedule'] == schedule
+
+@pytest.mark.asyncio
+async def test_run_with_invalid_schedule_argument(mock_io, mocker, gallery):
+    with mock_io() as cap:
+        with pytest.raises(SystemExit):
+            await run(args=['--schedule', 'random'])
+    assert "argument --schedule: invalid choice: 'random'" in cap.stderr
+
+
+@pytest.mark.parametrize(argnames='value', argvalues=('0', '-1', 'foo'))
+@pytest.mark.asyncio
+async def test_run_with_invalid_jobs_argument(value, mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock())
+    with mock_io() as cap:
+        with pytest.raises(SystemExit):
+            await run(args=['--jobs', value])
+    assert 'argument --jobs/-J:' in cap.stderr
+    assert gallery.call_args_list == []
+
+
+@pytest.mark.asyncio
+async def test_run_with_max_per_gallery_argument(mock_io, mocker, gallery, cache):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg', 'bar.png']))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--max-per-gallery', '50'])
+    assert mock_output_text.call_args_list[0][1]['max_per_gallery'] == 50
+
+
+@pytest.mark.parametrize(
+    argnames='args, exp_kwargs',
+    argvalues=(
+        (['--fit'], {'fit': True, 'optimize': False}),
+        (['--optimize'], {'fit': False, 'optimize': True}),
+        (['--fit', '--optimize'], {'fit': True, 'optimize': True}),
+    ),
+)
+@pytest.mark.asyncio
+async def test_run_with_preprocessing_arguments(args, exp_kwargs, mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    Preprocessor = mocker.patch('imgbox._preprocess.Preprocessor')
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=args)
+    assert Preprocessor.call_args_list == [call(**exp_kwargs)]
+    assert mock_output_text.call_args_list[0][1]['preprocessor'] is Preprocessor.return_value
+    assert Preprocessor.return_value.close.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_run_with_Preprocessor_raising_ValueError(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._preprocess.Preprocessor', side_effect=ValueError('No Pillow'))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--fit'])
+    assert exit_code == 1
+    assert cap.stderr == 'No Pillow\n'
+    assert mock_output_text.call_args_list == []
+
+
+@pytest.mark.asyncio
+async def test_run_with_default_retry_arguments(mock_io, mocker, gallery, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=[])
+    assert retry.call_args_list == [call(attempts=3, timeout=None, stall_timeout=None)]
+
+@pytest.mark.asyncio
+async def test_run_with_custom_retry_arguments(mock_io, mocker, gallery, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--attempts', '5', '--timeout', '60', '--stall-timeout', '20'])
+    assert retry.call_args_list == [call(attempts=5, timeout=60, stall_timeout=20)]
+
+@pytest.mark.parametrize(
+    argnames='output_exit_code, stalled, exp_exit_code',
+    argvalues=((0, 0, 0), (1, 0, 1), (1, 2, 4)),
+)
+@pytest.mark.asyncio
+async def test_run_with_stalled_uploads(output_exit_code, stalled, exp_exit_code,
+                                        mock_io, mocker, gallery, retry):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=output_exit_code))
+    retry.return_value.stalled = stalled
+    with mock_io():
+        exit_code = await run(args=['--stall-timeout', '20'])
+    assert exit_code == exp_exit_code
+
+@pytest.mark.asyncio
+async def test_run_with_deadline_argument(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(
+        side_effect=_upload.DeadlineExceeded('Deadline exceeded'),
+    ))
+    with mock_io() as cap:
+        exit_code = await run(args=['--deadline', '30'])
+    assert exit_code == 3
+    assert cap.stderr == 'Deadline of 30 seconds exceeded\n'
+    deadline = mock_output_text.call_args_list[0][1]['deadline']
+    assert deadline == pytest.approx(asyncio.get_running_loop().time() + 30, abs=1)
+
+@pytest.mark.asyncio
+async def test_run_with_deadline_argument_while_waiting_for_files(mock_io, mocker, gallery):
+    async def get_files(args):
+        await asyncio.sleep(10)
+
+    mocker.patch('imgbox._input.get_files', get_files)
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await asyncio.wait_for(run(args=['--deadline', '1']), timeout=5)
+    assert exit_code == 3
+    assert cap.stderr == 'Deadline of 1 seconds exceeded\n'
+    assert gallery.call_args_list == []
+    assert mock_output_text.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_run_with_deadline_argument_while_reopening_gallery(mock_io, mocker, gallery):
+    Journal = mocker.patch('imgbox._journal.Journal', return_value=Mock(
+        settings={}, files=['foo.jpg'], max_per_gallery=None, gallery_tokens={0: {'token_id': 123}},
+    ))
+
+    async def reopen(gallery, token):
+        await asyncio.sleep(10)
+
+    mocker.patch('imgbox._gallery.reopen', reopen)
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await asyncio.wait_for(
+            run(args=['--resume', 'my.journal', '--deadline', '1']),
+            timeout=5,
+        )
+    assert exit_code == 3
+    assert cap.stderr == 'Deadline of 1 seconds exceeded\n'
+    assert mock_output_text.call_args_list == []
+    assert Journal.return_value.close.call_args_list == [call()]
+
+@pytest.mark.parametrize('value', ('0', '-1', 'foo'))
+@pytest.mark.asyncio
+async def test_run_with_invalid_deadline_argument(value, mock_io, gallery):
+    with mock_io() as cap:
+        with pytest.raises(SystemExit):
+            await run(args=['--deadline', value])
+    assert 'argument --deadline: ' in cap.stderr
+
+
+@pytest.mark.asyncio
+async def test_run_without_trace_or_stats_argument(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    Tracer = mocker.patch('imgbox._trace.Tracer')
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=[])
+    assert Tracer.call_args_list == []
+    assert mock_output_text.call_args_list[0][1]['tracer'] is None
+
+@pytest.mark.asyncio
+async def test_run_with_stats_argument(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    Tracer = mocker.patch('imgbox._trace.Tracer', return_value=Mock(
+        sample_lag=AsyncMock(),
+        summary=Mock(return_value='<summary>'),
+    ))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--stats'])
+    assert exit_code == 0
+    assert cap.stderr == '<summary>\n'
+    assert mock_output_text.call_args_list[0][1]['tracer'] is Tracer.return_value
+    assert Tracer.return_value.write.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_run_with_progress_argument(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    Progress = mocker.patch('imgbox._progress.Progress', return_value=Mock(display=AsyncMock()))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        exit_code = await run(args=['--progress'])
+    assert exit_code == 0
+    assert Progress.call_args_list == [call()]
+    assert mock_output_text.call_args_list[0][1]['progress'] is Progress.return_value
+
+@pytest.mark.parametrize(
+    argnames='value, exp_rate',
+    argvalues=(('1000', 1000), ('500k', 500 * 2**10), ('5M', 5 * 2**20), ('1.5G', 1.5 * 2**30)),
+)
+@pytest.mark.asyncio
+async def test_run_with_limit_rate_argument(value, exp_rate, mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    RateLimit = mocker.patch('imgbox._ratelimit.RateLimit', return_value=Mock(
+        summary=Mock(return_value='<summary>'),
+    ))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--limit-rate', value])
+    assert exit_code == 0
+    assert cap.stderr == '<summary>\n'
+    assert RateLimit.call_args_list == [call(exp_rate)]
+    assert mock_output_text.call_args_list[0][1]['rate_limit'] is RateLimit.return_value
+
+@pytest.mark.parametrize(
+    argnames='value, exp_error',
+    argvalues=(('foo', 'Not a rate: foo'), ('5X', 'Not a rate: 5X'), ('0', 'Must be 1 or higher: 0')),
+)
+@pytest.mark.asyncio
+async def test_run_with_invalid_limit_rate_argument(value, exp_error, mock_io, gallery):
+    with mock_io() as cap:
+        with pytest.raises(SystemExit):
+            await run(args=['--limit-rate', value])
+    assert f'argument --limit-rate: {exp_error}' in cap.stderr
+
+@pytest.mark.asyncio
+async def test_run_with_trace_argument(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    Tracer = mocker.patch('imgbox._trace.Tracer', return_value=Mock(sample_lag=AsyncMock()))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--trace', 'path/to/trace.json'])
+    assert exit_code == 0
+    assert cap.stderr == ''
+    assert mock_output_text.call_args_list[0][1]['tracer'] is Tracer.return_value
+    assert Tracer.return_value.summary.call_args_list == []
+    assert Tracer.return_value.write.call_args_list == [call('path/to/trace.json')]
+
+@pytest.mark.asyncio
+async def test_run_with_trace_argument_and_write_raising_OSError(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._trace.Tracer', return_value=Mock(
+        sample_lag=AsyncMock(),
+        write=Mock(side_effect=OSError('trace.json: Permission denied')),
+    ))
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--trace', 'trace.json'])
+    assert exit_code == 1
+    assert cap.stderr == 'trace.json: Permission denied\n'
+
+
+@pytest.mark.asyncio
+async def test_run_with_default_cache_arguments(mock_io, mocker, gallery, cache):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._paths.cache_path', return_value='path/to/uploads.db')
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--cache'])
+    assert cache.call_args_list == [
+        call(path='path/to/uploads.db', max_age=None, max_entries=100000),
+    ]
+    assert cache.return_value.close.call_args_list == [call()]
+
+
+@pytest.mark.asyncio
+async def test_run_with_custom_cache_arguments(mock_io, mocker, gallery, cache):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--cache', '--cache-path', 'my.db', '--cache-max-age', '2',
+                        '--cache-max-entries', '10'])
+    assert cache.call_args_list == [
+        call(path='my.db', max_age=2 * 86400, max_entries=10),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_without_cache_argument(mock_io, mocker, gallery, cache):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--cache-path', 'my.db'])
+    assert cache.call_args_list == []
+    assert mock_output_text.call_args_list[0][1]['cache'] is None
+
+
+@pytest.mark.asyncio
+async def test_run_with_cache_raising_OSError(mock_io, mocker, gallery, cache):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    cache.side_effect = OSError('path/to/uploads.db: Permission denied')
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--cache'])
+    assert exit_code == 1
+    assert cap.stdout == ''
+    assert cap.stderr == 'path/to/uploads.db: Permission denied\n'
+    assert gallery.call_args_list == []
+    assert mock_output_text.call_args_list == []
+
+
+@pytest.mark.asyncio
+async def test_run_with_journal_argument(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg', 'bar.png']))
+    Journal = mocker.patch('imgbox._journal.Journal', return_value=Mock(gallery_tokens={}))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        await run(args=['--journal', 'my.journal', '--title', 'Foo'])
+    settings = {'title': 'Foo', 'adult': False, 'thumb_width': 100,
+                'square_thumbs': False, 'comments_enabled': False}
+    assert Journal.call_args_list == [call('my.journal')]
+    assert Journal.return_value.start.call_args_list == [call(settings, 1000)]
+    assert Journal.return_value.add_files.call_args_list == [call(['foo.jpg', 'bar.png'])]
+    assert mock_output_text.call_args_list[0][0] == (
+        gallery.return_value,
+        Journal.return_value.add_files.return_value,
+    )
+    assert mock_output_text.call_args_list[0][1]['journal'] is Journal.return_value
+    assert Journal.return_value.close.call_args_list == [call()]
+
+
+@pytest.mark.asyncio
+async def test_run_with_resume_argument(mock_io, mocker, gallery):
+    settings = {'title': 'Foo', 'adult': True, 'thumb_width': 300,
+                'square_thumbs': False, 'comments_enabled': False}
+    mock_get_files = mocker.patch('imgbox._input.get_files', AsyncMock())
+    Journal = mocker.patch('imgbox._journal.Journal', return_value=Mock(
+        settings=settings,
+        files=['foo.jpg', 'bar.png'],
+        max_per_gallery=2,
+        gallery_tokens={0: {'token_id': 123}, 1: {'token_id': 456}},
+    ))
+    mock_reopen = mocker.patch('imgbox._gallery.reopen', AsyncMock())
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        exit_code = await run(args=['--resume', 'my.journal'])
+    assert exit_code == 0
+    assert mock_get_files.call_args_list == []
+    assert Journal.call_args_list == [call('my.journal', resume=True)]
+    assert Journal.return_value.start.call_args_list == []
+    assert gallery.call_args_list == [call(**settings)]
+    assert mock_reopen.call_args_list == [call(gallery.return_value, {'token_id': 123})]
+    assert mock_output_text.call_args_list[0][0] == (gallery.return_value, ['foo.jpg', 'bar.png'])
+    assert mock_output_text.call_args_list[0][1]['journal'] is Journal.return_value
+    assert mock_output_text.call_args_list[0][1]['max_per_gallery'] == 2
+
+
+@pytest.mark.asyncio
+async def test_run_with_resume_argument_and_files(mock_io, mocker, gallery):
+    Journal = mocker.patch('imgbox._journal.Journal')
+    with mock_io() as cap:
+        exit_code = await run(args=['--resume', 'my.journal', 'foo.jpg'])
+    assert exit_code == 1
+    assert cap.stderr == '--resume does not take any files\n'
+    assert Journal.call_args_list == []
+
+
+@pytest.mark.asyncio
+async def test_run_with_saved_gallery_argument(mock_io, mocker, gallery, tmp_path):
+    store = str(tmp_path / 'galleries.json')
+    _tokens.TokenStore(store).save('daily', {'token_id': 123, 'token_secret': 'abc'})
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mock_reopen = mocker.patch('imgbox._gallery.reopen', AsyncMock())
+    mock_save = mocker.patch('imgbox._tokens.TokenStore.save')
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    for name in ('daily', 'https://imgbox.com/upload/edit/123/abc'):
+        with mock_io():
+            exit_code = await run(args=['--gallery', name, '--gallery-store', store])
+        assert exit_code == 0
+    assert mock_reopen.call_args_list == 2 * [
+        call(gallery.return_value, {'token_id': 123, 'token_secret': 'abc'}),
+    ]
+    assert mock_output_text.call_args_list[0][0] == (gallery.return_value, ['foo.jpg'])
+    assert mock_save.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_run_with_new_gallery_argument(mock_io, mocker, gallery, tmp_path):
+    store = str(tmp_path / 'galleries.json')
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mock_reopen = mocker.patch('imgbox._gallery.reopen', AsyncMock())
+    mocker.patch('imgbox._gallery.get_token', return_value={'token_id': 123})
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=1))
+    with mock_io():
+        exit_code = await run(args=['--gallery', 'daily', '--gallery-store', store])
+    assert exit_code == 1
+    assert mock_reopen.call_args_list == []
+    assert _tokens.TokenStore(store).get('daily') == {'token_id': 123}
+
+@pytest.mark.asyncio
+async def test_run_with_new_gallery_argument_and_save_raising_OSError(mock_io, mocker, gallery):
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mocker.patch('imgbox._tokens.TokenStore', return_value=Mock(
+        get=Mock(return_value=None),
+        save=Mock(side_effect=OSError('galleries.json: Permission denied')),
+    ))
+    mocker.patch('imgbox._gallery.get_token', return_value={'token_id': 123})
+    mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--gallery', 'daily'])
+    assert exit_code == 1
+    assert cap.stderr == 'galleries.json: Permission denied\n'
+
+@pytest.mark.parametrize(
+    argnames='args, exp_error',
+    argvalues=(
+        (['--gallery', 'https://imgbox.com/upload/edit/123/abc', 'foo.jpg'],
+         'Unknown gallery: https://imgbox.com/upload/edit/123/abc'),
+        (['--gallery', 'daily', '--resume', 'my.journal'],
+         '--gallery does not work with --resume or --manifest'),
+        (['--gallery', 'daily', '--manifest', 'jobs.jsonl'],
+         '--gallery does not work with --resume or --manifest'),
+    ),
+)
+@pytest.mark.asyncio
+async def test_run_with_invalid_gallery_argument(args, exp_error, mock_io, mocker, gallery,
+                                                 tmp_path):
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=args + ['--gallery-store', str(tmp_path / 'galleries.json')])
+    assert exit_code == 1
+    assert cap.stderr == f'{exp_error}\n'
+    assert gallery.call_args_list == []
+    assert mock_output_text.call_args_list == []
+
+
+@pytest.mark.asyncio
+async def test_run_with_reopen_raising_ConnectionError(mock_io, mocker, gallery):
+    Journal = mocker.patch('imgbox._journal.Journal', return_value=Mock(
+        settings={}, files=['foo.jpg'], max_per_gallery=None, gallery_tokens={0: {'token_id': 123}},
+    ))
+    mocker.patch('imgbox._gallery.reopen', AsyncMock(side_effect=ConnectionError('No')))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io() as cap:
+        exit_code = await run(args=['--resume', 'my.journal'])
+    assert exit_code == 1
+    assert cap.stderr == 'No\n'
+    assert mock_output_text.call_args_list == []
+    assert Journal.return_value.close.call_args_list == [call()]
+
+
 @pytest.mark.asyncio
 async def test_run_with_output_creator_raising_exception(mock_io, mocker, gallery):
-    mocker.patch('imgbox._input.get_files')
+    mocker.patch('imgbox._input.get_files', AsyncMock())
     mocker.patch('imgbox._output.json', AsyncMock(side_effect=ValueError('Foo')))
     mocker.patch('imgbox._output.text', AsyncMock(side_effect=ValueError('Bar')))
     with mock_io() as cap:
@@ -188,3 +723,91 @@ async def test_run_with_output_creator_raising_exception(mock_io, mocker, galler
     print(cap.stderr)
     assert cap.stderr.endswith('\n\nPlease report this as a bug: '
                                f'{__bugtracker_url__}\n')
+
+
+def test_main_with_serve_argument(mocker):
+    mock_daemon_main = mocker.patch('imgbox._daemon.main', return_value=0)
+    from imgbox._main import main
+    assert main(['serve', '--jobs', '3']) == 0
+    assert mock_daemon_main.call_args_list == [call(['--jobs', '3'])]
+
+def test_main_with_loop_argument(mocker):
+    get_loop_factory = mocker.patch('imgbox._loop.get_loop_factory')
+    run = mocker.patch('imgbox._loop.run', side_effect=lambda coro, _: coro.close() or 5)
+    from imgbox._main import main
+    assert main(['--loop', 'asyncio', 'foo.jpg']) == 5
+    assert get_loop_factory.call_args_list == [call('asyncio')]
+    assert run.call_args_list[0][0][1] is get_loop_factory.return_value
+
+def test_main_with_unavailable_loop(mock_io, mocker):
+    mocker.patch('imgbox._loop.get_loop_factory', side_effect=ValueError('uvloop is not installed'))
+    run = mocker.patch('imgbox._loop.run')
+    from imgbox._main import main
+    with mock_io() as cap:
+        assert main(['--loop', 'uvloop', 'foo.jpg']) == 1
+    assert cap.stderr == 'uvloop is not installed\n'
+    assert run.call_args_list == []
+
+def test_main_is_interrupted(mocker):
+    def run(coro, _):
+        coro.close()
+        raise KeyboardInterrupt()
+
+    mocker.patch('imgbox._loop.run', side_effect=run)
+    from imgbox._main import main
+    assert main(['foo.jpg']) == 130
+
+
+@pytest.mark.asyncio
+async def test_run_with_daemon_argument(mock_io, mocker, gallery):
+    mock_submit = mocker.patch('imgbox._daemon.submit', AsyncMock(return_value=3))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        exit_code = await run(args=['--daemon', 'foo.jpg'])
+    assert exit_code == 3
+    assert mock_submit.call_args_list[0][0][0].files == ['foo.jpg']
+    assert mock_output_text.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_run_with_daemon_argument_without_daemon(mock_io, mocker, gallery):
+    mocker.patch('imgbox._daemon.submit', AsyncMock(return_value=None))
+    mocker.patch('imgbox._input.get_files', AsyncMock(return_value=['foo.jpg']))
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        exit_code = await run(args=['--daemon', 'foo.jpg'])
+    assert exit_code == 0
+    assert mock_output_text.call_args_list[0][0] == (gallery.return_value, ['foo.jpg'])
+
+
+@pytest.mark.asyncio
+async def test_run_with_manifest_argument(mock_io, mocker, gallery):
+    Manifest = mocker.patch('imgbox._manifest.Manifest', return_value=AsyncContextManagerMock())
+    mock_get_files = mocker.patch('imgbox._input.get_files', AsyncMock())
+    mock_output_text = mocker.patch('imgbox._output.text', AsyncMock(return_value=0))
+    with mock_io():
+        exit_code = await run(args=['--manifest', 'jobs.jsonl', '--title', 'Foo',
+                                    '--max-per-gallery', '10'])
+    assert exit_code == 0
+    settings = {'title': 'Foo', 'adult': False, 'thumb_width': 100,
+                'square_thumbs': False, 'comments_enabled': False}
+    assert Manifest.call_args_list == [call('jobs.jsonl', settings, 10)]
+    assert mock_get_files.call_args_list == []
+    assert gallery.call_args_list == []
+    assert mock_output_text.call_args_list[0][0] == (None, Manifest.return_value)
+
+@pytest.mark.asyncio
+async def test_run_with_manifest_argument_and_files(mock_io, mocker, gallery):
+    Manifest = mocker.patch('imgbox._manifest.Manifest')
+    with mock_io() as cap:
+        exit_code = await run(args=['--manifest', 'jobs.jsonl', 'foo.jpg'])
+    assert exit_code == 1
+    assert cap.stderr == '--manifest does not take any files\n'
+    assert Manifest.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_run_with_invalid_manifest(mock_io, mocker, gallery):
+    mocker.patch('imgbox._manifest.Manifest', side_effect=ValueError('jobs.jsonl:3: Nope'))
+    with mock_io() as cap:
+        exit_code = await run(args=['--manifest', 'jobs.jsonl'])
+    assert exit_code == 1
+    assert cap.stderr == 'jobs.jsonl:3: Nope\n'
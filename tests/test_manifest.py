@@ -0,0 +1,110 @@
+import json
+from unittest.mock import Mock, call
+
+import pytest
+
+from imgbox import _manifest
+
+
+# Python 3.6 doesn't have AsyncMock
+class AsyncMock(Mock):
+    def __call__(self, *args, **kwargs):
+        async def coro(_sup=super()):
+            return _sup.__call__(*args, **kwargs)
+        return coro()
+
+
+DEFAULTS = {'title': None, 'thumb_width': 100, 'square_thumbs': False,
+            'adult': False, 'comments_enabled': False}
+
+
+@pytest.fixture
+def write_manifest(tmp_path):
+    def write(*objs):
+        path = tmp_path / 'jobs.jsonl'
+        path.write_text('\n'.join(o if isinstance(o, str) else json.dumps(o) for o in objs))
+        return str(path)
+    return write
+
+
+def test_manifest_reads_settings_and_files(write_manifest, tmp_path):
+    path = write_manifest(
+        {'title': 'Foo', 'thumb_width': 300, 'files': ['a.jpg', '/abs/b.jpg']},
+        '',
+        {'adult': True, 'comments': True, 'square_thumbs': True, 'files': ['c.jpg']},
+    )
+    manifest = _manifest.Manifest(path, DEFAULTS)
+    assert manifest._entries == [
+        ({**DEFAULTS, 'title': 'Foo', 'thumb_width': 300},
+         [str(tmp_path / 'a.jpg'), '/abs/b.jpg']),
+        ({**DEFAULTS, 'adult': True, 'comments_enabled': True, 'square_thumbs': True},
+         [str(tmp_path / 'c.jpg')]),
+    ]
+
+def test_manifest_reads_stdin(mock_io):
+    with mock_io(stdin=json.dumps({'files': ['a.jpg']})):
+        manifest = _manifest.Manifest('-', DEFAULTS)
+    assert manifest._entries == [(DEFAULTS, ['a.jpg'])]
+
+def test_manifest_with_nonexisting_file(tmp_path):
+    path = tmp_path / 'nonexisting.jsonl'
+    with pytest.raises(OSError, match=rf'^{path}: No such file or directory$'):
+        _manifest.Manifest(str(path), DEFAULTS)
+
+@pytest.mark.parametrize(
+    argnames='line, exp_error',
+    argvalues=(
+        ('{', 'Invalid JSON: Expecting property name enclosed in double quotes: '
+              'line 1 column 2 (char 1)'),
+        ('[]', 'Not a JSON object'),
+        ({'title': 'Foo'}, 'Missing list of files'),
+        ({'files': []}, 'Missing list of files'),
+        ({'files': 'a.jpg'}, 'Missing list of files'),
+        ({'files': ['a.jpg', 1]}, 'Invalid file: 1'),
+        ({'files': ['a.jpg'], 'foo': 'bar'}, 'Unknown key: foo'),
+        ({'files': ['a.jpg'], 'title': 1}, 'Invalid title: 1'),
+        ({'files': ['a.jpg'], 'thumb_width': True}, 'Invalid thumb_width: True'),
+        ({'files': ['a.jpg'], 'adult': 'yes'}, "Invalid adult: 'yes'"),
+    ),
+)
+def test_manifest_with_invalid_line(line, exp_error, write_manifest):
+    path = write_manifest({'files': ['a.jpg']}, line)
+    with pytest.raises(ValueError) as excinfo:
+        _manifest.Manifest(path, DEFAULTS)
+    assert str(excinfo.value) == f'{path}:2: {exp_error}'
+
+def test_manifest_without_galleries(write_manifest):
+    path = write_manifest('', ' ')
+    with pytest.raises(ValueError, match=rf'^{path}: No galleries$'):
+        _manifest.Manifest(path, DEFAULTS)
+
+
+def test_manifest_must_be_open_to_iterate(write_manifest):
+    manifest = _manifest.Manifest(write_manifest({'files': ['a.jpg']}), DEFAULTS)
+    with pytest.raises(RuntimeError, match=r'^Manifest is not open$'):
+        list(manifest)
+
+@pytest.mark.asyncio
+async def test_manifest_yields_galleries_and_files(write_manifest, tmp_path, mocker):
+    new = mocker.patch('imgbox._gallery.new', side_effect=lambda **kw: Mock(close=AsyncMock()))
+    copy = mocker.patch('imgbox._gallery.copy', return_value=Mock(close=AsyncMock()))
+    transport = mocker.patch('httpx.AsyncHTTPTransport', return_value=Mock(aclose=AsyncMock()))
+    path = write_manifest(
+        {'title': 'Foo', 'files': ['a.jpg', 'b.jpg', 'c.jpg']},
+        {'title': 'Bar', 'files': ['d.jpg']},
+    )
+    manifest = _manifest.Manifest(path, DEFAULTS, max_per_gallery=2)
+    async with manifest:
+        items = list(manifest)
+    galleries = [g for g, _ in items]
+    assert [f for _, f in items] == [str(tmp_path / f) for f in ('a.jpg', 'b.jpg', 'c.jpg', 'd.jpg')]
+    assert galleries[0] is galleries[1]
+    assert galleries[2] is copy.return_value
+    assert new.call_args_list == [
+        call(transport=transport.return_value, **{**DEFAULTS, 'title': 'Foo'}),
+        call(transport=transport.return_value, **{**DEFAULTS, 'title': 'Bar'}),
+    ]
+    assert copy.call_args_list == [call(galleries[0], number=2, transport=transport.return_value)]
+    for g in (galleries[0], galleries[2], galleries[3]):
+        assert g.close.call_args_list == [call()]
+    assert transport.return_value.aclose.call_args_list == [call()]
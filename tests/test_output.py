@@ -1,11 +1,15 @@
+import asyncio
+import io
 import json
 import os
+import re
 from unittest.mock import Mock, call
 
+import httpx
 import pytest
-from pyimgbox import MAX_FILE_SIZE, Submission
+from pyimgbox import Submission
 
-from imgbox import _output
+from imgbox import _gallery, _output
 
 
 # Python 3.6 doesn't have AsyncMock
@@ -16,124 +20,115 @@ class AsyncMock(Mock):
         return coro()
 
 
-class AsyncIterator:
-    def __init__(self, seq=()):
-        self.iter = iter(seq)
-
-    def __aiter__(self):
-        return self
-
-    async def __anext__(self):
-        try:
-            return next(self.iter)
-        except StopIteration:
-            raise StopAsyncIteration
-
-
 @pytest.fixture
 def mock_gallery():
-    return Mock(
+    def create():
+        gallery.created = True
+
+    gallery = Mock(
         url='<Gallery URL>',
         edit_url='<Edit URL>',
-        create=AsyncMock(),
-        upload=AsyncMock(),
-        add=Mock(return_value=AsyncIterator(())),
+        created=False,
+        create=AsyncMock(side_effect=create),
+        upload=AsyncMock(side_effect=lambda fp: Submission(
+            filepath=fp, image_url='img', thumbnail_url='thumb', web_url='web',
+            gallery_url='<Gallery URL>', edit_url='<Edit URL>',
+        )),
         close=AsyncMock(),
     )
+    return gallery
 
 
-def test_assert_file_ok_with_nonexisting_file():
-    with pytest.raises(AssertionError, match=r'^No such file$'):
-        _output._assert_file_ok('path/to/nonexisting/file.jpg')
-
-def test_assert_file_ok_with_directory(tmp_path):
-    with pytest.raises(AssertionError, match=r'^Not a file$'):
-        _output._assert_file_ok(tmp_path)
-
-def test_assert_file_ok_with_unreadable_file(tmp_path):
-    filepath = tmp_path / 'foo.jpg'
-    filepath.write_bytes(b'data')
-    os.chmod(filepath, 0x000)
-    try:
-        with pytest.raises(AssertionError, match=r'^Not readable$'):
-            _output._assert_file_ok(filepath)
-    finally:
-        os.chmod(filepath, 0x600)
-
-def test_assert_file_ok_with_too_large_file(tmp_path):
-    filepath = tmp_path / 'foo.jpg'
-    # Create sparse file
-    f = open(filepath, 'wb')
-    f.truncate(MAX_FILE_SIZE + 1)
-    f.close()
-    with pytest.raises(AssertionError, match=rf'^File is larger than {MAX_FILE_SIZE} bytes$'):
-        _output._assert_file_ok(filepath)
-
-
-def test_all_files_ok_finds_no_issues(mock_io, mocker):
-    mocker.patch('imgbox._output._assert_file_ok')
-    with mock_io() as cap:
-        _output._all_files_ok(('foo.jpg', 'bar.jpg', 'baz.jpg'))
-    assert cap.stdout == ''
-    assert cap.stderr == ''
-
-def test_all_files_ok_finds_multiple_issues(mock_io, mocker):
-    mocker.patch('imgbox._output._assert_file_ok', side_effect=[
-        AssertionError('No file'),
-        None,
-        AssertionError('Bad file'),
-    ])
-    with mock_io() as cap:
-        _output._all_files_ok(('foo.jpg', 'bar.jpg', 'baz.jpg'))
-    assert cap.stdout == ''
-    assert cap.stderr == (
-        'foo.jpg: No file\n'
-        'baz.jpg: Bad file\n'
-    )
+@pytest.fixture
+def check_file(mocker):
+    # Files named "missing.*" don't exist
+    def check_file(filepath, max_size=None):
+        if os.path.basename(filepath).startswith('missing.'):
+            raise AssertionError('No such file or directory')
+        return Mock(st_size=123)
 
+    return mocker.patch('imgbox._upload._check_file', side_effect=check_file)
 
-@pytest.mark.asyncio
-async def test_text_fails_unless_all_files_ok(mock_io, mock_gallery, mocker):
-    mock_all_files_ok = mocker.patch('imgbox._output._all_files_ok', return_value=False)
-    with mock_io() as cap:
-        exit_code = await _output.text(mock_gallery, ['path/to/foo.jpg'])
-    assert exit_code == 1
-    assert cap.stderr == ''
-    assert cap.stdout == ''
-    assert mock_all_files_ok.call_args_list == [call(['path/to/foo.jpg'])]
-    assert mock_gallery.create.call_args_list == []
-    assert mock_gallery.add.call_args_list == []
 
 @pytest.mark.asyncio
 async def test_text_creates_gallery_before_uploading(mock_io, mock_gallery, mocker):
-    mocker.patch('imgbox._output._all_files_ok', return_value=True)
-    calls = AsyncMock(add=Mock(return_value=AsyncIterator(())))
+    mocker.patch('imgbox._upload._check_file')
+    calls = AsyncMock()
+    calls.create.side_effect = mock_gallery.create.side_effect
+    calls.upload.side_effect = mock_gallery.upload.side_effect
     mock_gallery.create = calls.create
-    mock_gallery.add = calls.add
+    mock_gallery.upload = calls.upload
     with mock_io():
         exit_code = await _output.text(mock_gallery, ['path/to/foo.jpg'])
     assert exit_code == 0
     assert calls.mock_calls == [
         call.create(),
-        call.add(['path/to/foo.jpg']),
+        call.upload('path/to/foo.jpg'),
     ]
 
 @pytest.mark.asyncio
-async def test_text_catches_ConnectionError_from_gallery_creation(mock_io, mock_gallery, mocker):
-    mocker.patch('imgbox._output._all_files_ok', return_value=True)
-    mock_gallery.create.side_effect = ConnectionError('Creation failed')
+async def test_text_validates_files_while_creating_gallery(mock_io, mock_gallery, mocker):
+    check_file = mocker.patch('imgbox._upload._check_file')
+    validated = []
+
+    async def create():
+        await asyncio.sleep(0.05)
+        validated.append(check_file.call_count)
+        mock_gallery.created = True
+
+    mock_gallery.create = create
+    mock_gallery.upload.side_effect = lambda fp: Submission(filepath=fp, error='Oops')
+    with mock_io() as cap:
+        await _output.text(mock_gallery, ['a.jpg', 'b.jpg'])
+    assert validated == [2]
+    assert cap.stdout.startswith('Gallery: <Gallery URL>\n   Edit: <Edit URL>\n* a.jpg\n')
+
+@pytest.mark.asyncio
+async def test_text_does_not_create_existing_gallery(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    mock_gallery.created = True
     with mock_io() as cap:
         exit_code = await _output.text(mock_gallery, ['path/to/foo.jpg'])
+    assert exit_code == 0
+    assert cap.stdout.startswith('Gallery: <Gallery URL>\n   Edit: <Edit URL>\n')
+    assert mock_gallery.create.call_args_list == []
+    assert mock_gallery.upload.call_args_list == [call('path/to/foo.jpg')]
+
+@pytest.mark.asyncio
+async def test_text_catches_ConnectionError_from_gallery_creation(mock_io, mock_gallery,
+                                                                  check_file):
+    creations = []
+
+    async def create():
+        creations.append(call())
+        # Fail while the uploads are waiting for the same request
+        await asyncio.sleep(0.01)
+        raise ConnectionError('Creation failed')
+
+    mock_gallery.create = create
+    with mock_io() as cap:
+        exit_code = await _output.text(mock_gallery, ['missing.jpg', 'foo.jpg', 'bar.jpg'])
     assert exit_code == 1
-    assert cap.stdout == ''
-    assert cap.stderr == 'Creation failed\n'
-    assert mock_gallery.create.call_args_list == [call()]
-    assert mock_gallery.add.call_args_list == []
+    assert cap.stdout == ('* missing.jpg\n  No such file or directory\n'
+                          '* foo.jpg\n  Creation failed\n'
+                          '* bar.jpg\n  Creation failed\n')
+    assert cap.stderr == ''
+    assert creations == [call()]
+    assert mock_gallery.upload.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_text_does_not_create_gallery_for_invalid_files(mock_io, mock_gallery, check_file):
+    with mock_io() as cap:
+        exit_code = await _output.text(mock_gallery, ['missing.jpg', 'missing.png'])
+    assert exit_code == 1
+    assert cap.stdout == ('* missing.jpg\n  No such file or directory\n'
+                          '* missing.png\n  No such file or directory\n')
+    assert mock_gallery.create.call_args_list == []
 
 @pytest.mark.asyncio
 async def test_text_handles_error_when_adding_to_gallery(mock_io, mock_gallery, mocker):
-    mocker.patch('imgbox._output._all_files_ok', return_value=True)
-    mock_gallery.add.return_value = AsyncIterator((
+    mocker.patch('imgbox._upload._check_file')
+    mock_gallery.upload.side_effect = (
         Submission(filepath='path/to/foo.jpg', success=True,
                    image_url='img/foo', thumbnail_url='thumb/foo', web_url='web/foo',
                    gallery_url='gallery/foo', edit_url='edit/foo'),
@@ -141,7 +136,7 @@ async def test_text_handles_error_when_adding_to_gallery(mock_io, mock_gallery,
         Submission(filepath='path/to/baz.jpg', success=True,
                    image_url='img/baz', thumbnail_url='thumb/baz', web_url='web/baz',
                    gallery_url='gallery/baz', edit_url='edit/baz'),
-    ))
+    )
     with mock_io() as cap:
         exit_code = await _output.text(mock_gallery, ['path/to/foo.jpg',
                                                       'path/to/bar.jpg',
@@ -163,31 +158,67 @@ async def test_text_handles_error_when_adding_to_gallery(mock_io, mock_gallery,
         '    Webpage: web/baz\n'
     )
     assert mock_gallery.create.call_args_list == [call()]
-    assert mock_gallery.add.call_args_list == [
-        call(['path/to/foo.jpg', 'path/to/bar.jpg', 'path/to/baz.jpg'])
+    assert mock_gallery.upload.call_args_list == [
+        call('path/to/foo.jpg'), call('path/to/bar.jpg'), call('path/to/baz.jpg'),
     ]
 
+@pytest.mark.asyncio
+async def test_text_prints_each_gallery(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    shard = Mock(url='<Gallery URL 2>', edit_url='<Edit URL 2>', created=False,
+                 upload=AsyncMock(side_effect=lambda fp: Submission(filepath=fp, error='Oops')),
+                 close=AsyncMock())
+
+    async def create():
+        shard.created = True
+
+    shard.create = create
+    mocker.patch('imgbox._gallery.copy', return_value=shard)
+    mock_gallery.upload.side_effect = lambda fp: Submission(filepath=fp, error='Oops')
+    with mock_io() as cap:
+        exit_code = await _output.text(mock_gallery, ['a.jpg', 'b.jpg', 'c.jpg'],
+                                       max_per_gallery=2)
+    assert exit_code == 1
+    assert cap.stdout == (
+        'Gallery: <Gallery URL>\n'
+        '   Edit: <Edit URL>\n'
+        '* a.jpg\n'
+        '  Oops\n'
+        '* b.jpg\n'
+        '  Oops\n'
+        'Gallery: <Gallery URL 2>\n'
+        '   Edit: <Edit URL 2>\n'
+        '* c.jpg\n'
+        '  Oops\n'
+    )
+
 
 @pytest.mark.asyncio
-async def test_json_fails_unless_all_files_ok(mock_io, mock_gallery, mocker):
-    mock_all_files_ok = mocker.patch('imgbox._output._all_files_ok', return_value=False)
+async def test_text_without_gallery_uploads_to_given_galleries(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    mock_gallery.upload.side_effect = lambda fp: Submission(filepath=fp, error='Oops')
+    items = [(mock_gallery, 'a.jpg'), (mock_gallery, 'b.jpg')]
     with mock_io() as cap:
-        exit_code = await _output.json(mock_gallery, ['path/to/foo.jpg'])
+        exit_code = await _output.text(None, items)
     assert exit_code == 1
-    assert cap.stderr == ''
-    assert cap.stdout == ''
-    assert mock_all_files_ok.call_args_list == [call(['path/to/foo.jpg'])]
-    assert mock_gallery.create.call_args_list == []
-    assert mock_gallery.add.call_args_list == []
+    assert mock_gallery.create.call_args_list == [call()]
+    assert cap.stdout == (
+        'Gallery: <Gallery URL>\n'
+        '   Edit: <Edit URL>\n'
+        '* a.jpg\n'
+        '  Oops\n'
+        '* b.jpg\n'
+        '  Oops\n'
+    )
 
 @pytest.mark.asyncio
 async def test_json_encounters_no_exceptions(mock_io, mock_gallery, mocker):
-    mocker.patch('imgbox._output._all_files_ok', return_value=True)
-    mock_gallery.add.return_value = AsyncIterator((
+    mocker.patch('imgbox._upload._check_file')
+    mock_gallery.upload.side_effect = (
         Submission(filepath='path/to/foo.jpg', success=True,
                    image_url='img/foo', thumbnail_url='thumb/foo', web_url='web/foo',
                    gallery_url='gallery/foo', edit_url='edit/foo'),
-    ))
+    )
     with mock_io() as cap:
         exit_code = await _output.json(mock_gallery, ['path/to/foo.jpg'])
     assert exit_code == 0
@@ -205,13 +236,13 @@ async def test_json_encounters_no_exceptions(mock_io, mock_gallery, mocker):
             'edit_url': 'edit/foo',
         },
     ]
-    assert mock_gallery.add.call_args_list == [call(['path/to/foo.jpg'])]
-    assert mock_gallery.create.call_args_list == []
+    assert mock_gallery.upload.call_args_list == [call('path/to/foo.jpg')]
+    assert mock_gallery.create.call_args_list == [call()]
 
 @pytest.mark.asyncio
 async def test_json_handles_error_from_adding_to_gallery(mock_io, mock_gallery, mocker):
-    mocker.patch('imgbox._output._all_files_ok', return_value=True)
-    mock_gallery.add.return_value = AsyncIterator((
+    mocker.patch('imgbox._upload._check_file')
+    mock_gallery.upload.side_effect = (
         Submission(filepath='path/to/foo.jpg', success=True,
                    image_url='img/foo', thumbnail_url='thumb/foo', web_url='web/foo',
                    gallery_url='gallery/foo', edit_url='edit/foo'),
@@ -219,7 +250,7 @@ async def test_json_handles_error_from_adding_to_gallery(mock_io, mock_gallery,
         Submission(filepath='path/to/baz.jpg', success=True,
                    image_url='img/baz', thumbnail_url='thumb/baz', web_url='web/baz',
                    gallery_url='gallery/baz', edit_url='edit/baz'),
-    ))
+    )
     with mock_io() as cap:
         exit_code = await _output.json(mock_gallery, ['path/to/foo.jpg',
                                                       'path/to/bar.jpg',
@@ -261,7 +292,230 @@ async def test_json_handles_error_from_adding_to_gallery(mock_io, mock_gallery,
             'edit_url': 'edit/baz',
         },
     ]
-    assert mock_gallery.add.call_args_list == [
-        call(['path/to/foo.jpg', 'path/to/bar.jpg', 'path/to/baz.jpg']),
+    assert mock_gallery.upload.call_args_list == [
+        call('path/to/foo.jpg'), call('path/to/bar.jpg'), call('path/to/baz.jpg'),
+    ]
+    assert mock_gallery.create.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_json_prints_same_output_as_json_module(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    subs = (
+        Submission(filepath='path/to/foo.jpg', success=True,
+                   image_url='img/foo', thumbnail_url='thumb/foo', web_url='web/foo',
+                   gallery_url='gallery/foo', edit_url='edit/foo'),
+        Submission(filepath='path/to/bar.jpg', success=False, error='Oops'),
+    )
+    mock_gallery.upload.side_effect = subs
+    with mock_io() as cap:
+        await _output.json(mock_gallery, ['path/to/foo.jpg', 'path/to/bar.jpg'])
+    assert cap.stdout == json.dumps(list(subs), indent=4) + '\n'
+
+@pytest.mark.asyncio
+async def test_json_without_files(mock_io, mock_gallery):
+    with mock_io() as cap:
+        exit_code = await _output.json(mock_gallery, [])
+    assert exit_code == 0
+    assert cap.stdout == '[]\n'
+
+@pytest.mark.asyncio
+async def test_json_prints_valid_json_when_cancelled(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    sub = Submission(filepath='path/to/foo.jpg', success=False, error='Oops')
+    uploaded = asyncio.Event()
+
+    async def upload(filepath):
+        if filepath == sub['filepath']:
+            uploaded.set()
+            return sub
+        await asyncio.sleep(60)
+
+    mock_gallery.upload = upload
+    with mock_io() as cap:
+        output = asyncio.ensure_future(
+            _output.json(mock_gallery, ['path/to/foo.jpg', 'path/to/bar.jpg'], order='completion'),
+        )
+        await uploaded.wait()
+        await asyncio.sleep(0.01)
+        output.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await output
+    assert json.loads(cap.stdout) == [sub]
+
+
+@pytest.fixture
+def compact_json_encoder():
+    _output._get_compact_json_encoder.cache_clear()
+    yield _output._get_compact_json_encoder
+    _output._get_compact_json_encoder.cache_clear()
+
+def test_compact_json_encoder_without_orjson(compact_json_encoder, mocker):
+    mocker.patch.dict('sys.modules', {'orjson': None})
+    dumps = compact_json_encoder()
+    assert dumps({'foo': [1, 2], 'bar': 'b\udcffz'}) == '{"foo":[1,2],"bar":"b\\udcffz"}'
+
+def test_compact_json_encoder_with_orjson(compact_json_encoder, mocker):
+    def orjson_dumps(obj):
+        if obj == 'bad':
+            raise TypeError('str is not valid UTF-8: surrogates not allowed')
+        return b'<orjson>'
+
+    mocker.patch.dict('sys.modules', {'orjson': Mock(dumps=orjson_dumps)})
+    dumps = compact_json_encoder()
+    assert dumps({'foo': 'bar'}) == '<orjson>'
+    assert dumps('bad') == '"bad"'
+
+
+@pytest.mark.asyncio
+async def test_ndjson_catches_ConnectionError_from_gallery_creation(mock_io, mock_gallery,
+                                                                    check_file):
+    mock_gallery.create.side_effect = ConnectionError('Creation failed')
+    with mock_io() as cap:
+        exit_code = await _output.ndjson(mock_gallery, ['missing.jpg', 'foo.jpg'])
+    assert exit_code == 1
+    assert [(sub['filepath'], sub['error']) for sub in map(json.loads, cap.stdout.splitlines())] == [
+        ('missing.jpg', 'No such file or directory'),
+        ('foo.jpg', 'Creation failed'),
+    ]
+    assert cap.stderr == ''
+    assert mock_gallery.upload.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_ndjson_does_not_create_gallery_for_invalid_files(mock_io, mock_gallery, check_file):
+    with mock_io() as cap:
+        exit_code = await _output.ndjson(mock_gallery, ['missing.jpg'])
+    assert exit_code == 1
+    assert [sub['error'] for sub in map(json.loads, cap.stdout.splitlines())] == [
+        'No such file or directory',
     ]
     assert mock_gallery.create.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_ndjson_prints_one_line_per_submission(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    mock_gallery.upload.side_effect = (
+        Submission(filepath='path/to/foo.jpg', success=True,
+                   image_url='img/foo', thumbnail_url='thumb/foo', web_url='web/foo',
+                   gallery_url='gallery/foo', edit_url='edit/foo'),
+        Submission(filepath='path/to/bar.jpg', success=False, error='Oops'),
+    )
+    with mock_io() as cap:
+        exit_code = await _output.ndjson(mock_gallery, ['path/to/foo.jpg', 'path/to/bar.jpg'])
+    assert exit_code == 1
+    assert cap.stderr == ''
+    lines = cap.stdout.split('\n')
+    assert lines[-1] == ''
+    assert [json.loads(line) for line in lines[:-1]] == [
+        {'gallery_url': '<Gallery URL>', 'edit_url': '<Edit URL>'},
+        {
+            'filename': 'foo.jpg',
+            'filepath': 'path/to/foo.jpg',
+            'success': True,
+            'error': None,
+            'image_url': 'img/foo',
+            'thumbnail_url': 'thumb/foo',
+            'web_url': 'web/foo',
+            'gallery_url': 'gallery/foo',
+            'edit_url': 'edit/foo',
+        },
+        {
+            'filename': 'bar.jpg',
+            'filepath': 'path/to/bar.jpg',
+            'success': False,
+            'error': 'Oops',
+            'image_url': None,
+            'thumbnail_url': None,
+            'web_url': None,
+            'gallery_url': None,
+            'edit_url': None,
+        },
+    ]
+    assert mock_gallery.create.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_ndjson_without_gallery_prints_each_gallery(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    other = Mock(url='<Gallery URL 2>', edit_url='<Edit URL 2>', created=True,
+                 upload=AsyncMock(side_effect=lambda fp: Submission(filepath=fp, error='Oops')))
+    mock_gallery.upload.side_effect = lambda fp: Submission(filepath=fp, error='Oops')
+    with mock_io() as cap:
+        exit_code = await _output.ndjson(None, [(mock_gallery, 'a.jpg'), (other, 'b.jpg')])
+    assert exit_code == 1
+    lines = [json.loads(line) for line in cap.stdout.splitlines()]
+    assert [line.get('filename', line['gallery_url']) for line in lines] == [
+        '<Gallery URL>', 'a.jpg', '<Gallery URL 2>', 'b.jpg',
+    ]
+
+@pytest.mark.asyncio
+async def test_ndjson_flushes_each_line(mock_io, mock_gallery, mocker):
+    mocker.patch('imgbox._upload._check_file')
+    stdout_lines = []
+
+    async def upload(filepath):
+        stdout_lines.append(cap.stdout.count('\n'))
+        return Submission(filepath=filepath, error='Oops')
+
+    mock_gallery.upload = upload
+    with mock_io() as cap:
+        mocker.patch.object(cap._stdout, 'flush', wraps=cap._stdout.flush)
+        await _output.ndjson(mock_gallery, ['a.jpg', 'b.jpg'])
+    # The gallery line is printed before the first upload starts
+    assert stdout_lines[0] == 1
+    assert cap._stdout.flush.call_count == 3
+
+
+def fake_imgbox(request):
+    # httpx.MockTransport handler that responds like imgbox.com
+    if request.url.path == '/':
+        return httpx.Response(200, text='<meta content="csrf" name="csrf-token" />')
+    elif request.url.path == '/ajax/token/generate':
+        return httpx.Response(200, json={'token_id': 1, 'token_secret': 's',
+                                         'gallery_id': 'g1', 'gallery_secret': 's'})
+    else:
+        return httpx.Response(200, json={'files': [{'original_url': 'img',
+                                                    'thumbnail_url': 'thumb',
+                                                    'url': 'web'}]})
+
+
+@pytest.mark.parametrize('output', ('text', 'json', 'ndjson'))
+@pytest.mark.asyncio
+async def test_file_names_that_are_not_valid_utf8(output, tmp_path, mocker):
+    # Paths are decoded like paths from stdin with --null
+    directory = os.path.join(str(tmp_path), os.fsdecode(b'dir\xff'))
+    os.mkdir(directory)
+    good = os.path.join(directory, 'good.jpg')
+    bad = os.path.join(str(tmp_path), os.fsdecode(b'\xff.jpg'))
+    for filepath in (good, bad):
+        with open(filepath, 'wb') as f:
+            f.write(b'image data')
+
+    uploaded_names = []
+
+    def handler(request):
+        if request.url.path == '/upload/process':
+            uploaded_names.extend(re.findall(rb'filename="([^"]*)"', request.read()))
+        return fake_imgbox(request)
+
+    gallery = _gallery.new()
+    gallery._client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', errors='strict')
+    mocker.patch('sys.stdout', stdout)
+    exit_code = await getattr(_output, output)(gallery, [good, bad])
+    await gallery.close()
+    stdout.seek(0)
+    text = stdout.read()
+    assert exit_code == 0
+    assert uploaded_names == [b'good.jpg', '\ufffd.jpg'.encode('utf-8')]
+    if output == 'text':
+        assert '* good.jpg\n      Image: img\n' in text
+        assert '* \ufffd.jpg\n      Image: img\n' in text
+    else:
+        if output == 'json':
+            subs = json.loads(text)
+        else:
+            subs = [json.loads(line) for line in text.splitlines()][1:]
+        assert [(sub['filepath'], sub['filename'], sub['success']) for sub in subs] == [
+            (_output._printable(good), 'good.jpg', True),
+            (_output._printable(bad), '\ufffd.jpg', True),
+        ]
+        assert '\\udc' not in text
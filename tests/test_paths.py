@@ -0,0 +1,21 @@
+from imgbox import _paths
+
+
+def test_cache_path_with_XDG_CACHE_HOME(monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', '/my/cache')
+    assert _paths.cache_path() == '/my/cache/imgbox/uploads.db'
+
+def test_cache_path_without_XDG_CACHE_HOME(monkeypatch):
+    monkeypatch.delenv('XDG_CACHE_HOME', raising=False)
+    monkeypatch.setenv('HOME', '/home/foo')
+    assert _paths.cache_path() == '/home/foo/.cache/imgbox/uploads.db'
+
+
+def test_gallery_store_path_with_XDG_DATA_HOME(monkeypatch):
+    monkeypatch.setenv('XDG_DATA_HOME', '/my/data')
+    assert _paths.gallery_store_path() == '/my/data/imgbox/galleries.json'
+
+def test_gallery_store_path_without_XDG_DATA_HOME(monkeypatch):
+    monkeypatch.delenv('XDG_DATA_HOME', raising=False)
+    monkeypatch.setenv('HOME', '/home/foo')
+    assert _paths.gallery_store_path() == '/home/foo/.local/share/imgbox/galleries.json'
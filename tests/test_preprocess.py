@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from imgbox import _preprocess
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def make_image(filepath, fmt, size=(64, 64), noise=False, **kwargs):
+    if noise:
+        img = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    else:
+        img = Image.new('RGB', size, (255, 0, 0))
+    img.save(filepath, format=fmt, **kwargs)
+    return str(filepath)
+
+
+@pytest.fixture
+def preprocessor():
+    preprocessors = []
+
+    def make(**kwargs):
+        preprocessors.append(_preprocess.Preprocessor(workers=1, **kwargs))
+        return preprocessors[-1]
+
+    yield make
+    for p in preprocessors:
+        p.close()
+
+
+def test_Preprocessor_without_Pillow(mocker):
+    mocker.patch.dict('sys.modules', {'PIL': None})
+    with pytest.raises(ValueError, match=r'^Preprocessing images requires Pillow: pip install Pillow$'):
+        _preprocess.Preprocessor(fit=True)
+
+def test_Preprocessor_close_removes_processed_files(preprocessor):
+    p = preprocessor()
+    assert os.path.isdir(p._tmpdir)
+    p.close()
+    assert not os.path.exists(p._tmpdir)
+
+
+@pytest.mark.asyncio
+async def test_process_does_nothing_by_default(tmp_path, preprocessor):
+    filepath = make_image(tmp_path / 'foo.jpg', 'JPEG')
+    p = preprocessor()
+    assert await p.process(filepath, os.stat(filepath)) == filepath
+
+@pytest.mark.asyncio
+async def test_process_refuses_too_large_file_without_fit(tmp_path, preprocessor, mocker):
+    filepath = make_image(tmp_path / 'foo.jpg', 'JPEG')
+    mocker.patch('pyimgbox.MAX_FILE_SIZE', 10)
+    p = preprocessor(optimize=True)
+    with pytest.raises(AssertionError, match=r'^File is larger than 10 bytes$'):
+        await p.process(filepath, os.stat(filepath))
+
+@pytest.mark.parametrize('fmt', ('JPEG', 'PNG'))
+@pytest.mark.asyncio
+async def test_process_shrinks_too_large_file(fmt, tmp_path, preprocessor, mocker):
+    filepath = make_image(tmp_path / 'foo.img', fmt, size=(200, 100), noise=True)
+    max_size = os.path.getsize(filepath) // 3
+    mocker.patch('pyimgbox.MAX_FILE_SIZE', max_size)
+    p = preprocessor(fit=True)
+    processed = await p.process(filepath, os.stat(filepath))
+    assert processed != filepath
+    assert os.path.basename(processed) == 'foo.img'
+    assert os.path.getsize(processed) <= max_size
+    with Image.open(processed) as img:
+        assert img.format == fmt
+        assert img.width / img.height == pytest.approx(2, rel=0.05)
+    p.release(processed)
+    assert not os.path.exists(processed)
+    assert os.path.exists(filepath)
+
+@pytest.mark.asyncio
+async def test_process_refuses_to_shrink_unsupported_format(tmp_path, preprocessor, mocker):
+    filepath = make_image(tmp_path / 'foo.gif', 'GIF', noise=True)
+    mocker.patch('pyimgbox.MAX_FILE_SIZE', 10)
+    p = preprocessor(fit=True)
+    with pytest.raises(AssertionError, match=r'^Unsupported image format: GIF$'):
+        await p.process(filepath, os.stat(filepath))
+
+@pytest.mark.asyncio
+async def test_process_refuses_invalid_image(tmp_path, preprocessor):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'not an image')
+    p = preprocessor(optimize=True)
+    with pytest.raises(AssertionError, match=r'^Invalid image: '):
+        await p.process(str(filepath), os.stat(filepath))
+
+@pytest.mark.asyncio
+async def test_process_strips_metadata(tmp_path, preprocessor):
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera Maker ' * 1000
+    exif[0x0112] = 6
+    filepath = make_image(tmp_path / 'foo.jpg', 'JPEG', exif=exif)
+    p = preprocessor(optimize=True)
+    processed = await p.process(filepath, os.stat(filepath))
+    assert processed != filepath
+    with Image.open(processed) as img:
+        assert dict(img.getexif()) == {0x0112: 6}
+
+@pytest.mark.asyncio
+async def test_process_keeps_optimized_file(tmp_path, preprocessor):
+    filepath = make_image(tmp_path / 'foo.png', 'PNG', optimize=True)
+    p = preprocessor(optimize=True)
+    assert await p.process(filepath, os.stat(filepath)) == filepath
+
+def test_release_ignores_original_file(tmp_path, preprocessor):
+    filepath = make_image(tmp_path / 'foo.png', 'PNG')
+    preprocessor().release(filepath)
+    assert os.path.exists(filepath)
@@ -0,0 +1,163 @@
+import asyncio
+import io
+from unittest.mock import Mock
+
+import httpx
+import pytest
+
+from imgbox import _progress
+
+
+class MockStream(io.StringIO):
+    def __init__(self, isatty=False):
+        super().__init__()
+        self._isatty = isatty
+
+    def isatty(self):
+        return self._isatty
+
+
+@pytest.mark.parametrize(
+    argnames='seconds, exp_string',
+    argvalues=((0, '0s'), (59.9, '59s'), (60, '1m00s'), (3599, '59m59s'), (3600, '1h00m'),
+               (7384, '2h03m')),
+)
+def test_format_duration(seconds, exp_string):
+    assert _progress._format_duration(seconds) == exp_string
+
+
+def test_format_before_input_is_finished():
+    progress = _progress.Progress(stream=MockStream())
+    progress.add_file()
+    progress.add_file()
+    progress.add_bytes(2 * 2**20)
+    with progress.uploading(2 * 2**20):
+        pass
+    progress.finish_file()
+    assert progress.format(now=0) == '1/? files, 2.0 MiB, 0 B/s'
+
+def test_format_after_input_is_finished():
+    progress = _progress.Progress(stream=MockStream())
+    for _ in range(3):
+        progress.add_file()
+        progress.add_bytes(2**20)
+    progress.finish_input()
+    assert progress.format(now=0) == '0/3 files, 0 B/3.0 MiB, 0 B/s, ETA ?'
+    progress._sent = 2**20
+    with progress.uploading(2**20):
+        pass
+    progress.finish_file()
+    assert progress.format(now=2) == '1/3 files, 1.0 MiB/3.0 MiB, 512.0 KiB/s, ETA 4s'
+
+def test_format_after_all_bytes_are_uploaded():
+    progress = _progress.Progress(stream=MockStream())
+    progress.add_file()
+    progress.add_bytes(100)
+    progress.finish_input()
+    with progress.uploading(100):
+        pass
+    progress.finish_file()
+    assert progress.format(now=0) == '1/1 files, 100 B/100 B, 0 B/s'
+
+
+@pytest.mark.parametrize(
+    argnames='size, exp_string',
+    argvalues=(
+        (0, '0 B'),
+        (1023, '1023 B'),
+        (1024, '1.0 KiB'),
+        (50 * 1024, '50.0 KiB'),
+        (1.5 * 2**20, '1.5 MiB'),
+        (3 * 2**30, '3.0 GiB'),
+        (2**50, '1024.0 TiB'),
+    ),
+)
+def test_format_size(size, exp_string):
+    assert _progress.format_size(size) == exp_string
+
+
+def test_rate_is_averaged_over_window():
+    progress = _progress.Progress(stream=MockStream())
+    progress._rate(0)
+    progress._sent = 10 * 2**20
+    progress._rate(1)
+    progress._sent = 11 * 2**20
+    assert progress._rate(_progress._RATE_WINDOW + 1) == 2**20 / _progress._RATE_WINDOW
+
+
+@pytest.mark.asyncio
+async def test_uploading_counts_sent_bytes():
+    progress = _progress.Progress(stream=MockStream())
+    bodies = []
+
+    async def handler(request):
+        # MockTransport reads the request body before calling us
+        bodies.append(request.content)
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    gallery = Mock()
+    gallery._client._client = client
+    progress.watch(gallery)
+
+    async def body():
+        yield b'ab'
+        yield b'cde'
+
+    with progress.uploading(size=5):
+        await client.post('http://localhost/', content=body())
+    await client.post('http://localhost/', content=b'not counted')
+    assert bodies == [b'abcde', b'not counted']
+    assert progress.uploaded == 5
+    assert progress._sent == 5
+    await client.aclose()
+
+@pytest.mark.asyncio
+async def test_repeated_request_is_counted_from_zero():
+    progress = _progress.Progress(stream=MockStream())
+    upload = _progress._Upload(size=3)
+    progress._uploads.add(upload)
+
+    async def body():
+        yield b'abc'
+
+    stream = _progress._CountingStream(httpx.AsyncByteStream(), progress, upload)
+    stream._stream = body()
+    assert [chunk async for chunk in stream] == [b'abc']
+    stream._stream = body()
+    assert [chunk async for chunk in stream] == [b'abc']
+    assert progress.uploaded == 3
+    assert progress._sent == 6
+
+
+@pytest.mark.asyncio
+async def test_display_on_terminal(mocker):
+    mocker.patch('imgbox._progress._TTY_INTERVAL', 0.01)
+    stream = MockStream(isatty=True)
+    progress = _progress.Progress(stream=stream)
+    progress.add_file()
+    task = asyncio.ensure_future(progress.display())
+    await asyncio.sleep(0.05)
+    progress.clear()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    output = stream.getvalue()
+    assert output.startswith('\r\x1b[K0/? files, 0 B, 0 B/s\r\x1b[K')
+    assert output.endswith('\r\x1b[K\r\x1b[K0/? files, 0 B, 0 B/s\n')
+
+@pytest.mark.asyncio
+async def test_display_on_non_terminal(mocker):
+    mocker.patch('imgbox._progress._LOG_INTERVAL', 0.01)
+    stream = MockStream(isatty=False)
+    progress = _progress.Progress(stream=stream)
+    task = asyncio.ensure_future(progress.display())
+    await asyncio.sleep(0.05)
+    progress.clear()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    lines = stream.getvalue().split('\n')
+    assert len(lines) >= 3
+    assert lines[-1] == ''
+    assert all(line == 'imgbox: 0/? files, 0 B, 0 B/s' for line in lines[:-1])
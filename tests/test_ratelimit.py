@@ -0,0 +1,91 @@
+import asyncio
+from unittest.mock import Mock, call
+
+import httpx
+import pytest
+
+from imgbox import _ratelimit
+
+
+# Python 3.6 doesn't have AsyncMock
+class AsyncMock(Mock):
+    def __call__(self, *args, **kwargs):
+        async def coro(_sup=super()):
+            return _sup.__call__(*args, **kwargs)
+        return coro()
+
+
+@pytest.fixture
+def sleep(mocker):
+    return mocker.patch('asyncio.sleep', AsyncMock())
+
+
+def delays(sleep):
+    return [c[0][0] for c in sleep.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_consume_spreads_bytes_evenly(sleep):
+    rate_limit = _ratelimit.RateLimit(2**20)
+    await asyncio.gather(*(rate_limit.consume(2**18) for _ in range(3)))
+    assert delays(sleep) == pytest.approx([0.25, 0.5, 0.75], abs=0.01)
+    assert rate_limit.sent == 3 * 2**18
+
+@pytest.mark.asyncio
+async def test_consume_saves_unused_bandwidth_up_to_burst(sleep):
+    rate_limit = _ratelimit.RateLimit(2**20)
+    rate_limit._empty_at = asyncio.get_running_loop().time() - 10
+    await rate_limit.consume(2**20 * _ratelimit._BURST_SECONDS)
+    assert sleep.call_args_list == []
+    await rate_limit.consume(2**19)
+    assert delays(sleep) == pytest.approx([0.5], abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_watch_limits_request_bodies(mocker):
+    rate_limit = _ratelimit.RateLimit(2**30)
+    consume = mocker.patch.object(rate_limit, 'consume', AsyncMock())
+    bodies = []
+
+    async def handler(request):
+        # MockTransport reads the request body before calling us
+        bodies.append(request.content)
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    gallery = Mock()
+    gallery._client._client = client
+    rate_limit.watch(gallery)
+
+    async def body():
+        yield b'a' * 40000
+        yield b'b' * 10
+
+    await client.post('http://localhost/', content=body())
+    await client.get('http://localhost/')
+    assert bodies == [b'a' * 40000 + b'b' * 10, b'']
+    assert consume.call_args_list == [call(16384), call(16384), call(7232), call(10)]
+    await client.aclose()
+
+def test_unwatch_removes_hook():
+    rate_limit = _ratelimit.RateLimit(2**30)
+    gallery = Mock()
+    gallery._client._client.event_hooks = {'request': [], 'response': []}
+    rate_limit.watch(gallery)
+    rate_limit.unwatch(gallery)
+    assert gallery._client._client.event_hooks == {'request': [], 'response': []}
+
+
+def test_effective_rate():
+    rate_limit = _ratelimit.RateLimit(5 * 2**20)
+    assert rate_limit.effective_rate == 0
+    rate_limit._first_sent, rate_limit._last_sent = 10, 12
+    rate_limit._sent = 9 * 2**20
+    assert rate_limit.effective_rate == 4.5 * 2**20
+    assert rate_limit.summary() == 'Sent 9.0 MiB at 4.5 MiB/s (limit: 5.0 MiB/s)'
+
+def test_summary_with_low_rate():
+    rate_limit = _ratelimit.RateLimit(50 * 1024)
+    rate_limit._first_sent, rate_limit._last_sent = 10, 14
+    rate_limit._sent = 200 * 1024
+    assert rate_limit.summary() == 'Sent 200.0 KiB at 50.0 KiB/s (limit: 50.0 KiB/s)'
@@ -0,0 +1,252 @@
+import asyncio
+import time
+from unittest.mock import Mock, call
+
+import httpx
+import pytest
+from pyimgbox import Submission
+
+from imgbox import _retry
+
+
+class MockGallery:
+    """
+    Gallery that fails with the next item from `results`
+
+    Each result is a status code, "network" for a failed connection or "local"
+    for an error without request.
+    """
+
+    def __init__(self, results, retry_after=None, delay=0):
+        self.results = list(results)
+        self.retry_after = retry_after
+        self.delay = delay
+        self.hooks = {'request': [], 'response': []}
+        self._client = Mock(_client=Mock(event_hooks=self.hooks))
+        self.calls = []
+
+    async def _request(self):
+        self.calls.append(self.results[0])
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        result = self.results.pop(0)
+        if result == 'local':
+            return 'Local error'
+        for hook in self.hooks['request']:
+            await hook(Mock())
+        if result == 'network':
+            return 'Connection failed'
+        headers = {'Retry-After': self.retry_after} if self.retry_after else {}
+        for hook in self.hooks['response']:
+            await hook(Mock(status_code=result, headers=headers))
+        if result >= 400:
+            return f'Status {result}'
+
+    async def create(self):
+        error = await self._request()
+        if error:
+            raise ConnectionError(error)
+
+    async def upload(self, filepath):
+        error = await self._request()
+        if error:
+            return Submission(filepath=filepath, error=error)
+        return Submission(filepath=filepath, image_url='img', thumbnail_url='thumb',
+                          web_url='web', gallery_url='gallery', edit_url='edit')
+
+
+@pytest.fixture
+def sleep(mocker):
+    # Don't actually wait, but advance the clock that is used for pauses
+    now = [1000.0]
+    real_sleep = asyncio.sleep
+
+    def sleep_(seconds):
+        now[0] += seconds
+        return real_sleep(0)
+
+    mocker.patch('imgbox._retry.time', Mock(monotonic=lambda: now[0], time=time.time))
+    return mocker.patch('asyncio.sleep', Mock(side_effect=sleep_))
+
+
+@pytest.mark.parametrize(
+    argnames='value, exp_seconds',
+    argvalues=(
+        (None, None),
+        ('12', 12),
+        ('-1', 0),
+        ('foo', None),
+        ('Wed, 21 Oct 2015 07:28:00 GMT', 0),
+    ),
+)
+def test_parse_retry_after(value, exp_seconds):
+    assert _retry._parse_retry_after(value) == exp_seconds
+
+def test_parse_retry_after_with_future_date():
+    value = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 100))
+    assert _retry._parse_retry_after(value) == pytest.approx(100, abs=2)
+
+
+@pytest.mark.asyncio
+async def test_upload_returns_first_success(sleep):
+    gallery = MockGallery([200])
+    sub = await _retry.Retry().upload(gallery, 'a.jpg')
+    assert sub.success
+    assert len(gallery.calls) == 1
+    assert sleep.call_args_list == []
+
+@pytest.mark.parametrize('result', ('network', 500, 502, 429, 503))
+@pytest.mark.asyncio
+async def test_upload_repeats_temporary_errors(result, sleep):
+    gallery = MockGallery([result, result, 200])
+    sub = await _retry.Retry(attempts=3).upload(gallery, 'a.jpg')
+    assert sub.success
+    assert len(gallery.calls) == 3
+
+@pytest.mark.parametrize('result', ('local', 400, 404, 413))
+@pytest.mark.asyncio
+async def test_upload_does_not_repeat_permanent_errors(result, sleep):
+    gallery = MockGallery([result, 200])
+    sub = await _retry.Retry(attempts=3).upload(gallery, 'a.jpg')
+    assert not sub.success
+    assert len(gallery.calls) == 1
+
+@pytest.mark.asyncio
+async def test_upload_returns_last_failure(sleep):
+    gallery = MockGallery([500, 502, 'network'])
+    sub = await _retry.Retry(attempts=3).upload(gallery, 'a.jpg')
+    assert sub == Submission(filepath='a.jpg', error='Connection failed')
+    assert len(gallery.calls) == 3
+
+@pytest.mark.asyncio
+async def test_upload_backs_off_exponentially(sleep, mocker):
+    mocker.patch('random.uniform', side_effect=lambda a, b: b)
+    gallery = MockGallery([500, 500, 500, 500, 500])
+    await _retry.Retry(attempts=5, delay=1, max_delay=5, breaker_threshold=100).upload(gallery, 'a.jpg')
+    assert sleep.call_args_list == [call(1), call(2), call(4), call(5)]
+
+@pytest.mark.asyncio
+async def test_upload_randomizes_delay(sleep, mocker):
+    uniform = mocker.patch('random.uniform', return_value=0.123)
+    gallery = MockGallery([500, 200])
+    await _retry.Retry(delay=2).upload(gallery, 'a.jpg')
+    assert uniform.call_args_list == [call(0, 2)]
+    assert sleep.call_args_list == [call(0.123)]
+
+@pytest.mark.asyncio
+async def test_upload_times_out():
+    gallery = MockGallery([200, 200], delay=10)
+    sub = await _retry.Retry(attempts=2, timeout=0.01, delay=0).upload(gallery, 'a.jpg')
+    assert sub == Submission(filepath='a.jpg', error='Timeout after 0.01 seconds')
+    assert len(gallery.calls) == 2
+
+@pytest.mark.asyncio
+async def test_upload_repeats_stalled_attempts():
+    gallery = MockGallery([200, 200], delay=10)
+    retry = _retry.Retry(attempts=2, stall_timeout=0.01, delay=0)
+    sub = await retry.upload(gallery, 'a.jpg')
+    assert sub == Submission(filepath='a.jpg', error='Stalled for 0.01 seconds')
+    assert len(gallery.calls) == 2
+    assert retry.stalled == 1
+
+@pytest.mark.asyncio
+async def test_upload_does_not_stall_while_sending():
+    retry = _retry.Retry(attempts=1, stall_timeout=0.05)
+
+    class SlowGallery(MockGallery):
+        async def upload(self, filepath):
+            async def body():
+                for _ in range(5):
+                    await asyncio.sleep(0.02)
+                    yield b'x'
+
+            request = httpx.Request('POST', 'http://localhost/', content=body())
+            for hook in self.hooks['request']:
+                await hook(request)
+            async for _ in request.stream:
+                pass
+            return await super().upload(filepath)
+
+    sub = await retry.upload(SlowGallery([200]), 'a.jpg')
+    assert sub.success
+    assert retry.stalled == 0
+
+@pytest.mark.asyncio
+async def test_upload_honours_retry_after(sleep, mocker):
+    mocker.patch('random.uniform', return_value=0)
+    retry = _retry.Retry()
+    gallery = MockGallery([429, 200], retry_after='7')
+    await retry.upload(gallery, 'a.jpg')
+    assert sleep.call_args_list == [call(0), call(7)]
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_pauses_all_uploads(sleep, mocker):
+    mocker.patch('random.uniform', return_value=0)
+    retry = _retry.Retry(attempts=10, breaker_threshold=3, breaker_pause=30)
+    gallery = MockGallery([500, 500, 500, 200])
+    await retry.upload(gallery, 'a.jpg')
+    assert sleep.call_args_list == [call(0), call(0), call(0), call(30)]
+
+    # Another upload also waits while the breaker is open
+    retry._pause(20)
+    sleep.reset_mock()
+    await retry.upload(MockGallery([200]), 'b.jpg')
+    assert sleep.call_args_list == [call(20)]
+
+@pytest.mark.asyncio
+async def test_success_resets_circuit_breaker(sleep, mocker):
+    mocker.patch('random.uniform', return_value=0)
+    retry = _retry.Retry(attempts=10, breaker_threshold=3, breaker_pause=30)
+    await retry.upload(MockGallery([500, 500, 200]), 'a.jpg')
+    await retry.upload(MockGallery([500, 500, 200]), 'b.jpg')
+    assert sleep.call_args_list == [call(0), call(0), call(0), call(0)]
+
+
+@pytest.mark.asyncio
+async def test_create_repeats_temporary_errors(sleep):
+    gallery = MockGallery(['network', 503, 200])
+    await _retry.Retry(attempts=3).create(gallery)
+    assert len(gallery.calls) == 3
+
+@pytest.mark.asyncio
+async def test_create_raises_last_error(sleep):
+    gallery = MockGallery(['network', 503, 'network'])
+    with pytest.raises(ConnectionError, match=r'^Connection failed$'):
+        await _retry.Retry(attempts=3).create(gallery)
+    assert len(gallery.calls) == 3
+
+@pytest.mark.asyncio
+async def test_create_does_not_repeat_permanent_errors(sleep):
+    gallery = MockGallery([403, 200])
+    with pytest.raises(ConnectionError, match=r'^Status 403$'):
+        await _retry.Retry(attempts=3).create(gallery)
+    assert len(gallery.calls) == 1
+
+@pytest.mark.asyncio
+async def test_create_times_out():
+    gallery = MockGallery([200], delay=10)
+    with pytest.raises(ConnectionError, match=r'^Timeout after 0.01 seconds$'):
+        await _retry.Retry(attempts=1, timeout=0.01).create(gallery)
+
+@pytest.mark.asyncio
+async def test_create_stalls():
+    gallery = MockGallery([200], delay=10)
+    with pytest.raises(ConnectionError, match=r'^Stalled for 0.01 seconds$'):
+        await _retry.Retry(attempts=1, stall_timeout=0.01).create(gallery)
+
+@pytest.mark.asyncio
+async def test_hooks_are_added_once(sleep):
+    gallery = MockGallery([200, 200])
+    retry = _retry.Retry()
+    await retry.upload(gallery, 'a.jpg')
+    await retry.upload(gallery, 'b.jpg')
+    assert len(gallery.hooks['request']) == 1
+    assert len(gallery.hooks['response']) == 1
+
+@pytest.mark.asyncio
+async def test_unwatch_removes_hooks(sleep):
+    gallery = MockGallery([200])
+    retry = _retry.Retry()
+    await retry.upload(gallery, 'a.jpg')
+    retry.unwatch(gallery)
+    assert gallery.hooks == {'request': [], 'response': []}
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from pyimgbox import Submission
+
+from imgbox import _schedule
+
+
+def prepared(result):
+    future = asyncio.get_running_loop().create_future()
+    if result is not None:
+        future.set_result(result)
+    return future
+
+
+def test_scheduler_with_invalid_policy():
+    with pytest.raises(ValueError, match=r"^Invalid schedule: 'foo'$"):
+        _schedule.Scheduler('foo')
+
+
+@pytest.mark.asyncio
+async def test_scheduler_hands_out_items_in_input_order():
+    scheduler = _schedule.Scheduler('input')
+    futures = [prepared(None) for _ in range(3)]
+    for i, future in enumerate(futures):
+        await scheduler.put(i, future)
+    futures[2].set_result(('c.jpg', 1))
+    await scheduler.finish(2)
+    assert [await scheduler.get() for _ in range(5)] == [0, 1, 2, None, None]
+
+@pytest.mark.parametrize(
+    argnames='policy, exp_items',
+    argvalues=(
+        ('smallest-first', ['failed', 'journal', 'small', 'medium', 'large', None]),
+        ('largest-first', ['failed', 'journal', 'large', 'medium', 'small', None]),
+    ),
+)
+@pytest.mark.asyncio
+async def test_scheduler_hands_out_items_by_size(policy, exp_items):
+    scheduler = _schedule.Scheduler(policy)
+    await scheduler.put('medium', prepared(('medium.jpg', 200)))
+    await scheduler.put('large', prepared(('large.jpg', 300)))
+    await scheduler.put('failed', prepared(Submission(filepath='failed.jpg', error='Oops')))
+    await scheduler.put('small', prepared(('small.jpg', 100)))
+    await scheduler.put('journal', None)
+    await scheduler.finish(1)
+    assert [await scheduler.get() for _ in range(6)] == exp_items
+
+@pytest.mark.asyncio
+async def test_scheduler_waits_for_preparation():
+    scheduler = _schedule.Scheduler('smallest-first')
+    large, small = prepared(None), prepared(None)
+    await scheduler.put('large', large)
+    await scheduler.put('small', small)
+    get = asyncio.ensure_future(scheduler.get())
+    finish = asyncio.ensure_future(scheduler.finish(1))
+    await asyncio.sleep(0)
+    assert not get.done()
+    assert not finish.done()
+    large.set_result(('large.jpg', 300))
+    assert await get == 'large'
+    assert not finish.done()
+    small.set_result(('small.jpg', 100))
+    await finish
+    assert [await scheduler.get() for _ in range(2)] == ['small', None]
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_items_ahead():
+    scheduler = _schedule.Scheduler('input', ahead=2)
+    await scheduler.put(0, None)
+    await scheduler.put(1, None)
+    put = asyncio.ensure_future(scheduler.put(2, None))
+    await asyncio.sleep(0)
+    assert not put.done()
+    assert await scheduler.get() == 0
+    await put
+
+@pytest.mark.parametrize('policy', ('input', 'smallest-first'))
+@pytest.mark.asyncio
+async def test_scheduler_cancels_futures_that_are_not_taken(policy):
+    scheduler = _schedule.Scheduler(policy)
+    taken, preparing = prepared(('a.jpg', 1)), prepared(None)
+    await scheduler.put('taken', taken)
+    await scheduler.put('preparing', preparing)
+    assert await scheduler.get() == 'taken'
+    scheduler.cancel()
+    assert not taken.cancelled()
+    assert preparing.cancelled()
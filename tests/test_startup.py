@@ -0,0 +1,57 @@
+import subprocess
+import sys
+
+import pytest
+
+# Maximum number of milliseconds it may take to import everything that is
+# needed to handle --version, --help and invalid arguments
+STARTUP_BUDGET_MS = 50
+
+# Import times vary with the load of the machine, so only the fastest of this
+# many runs is compared to the budget
+STARTUP_RUNS = 5
+
+# Modules that must not be imported before an upload actually runs
+HEAVY_MODULES = ('asyncio', 'pyimgbox', 'httpx', 'bs4', 'traceback', 'sqlite3', 'hashlib', 'json')
+
+
+def import_times(args):
+    # Run imgbox with `args` and return list of (module, cumulative
+    # microseconds) of all modules that are imported by imgbox, including the
+    # modules that are imported by them
+    code = ('from imgbox._main import main\n'
+            'try:\n'
+            f'    main({args!r})\n'
+            'except SystemExit:\n'
+            '    pass\n')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times.append((name.rstrip(), int(cumulative)))
+
+    # Ignore modules that are imported during interpreter startup and nested
+    # imports, which are included in the cumulative time of their parent
+    toplevel = [(name, us) for name, us in times if not name.startswith('  ')]
+    first = next(i for i, (name, _) in enumerate(toplevel) if name.strip().startswith('imgbox'))
+    return {
+        'all': [name.strip() for name, _ in times],
+        'toplevel': dict((name.strip(), us) for name, us in toplevel[first:]),
+    }
+
+
+@pytest.mark.parametrize('args', (['--version'], ['--help'], ['--jobs', 'foo']))
+def test_fast_path_does_not_import_heavy_modules(args):
+    modules = import_times(args)['all']
+    assert 'imgbox._main' in modules
+    assert [name for name in modules if name in HEAVY_MODULES or name.split('.')[0] in HEAVY_MODULES] == []
+
+@pytest.mark.parametrize('args', (['--version'], ['--help'], ['--jobs', 'foo']))
+def test_fast_path_import_time(args):
+    runs = [import_times(args)['toplevel'] for _ in range(STARTUP_RUNS)]
+    times = min(runs, key=lambda times: sum(times.values()))
+    total_ms = sum(times.values()) / 1000
+    assert total_ms < STARTUP_BUDGET_MS, times
@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+from imgbox import _tokens
+
+TOKEN = {'token_id': 123, 'token_secret': 'abc', 'gallery_id': 'g1', 'gallery_secret': 'def'}
+
+
+@pytest.mark.parametrize(
+    argnames='url, exp_ids',
+    argvalues=(
+        ('https://imgbox.com/upload/edit/123/abc', ('123', 'abc')),
+        ('http://www.imgbox.com/upload/edit/123/abc/', ('123', 'abc')),
+        ('https://imgbox.com/g/g1', None),
+        ('https://example.org/upload/edit/123/abc', None),
+        ('daily', None),
+    ),
+)
+def test_parse_edit_url(url, exp_ids):
+    assert _tokens.parse_edit_url(url) == exp_ids
+
+
+def test_TokenStore_without_file(tmp_path):
+    tokens = _tokens.TokenStore(str(tmp_path / 'galleries.json'))
+    assert tokens.get('daily') is None
+    assert tokens.find('https://imgbox.com/upload/edit/123/abc') is None
+
+def test_TokenStore_with_unreadable_file(tmp_path):
+    path = tmp_path / 'galleries.json'
+    path.mkdir()
+    with pytest.raises(OSError, match=rf'^{path}: '):
+        _tokens.TokenStore(str(path))
+
+@pytest.mark.parametrize('content', ('{"daily": ', '[]', '{"daily": 123}'))
+def test_TokenStore_with_invalid_file(content, tmp_path):
+    path = tmp_path / 'galleries.json'
+    path.write_text(content)
+    with pytest.raises(OSError, match=rf'^{path}: Invalid gallery store'):
+        _tokens.TokenStore(str(path))
+
+
+def test_save_creates_private_file(tmp_path):
+    path = tmp_path / 'foo' / 'galleries.json'
+    tokens = _tokens.TokenStore(str(path))
+    tokens.save('daily', TOKEN)
+    assert json.loads(path.read_text()) == {'daily': TOKEN}
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert tokens.get('daily') == TOKEN
+
+def test_save_keeps_galleries_from_other_processes(tmp_path):
+    path = str(tmp_path / 'galleries.json')
+    tokens = _tokens.TokenStore(path)
+    _tokens.TokenStore(path).save('weekly', {'token_id': 456})
+    tokens.save('daily', TOKEN)
+    assert _tokens.TokenStore(path).get('weekly') == {'token_id': 456}
+    assert _tokens.TokenStore(path).get('daily') == TOKEN
+
+def test_save_raises_OSError(tmp_path):
+    path = tmp_path / 'galleries.json'
+    tokens = _tokens.TokenStore(str(path))
+    (tmp_path / 'galleries.json.tmp').mkdir()
+    with pytest.raises(OSError, match=rf'^{path}: '):
+        tokens.save('daily', TOKEN)
+
+
+def test_find_returns_gallery_with_edit_url(tmp_path):
+    tokens = _tokens.TokenStore(str(tmp_path / 'galleries.json'))
+    tokens.save('weekly', {'token_id': 456, 'token_secret': 'xyz'})
+    tokens.save('daily', TOKEN)
+    assert tokens.find('https://imgbox.com/upload/edit/123/abc') == ('daily', TOKEN)
+    assert tokens.find('https://imgbox.com/upload/edit/123/xyz') is None
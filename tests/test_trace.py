@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+
+from imgbox import _trace
+
+
+def test_span_without_tracer():
+    with _trace.span(None, 'foo', 'bar'):
+        pass
+
+def test_span_with_tracer():
+    tracer = _trace.Tracer()
+    with _trace.span(tracer, 'foo', 'bar', id=1, x='y'):
+        pass
+    events = tracer.events
+    assert [(e['ph'], e['name'], e['cat'], e['id'], e['args']) for e in events] == [
+        ('b', 'foo', 'bar', '1', {'x': 'y'}),
+        ('e', 'foo', 'bar', '1', {'x': 'y'}),
+    ]
+    assert events[0]['ts'] <= events[1]['ts']
+
+def test_span_without_id():
+    tracer = _trace.Tracer()
+    with tracer.span('foo', 'bar'):
+        pass
+    [event] = tracer.events
+    assert event['ph'] == 'X'
+    assert event['tid'] == 'main'
+    assert event['dur'] >= 0
+
+def test_span_records_exception():
+    tracer = _trace.Tracer()
+    with pytest.raises(ValueError):
+        with tracer.span('foo', 'bar', id=1):
+            raise ValueError()
+    assert len(tracer.events) == 2
+
+
+@pytest.mark.asyncio
+async def test_sample_lag():
+    tracer = _trace.Tracer(lag_interval=0.01)
+    task = asyncio.ensure_future(tracer.sample_lag())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    lags = [e for e in tracer.events if e['name'] == 'event loop lag']
+    assert len(lags) >= 2
+    assert all(e['ph'] == 'C' and e['args']['ms'] >= 0 for e in lags)
+
+
+def test_write(tmp_path):
+    tracer = _trace.Tracer()
+    with tracer.span('foo', 'bar', id=1):
+        pass
+    path = tmp_path / 'trace.json'
+    tracer.write(str(path))
+    data = json.loads(path.read_text())
+    assert data['traceEvents'] == list(tracer.events)
+
+def test_write_fails(tmp_path):
+    tracer = _trace.Tracer()
+    path = tmp_path / 'nonexisting' / 'trace.json'
+    with pytest.raises(OSError, match=rf'^{path}: No such file or directory$'):
+        tracer.write(str(path))
+
+
+def test_summary():
+    tracer = _trace.Tracer()
+    for i in range(10):
+        with tracer.span('upload', 'file', id=i):
+            pass
+    tracer._lags.extend((0.001, 0.002))
+    lines = tracer.summary().split('\n')
+    assert lines[0].split() == ['Phase', 'Count', 'Total', 's', 'p50', 'ms',
+                                'p95', 'ms', 'p99', 'ms', 'Max', 'ms']
+    assert lines[1].startswith('file upload ')
+    assert lines[1].split()[2] == '10'
+    assert lines[2].startswith('event loop lag ')
+    assert lines[2].split()[3] == '2'
+    assert lines[3].startswith('Total time: ')
+
+def test_summary_aligns_columns_to_longest_phase():
+    tracer = _trace.Tracer()
+    with tracer.span('wait for preparation', 'file', id=0):
+        pass
+    with tracer.span('upload', 'file', id=0):
+        pass
+    tracer._lags.append(0.001)
+    lines = tracer.summary().split('\n')[:-1]
+    assert [line[:26] for line in lines] == [
+        'Phase                     ',
+        'file wait for preparation ',
+        'file upload               ',
+        'event loop lag            ',
+    ]
+    assert len({len(line) for line in lines}) == 1
+
+
+@pytest.mark.parametrize(
+    argnames='percent, exp_value',
+    argvalues=((50, 5), (95, 10), (99, 10), (10, 1), (0, 1)),
+)
+def test_percentile(percent, exp_value):
+    assert _trace._percentile(list(range(1, 11)), percent) == exp_value
@@ -0,0 +1,580 @@
+import asyncio
+import gc
+import os
+import weakref
+from unittest.mock import MagicMock, Mock, call
+
+import pytest
+from pyimgbox import MAX_FILE_SIZE, Submission
+
+from imgbox import _trace, _upload
+
+
+# Python 3.6 doesn't have AsyncMock
+class AsyncMock(Mock):
+    def __call__(self, *args, **kwargs):
+        async def coro(_sup=super()):
+            return _sup.__call__(*args, **kwargs)
+        return coro()
+
+
+class MockGallery:
+    """Gallery that takes `delays[filepath]` seconds to upload `filepath`"""
+
+    def __init__(self, delays={}, created=True):
+        self.delays = delays
+        self.created = created
+        self.create = AsyncMock()
+        self.close = AsyncMock()
+        self.uploading = 0
+        self.max_uploading = 0
+        self.uploaded = []
+
+    async def upload(self, filepath):
+        self.uploading += 1
+        self.max_uploading = max(self.max_uploading, self.uploading)
+        try:
+            await asyncio.sleep(self.delays.get(filepath, 0))
+        finally:
+            self.uploading -= 1
+        if filepath.startswith('bad'):
+            return Submission(filepath=filepath, error='Oops')
+        elif filepath.startswith('crash'):
+            raise RuntimeError('Unexpected response')
+        self.uploaded.append(filepath)
+        return Submission(filepath=filepath, image_url=f'img/{filepath}',
+                          thumbnail_url=f'thumb/{filepath}', web_url=f'web/{filepath}',
+                          gallery_url='gallery', edit_url='edit')
+
+
+@pytest.fixture
+def check_file(mocker):
+    return mocker.patch('imgbox._upload._check_file')
+
+
+async def collect(aiter):
+    return [sub async for gallery, sub in aiter]
+
+
+def test_check_file_with_nonexisting_file():
+    with pytest.raises(AssertionError, match=r'^No such file$'):
+        _upload._check_file('path/to/nonexisting/file.jpg')
+
+def test_check_file_with_directory(tmp_path):
+    with pytest.raises(AssertionError, match=r'^Not a file$'):
+        _upload._check_file(tmp_path)
+
+@pytest.mark.skipif(os.geteuid() == 0, reason='root can read any file')
+def test_check_file_with_unreadable_file(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'data')
+    os.chmod(filepath, 0x000)
+    try:
+        with pytest.raises(AssertionError, match=r'^Not readable$'):
+            _upload._check_file(filepath)
+    finally:
+        os.chmod(filepath, 0x600)
+
+def test_check_file_returns_stat_result(tmp_path, mocker):
+    filepath = tmp_path / 'foo.jpg'
+    filepath.write_bytes(b'data')
+    mocker.patch('os.stat', wraps=os.stat)
+    st = _upload._check_file(filepath)
+    assert st.st_size == 4
+    assert os.stat.call_args_list == [call(filepath)]
+
+@pytest.mark.parametrize(
+    argnames='mode, uid, gid, euid, egid, groups, exp_readable',
+    argvalues=(
+        (0o000, 1000, 1000, 0, 0, [], True),
+        (0o400, 1000, 1000, 1000, 1000, [], True),
+        (0o040, 1000, 1000, 1000, 1000, [], False),
+        (0o040, 1000, 2000, 1001, 1000, [2000], True),
+        (0o040, 1000, 2000, 1001, 2000, [], True),
+        (0o404, 1000, 2000, 1001, 1000, [], True),
+        (0o440, 1000, 2000, 1001, 1000, [], False),
+    ),
+)
+def test_is_readable(mode, uid, gid, euid, egid, groups, exp_readable, mocker):
+    mocker.patch('os.geteuid', return_value=euid)
+    mocker.patch('os.getegid', return_value=egid)
+    mocker.patch('os.getgroups', return_value=groups)
+    st = Mock(st_mode=mode, st_uid=uid, st_gid=gid)
+    assert _upload._is_readable(st) is exp_readable
+
+def test_check_file_with_too_large_file(tmp_path):
+    filepath = tmp_path / 'foo.jpg'
+    # Create sparse file
+    f = open(filepath, 'wb')
+    f.truncate(MAX_FILE_SIZE + 1)
+    f.close()
+    with pytest.raises(AssertionError, match=rf'^File is larger than {MAX_FILE_SIZE} bytes$'):
+        _upload._check_file(filepath)
+
+
+@pytest.mark.asyncio
+async def test_create_gallery_shares_simultaneous_requests():
+    gallery = MockGallery(created=False)
+    await asyncio.gather(_upload.create_gallery(gallery), _upload.create_gallery(gallery))
+    assert gallery.create.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_create_gallery_shares_simultaneous_failed_request():
+    gallery = MockGallery(created=False)
+    gallery.create.side_effect = ConnectionError('Creation failed')
+    results = await asyncio.gather(_upload.create_gallery(gallery), _upload.create_gallery(gallery),
+                                   return_exceptions=True)
+    assert [str(r) for r in results] == ['Creation failed', 'Creation failed']
+    assert gallery.create.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_create_gallery_repeats_failed_request():
+    gallery = MockGallery(created=False)
+    gallery.create.side_effect = (ConnectionError('Creation failed'), None)
+    with pytest.raises(ConnectionError, match=r'^Creation failed$'):
+        await _upload.create_gallery(gallery)
+    await _upload.create_gallery(gallery)
+    assert gallery.create.call_args_list == [call(), call()]
+    assert gallery not in _upload._creations
+
+
+@pytest.mark.asyncio
+async def test_upload_with_invalid_order(check_file):
+    with pytest.raises(ValueError, match=r"^Invalid order: 'foo'$"):
+        await collect(_upload.upload(MockGallery(), ['a.jpg'], order='foo'))
+
+@pytest.mark.asyncio
+async def test_upload_creates_gallery_if_necessary(check_file):
+    gallery = MockGallery(created=False)
+    subs = await collect(_upload.upload(gallery, ['a.jpg']))
+    assert gallery.create.call_args_list == [call()]
+    assert [sub.filepath for sub in subs] == ['a.jpg']
+
+@pytest.mark.asyncio
+async def test_upload_does_not_create_existing_gallery(check_file):
+    gallery = MockGallery(created=True)
+    await collect(_upload.upload(gallery, ['a.jpg']))
+    assert gallery.create.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_upload_handles_ConnectionError_from_gallery_creation(check_file):
+    gallery = MockGallery(created=False)
+    gallery.create.side_effect = ConnectionError('Creation failed')
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg']))
+    assert subs == [
+        Submission(filepath='a.jpg', error='Creation failed'),
+        Submission(filepath='b.jpg', error='Creation failed'),
+    ]
+    assert gallery.uploaded == []
+
+@pytest.mark.asyncio
+async def test_upload_does_not_create_gallery_for_invalid_files(check_file):
+    check_file.side_effect = AssertionError('No such file')
+    gallery = MockGallery(created=False)
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg']))
+    assert subs == [
+        Submission(filepath='a.jpg', error='No such file'),
+        Submission(filepath='b.jpg', error='No such file'),
+    ]
+    assert gallery.create.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_upload_calls_on_gallery_when_gallery_is_created(check_file):
+    gallery = MockGallery(created=False)
+    created = []
+    uploads = _upload.upload(gallery, ['a.jpg', 'b.jpg'],
+                             on_gallery=lambda g: created.append((g, gallery.uploaded[:])))
+    await collect(uploads)
+    assert created == [(gallery, [])]
+
+@pytest.mark.parametrize('jobs', (1, 2, 3, 10))
+@pytest.mark.asyncio
+async def test_upload_limits_simultaneous_uploads(jobs, check_file):
+    filepaths = [f'{i}.jpg' for i in range(10)]
+    gallery = MockGallery(delays={fp: 0.01 for fp in filepaths})
+    subs = await collect(_upload.upload(gallery, filepaths, jobs=jobs))
+    assert [sub.filepath for sub in subs] == filepaths
+    assert gallery.max_uploading == jobs
+
+@pytest.mark.asyncio
+async def test_upload_yields_in_input_order(check_file):
+    filepaths = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']
+    gallery = MockGallery(delays={'a.jpg': 0.04, 'b.jpg': 0.01, 'c.jpg': 0.03, 'd.jpg': 0})
+    subs = await collect(_upload.upload(gallery, filepaths, jobs=4, order='input'))
+    assert [sub.filepath for sub in subs] == filepaths
+    assert gallery.uploaded == ['d.jpg', 'b.jpg', 'c.jpg', 'a.jpg']
+
+@pytest.mark.asyncio
+async def test_upload_yields_in_completion_order(check_file):
+    filepaths = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']
+    gallery = MockGallery(delays={'a.jpg': 0.04, 'b.jpg': 0.01, 'c.jpg': 0.03, 'd.jpg': 0})
+    subs = await collect(_upload.upload(gallery, filepaths, jobs=4, order='completion'))
+    assert [sub.filepath for sub in subs] == ['d.jpg', 'b.jpg', 'c.jpg', 'a.jpg']
+
+@pytest.mark.asyncio
+async def test_upload_with_invalid_schedule(check_file):
+    with pytest.raises(ValueError, match=r"^Invalid schedule: 'foo'$"):
+        await collect(_upload.upload(MockGallery(), ['a.jpg'], schedule='foo'))
+
+@pytest.mark.parametrize(
+    argnames='schedule, exp_uploaded',
+    argvalues=(
+        ('input', ['b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']),
+        ('smallest-first', ['e.jpg', 'c.jpg', 'd.jpg', 'b.jpg']),
+        ('largest-first', ['b.jpg', 'd.jpg', 'c.jpg', 'e.jpg']),
+    ),
+)
+@pytest.mark.asyncio
+async def test_upload_schedules_files_by_size(schedule, exp_uploaded, check_file):
+    sizes = {'a.jpg': 1, 'b.jpg': 400, 'c.jpg': 200, 'd.jpg': 300, 'e.jpg': 100}
+    check_file.side_effect = lambda filepath, max_size: Mock(st_size=sizes[filepath])
+
+    async def filepaths():
+        # The other files are validated while the first file is uploaded
+        yield 'a.jpg'
+        await asyncio.sleep(0.01)
+        for filepath in list(sizes)[1:]:
+            yield filepath
+
+    gallery = MockGallery(delays={'a.jpg': 0.2})
+    subs = await collect(_upload.upload(gallery, filepaths(), schedule=schedule))
+    assert [sub.filepath for sub in subs] == list(sizes)
+    assert gallery.uploaded == ['a.jpg'] + exp_uploaded
+
+@pytest.mark.asyncio
+async def test_upload_yields_failed_submissions(check_file):
+    subs = await collect(_upload.upload(MockGallery(), ['a.jpg', 'bad.jpg', 'c.jpg'], jobs=2))
+    assert [(sub.filepath, sub.success) for sub in subs] == [
+        ('a.jpg', True),
+        ('bad.jpg', False),
+        ('c.jpg', True),
+    ]
+
+@pytest.mark.asyncio
+async def test_upload_raises_exception_from_worker(check_file):
+    gallery = MockGallery(delays={'b.jpg': 10})
+    with pytest.raises(RuntimeError, match=r'^Unexpected response$'):
+        await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg', 'crash.jpg'], jobs=3))
+    # Remaining uploads are cancelled
+    await asyncio.sleep(0)
+    assert gallery.uploading == 0
+
+@pytest.mark.parametrize('order', ('input', 'completion'))
+@pytest.mark.asyncio
+async def test_upload_yields_finished_submissions_at_deadline(order, check_file):
+    journal = Mock(get=Mock(return_value=None), gallery_tokens={})
+    gallery = MockGallery(delays={'a.jpg': 10, 'c.jpg': 10})
+    deadline = asyncio.get_running_loop().time() + 0.05
+    subs = []
+    with pytest.raises(_upload.DeadlineExceeded, match=r'^Deadline exceeded$'):
+        async for _, sub in _upload.upload(gallery, ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg'],
+                                           jobs=4, order=order, journal=journal,
+                                           deadline=deadline):
+            subs.append(sub)
+    assert sorted(sub.filepath for sub in subs) == ['b.jpg', 'd.jpg']
+    assert journal.add.call_args_list == [call(sub) for sub in subs]
+    # Remaining uploads are cancelled
+    await asyncio.sleep(0)
+    assert gallery.uploading == 0
+
+@pytest.mark.asyncio
+async def test_upload_skips_cached_files(check_file):
+    cached = Submission(filepath='b.jpg', image_url='img/old', thumbnail_url='thumb/old',
+                        web_url='web/old', gallery_url='gallery/old', edit_url='edit/old')
+    cache = Mock(get=AsyncMock(side_effect=lambda fp, g, st: cached if fp == 'b.jpg' else None),
+                 add=AsyncMock())
+    gallery = MockGallery()
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg', 'c.jpg'], cache=cache))
+    assert subs[1] is cached
+    assert gallery.uploaded == ['a.jpg', 'c.jpg']
+    assert cache.get.call_args_list == [
+        call('a.jpg', gallery, check_file.return_value),
+        call('b.jpg', gallery, check_file.return_value),
+        call('c.jpg', gallery, check_file.return_value),
+    ]
+    assert cache.add.call_args_list == [call(subs[0], gallery), call(subs[2], gallery)]
+
+@pytest.mark.asyncio
+async def test_upload_records_submissions_in_journal(check_file):
+    old = Submission(filepath='b.jpg', image_url='img/old', thumbnail_url='thumb/old',
+                     web_url='web/old', gallery_url='gallery/old', edit_url='edit/old')
+    journal = Mock(get=Mock(side_effect=lambda fp: old if fp == 'b.jpg' else None),
+                   gallery_tokens={})
+    gallery = MockGallery(created=False)
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg', 'bad.jpg'], journal=journal))
+    assert subs[1] is old
+    assert gallery.uploaded == ['a.jpg']
+    assert journal.add_gallery.call_args_list == [call(gallery, 0)]
+    assert journal.add.call_args_list == [call(subs[0]), call(subs[2])]
+
+@pytest.mark.asyncio
+async def test_upload_splits_files_into_multiple_galleries(check_file, mocker):
+    shards = [MockGallery(created=False), MockGallery(created=False)]
+    copy = mocker.patch('imgbox._gallery.copy', side_effect=shards)
+    gallery = MockGallery(created=False)
+    filepaths = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']
+    uploads = _upload.upload(gallery, filepaths, jobs=2, max_per_gallery=2)
+    results = [(g, sub.filepath) async for g, sub in uploads]
+    assert results == [
+        (gallery, 'a.jpg'), (gallery, 'b.jpg'),
+        (shards[0], 'c.jpg'), (shards[0], 'd.jpg'),
+        (shards[1], 'e.jpg'),
+    ]
+    assert copy.call_args_list == [call(gallery, number=2), call(gallery, number=3)]
+    for g in (gallery, *shards):
+        assert g.create.call_args_list == [call()]
+    assert gallery.close.call_args_list == []
+    for g in shards:
+        assert g.close.call_args_list == [call()]
+
+@pytest.mark.asyncio
+async def test_upload_closes_each_copy_after_its_last_file(check_file, mocker):
+    shards = [MockGallery(), MockGallery()]
+    mocker.patch('imgbox._gallery.copy', side_effect=shards)
+    uploads = _upload.upload(MockGallery(), ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg'],
+                             max_per_gallery=2)
+    closed = []
+    async for g, sub in uploads:
+        closed.append([sg.close.call_count for sg in shards])
+    assert closed == [[0, 0], [0, 0], [0, 0], [0, 0], [1, 0]]
+    assert [sg.close.call_count for sg in shards] == [1, 1]
+
+@pytest.mark.asyncio
+async def test_upload_many_uploads_to_each_gallery(check_file):
+    galleries = [MockGallery(created=False), MockGallery(created=False)]
+    journal = Mock(get=Mock(return_value=None), gallery_tokens={})
+    items = [(galleries[0], 'a.jpg'), (galleries[1], 'b.jpg'), (galleries[0], 'c.jpg')]
+    uploads = _upload.upload_many(items, jobs=3, journal=journal)
+    results = [(g, sub.filepath) async for g, sub in uploads]
+    assert results == items
+    assert galleries[0].uploaded == ['a.jpg', 'c.jpg']
+    assert galleries[1].uploaded == ['b.jpg']
+    assert journal.add_gallery.call_args_list == [call(galleries[0], 0), call(galleries[1], 1)]
+    for g in galleries:
+        assert g.create.call_args_list == [call()]
+        assert g.close.call_args_list == []
+
+@pytest.mark.asyncio
+async def test_upload_many_forgets_finished_galleries(check_file):
+    refs = []
+
+    def items():
+        for i in range(3):
+            g = MockGallery()
+            refs.append(weakref.ref(g))
+            yield g, f'{i}.jpg'
+
+    uploads = _upload.upload_many(items())
+    assert (await uploads.__anext__())[1].filepath == '0.jpg'
+    assert (await uploads.__anext__())[1].filepath == '1.jpg'
+    gc.collect()
+    assert refs[0]() is None
+    assert refs[2]() is not None
+    await collect(uploads)
+
+@pytest.mark.asyncio
+async def test_upload_reopens_galleries_from_journal(check_file, mocker):
+    shard = MockGallery(created=False)
+    mocker.patch('imgbox._gallery.copy', return_value=shard)
+    reopen = mocker.patch('imgbox._gallery.reopen', AsyncMock())
+    journal = Mock(get=Mock(return_value=None), gallery_tokens={1: {'token_id': 123}})
+    gallery = MockGallery(created=False)
+    await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg'], journal=journal, max_per_gallery=1))
+    assert gallery.create.call_args_list == [call()]
+    assert shard.create.call_args_list == []
+    assert reopen.call_args_list == [call(shard, {'token_id': 123})]
+    # Reopening doesn't have to wait for creation
+    assert sorted(journal.add_gallery.call_args_list, key=lambda c: c.args[1]) == [
+        call(gallery, 0), call(shard, 1),
+    ]
+
+@pytest.mark.asyncio
+async def test_upload_uploads_preprocessed_files(check_file, tmp_path):
+    processed_filepath = str(tmp_path / 'c.jpg')
+    with open(processed_filepath, 'wb') as f:
+        f.write(b'data')
+
+    def process(filepath, st):
+        if filepath == 'b.jpg':
+            raise AssertionError('Invalid image')
+        elif filepath == 'c.jpg':
+            return processed_filepath
+        return filepath
+
+    preprocessor = Mock(fit=True, process=AsyncMock(side_effect=process))
+    gallery = MockGallery()
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg', 'c.jpg'],
+                                        preprocessor=preprocessor))
+    assert gallery.uploaded == ['a.jpg', processed_filepath]
+    assert [sub.filepath for sub in subs] == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert subs[1] == Submission(filepath='b.jpg', error='Invalid image')
+    assert subs[2].image_url == f'img/{processed_filepath}'
+    assert preprocessor.release.call_args_list == [call(processed_filepath)]
+    assert [c[0][1] for c in check_file.call_args_list] == [None, None, None]
+
+@pytest.mark.asyncio
+async def test_upload_uploads_links_to_files_with_invalid_names(tmp_path):
+    good = str(tmp_path / 'good.jpg')
+    bad = os.path.join(str(tmp_path), os.fsdecode(b'b\xffd.jpg'))
+    for filepath in (good, bad):
+        with open(filepath, 'wb') as f:
+            f.write(b'data')
+
+    links = []
+
+    class Gallery(MockGallery):
+        async def upload(self, filepath):
+            if filepath != good:
+                links.append((filepath, os.readlink(filepath)))
+            return await super().upload(filepath)
+
+    gallery = Gallery()
+    subs = await collect(_upload.upload(gallery, [good, bad]))
+    assert [(sub.filepath, sub.success) for sub in subs] == [(good, True), (bad, True)]
+    assert len(links) == 1
+    link, target = links[0]
+    assert os.path.basename(link) == 'b\ufffdd.jpg'
+    assert target == bad
+    assert gallery.uploaded == [good, link]
+    # The link and its directories are removed
+    assert not os.path.exists(os.path.dirname(os.path.dirname(link)))
+
+@pytest.mark.asyncio
+async def test_upload_uses_size_of_preprocessed_files(check_file, tmp_path):
+    sizes = {'a.jpg': 1, 'b.jpg': 100, 'c.jpg': 20, 'd.jpg': 25}
+    check_file.side_effect = lambda filepath, max_size: Mock(st_size=sizes[filepath])
+    processed_sizes = {'b.jpg': 10, 'c.jpg': 30}
+
+    def process(filepath, st):
+        if filepath in processed_sizes:
+            processed_filepath = str(tmp_path / filepath)
+            with open(processed_filepath, 'wb') as f:
+                f.write(b'x' * processed_sizes[filepath])
+            return processed_filepath
+        return filepath
+
+    async def filepaths():
+        # The other files are processed while the first file is uploaded
+        yield 'a.jpg'
+        await asyncio.sleep(0.01)
+        for filepath in list(sizes)[1:]:
+            yield filepath
+
+    preprocessor = Mock(fit=False, process=AsyncMock(side_effect=process))
+    progress = MagicMock()
+    gallery = MockGallery(delays={'a.jpg': 0.2})
+    await collect(_upload.upload(gallery, filepaths(), schedule='smallest-first',
+                                 preprocessor=preprocessor, progress=progress))
+    assert gallery.uploaded == ['a.jpg', str(tmp_path / 'b.jpg'), 'd.jpg', str(tmp_path / 'c.jpg')]
+    assert sorted(c[0][0] for c in progress.add_bytes.call_args_list) == [1, 10, 25, 30]
+    assert progress.uploading.call_args_list == [call(1), call(10), call(25), call(30)]
+
+@pytest.mark.asyncio
+async def test_upload_repeats_failed_requests_with_retry(check_file):
+    async def upload(gallery, filepath):
+        return await gallery.upload(filepath)
+
+    retry = Mock(create=AsyncMock(), upload=Mock(side_effect=upload))
+    gallery = MockGallery(created=False)
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg'], retry=retry))
+    assert [sub.filepath for sub in subs] == ['a.jpg', 'b.jpg']
+    assert retry.create.call_args_list == [call(gallery)]
+    assert gallery.create.call_args_list == []
+    assert retry.upload.call_args_list == [call(gallery, 'a.jpg'), call(gallery, 'b.jpg')]
+
+@pytest.mark.asyncio
+async def test_upload_records_phases_with_tracer(check_file):
+    tracer = _trace.Tracer()
+    gallery = MockGallery(created=False)
+    await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg'], tracer=tracer))
+    spans = [(e['cat'], e['name'], e['id']) for e in tracer.events if e['ph'] == 'b']
+    assert sorted(spans) == [
+        ('file', 'upload', '0'), ('file', 'upload', '1'),
+        ('file', 'validate', '0'), ('file', 'validate', '1'),
+        ('file', 'wait for gallery', '0'), ('file', 'wait for gallery', '1'),
+        ('file', 'wait for preparation', '0'), ('file', 'wait for preparation', '1'),
+        ('gallery', 'create', '0'),
+    ]
+
+@pytest.mark.asyncio
+async def test_upload_counts_progress(check_file):
+    def check_file_(filepath, max_size):
+        if filepath == 'b.jpg':
+            raise AssertionError('No such file')
+        return Mock(st_size=100)
+
+    check_file.side_effect = check_file_
+    progress = MagicMock()
+    gallery = MockGallery()
+    await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg', 'c.jpg'], progress=progress))
+    assert progress.watch.call_args_list == [call(gallery)]
+    assert progress.add_file.call_count == 3
+    assert progress.add_bytes.call_args_list == [call(100), call(100)]
+    assert progress.uploading.call_args_list == [call(100), call(100)]
+    assert progress.finish_input.call_args_list == [call()]
+    assert progress.finish_file.call_count == 3
+
+@pytest.mark.asyncio
+async def test_upload_does_not_upload_bad_files(check_file):
+    def check_file_(filepath, max_size):
+        if filepath == 'b.jpg':
+            raise AssertionError('No such file')
+        return Mock(st_size=123)
+
+    check_file.side_effect = check_file_
+    gallery = MockGallery()
+    subs = await collect(_upload.upload(gallery, ['a.jpg', 'b.jpg', 'c.jpg']))
+    assert subs[1] == Submission(filepath='b.jpg', error='No such file')
+    assert gallery.uploaded == ['a.jpg', 'c.jpg']
+
+@pytest.mark.asyncio
+async def test_upload_validates_files_ahead_of_uploads(check_file):
+    filepaths = [f'{i}.jpg' for i in range(10)]
+    gallery = MockGallery(delays={fp: 0.01 for fp in filepaths})
+    uploads = _upload.upload(gallery, filepaths, jobs=1)
+    assert (await uploads.__anext__())[1].filepath == '0.jpg'
+    assert check_file.call_count == 10
+    await collect(uploads)
+
+@pytest.mark.asyncio
+async def test_upload_starts_before_asynchronous_iterable_is_exhausted(check_file):
+    more_files = asyncio.Event()
+
+    async def filepaths():
+        yield 'a.jpg'
+        await more_files.wait()
+        yield 'b.jpg'
+
+    gallery = MockGallery()
+    uploads = _upload.upload(gallery, filepaths(), jobs=2)
+    assert (await uploads.__anext__())[1].filepath == 'a.jpg'
+    more_files.set()
+    assert [sub.filepath for sub in await collect(uploads)] == ['b.jpg']
+
+@pytest.mark.asyncio
+async def test_upload_raises_exception_from_asynchronous_iterable(check_file):
+    async def filepaths():
+        yield 'a.jpg'
+        raise OSError('Read error')
+
+    with pytest.raises(OSError, match=r'^Read error$'):
+        await collect(_upload.upload(MockGallery(), filepaths(), jobs=2))
+
+@pytest.mark.asyncio
+async def test_upload_limits_submissions_waiting_for_slow_upload(check_file, mocker):
+    mocker.patch('imgbox._upload._REORDER_AHEAD', 5)
+    mocker.patch('imgbox._upload._VALIDATE_AHEAD', 2)
+    read = []
+
+    def filepaths():
+        for i in range(100):
+            read.append(i)
+            yield f'{i}.jpg'
+
+    gallery = MockGallery(delays={'0.jpg': 0.1})
+    uploads = _upload.upload(gallery, filepaths(), jobs=2)
+    assert (await uploads.__anext__())[1].filepath == '0.jpg'
+    # 5 finished submissions + 2 uploads + 2 validated files + 1 file that
+    # waits for a slot
+    assert len(read) == 10
+    assert [sub.filepath for sub in await collect(uploads)] == [f'{i}.jpg' for i in range(1, 100)]